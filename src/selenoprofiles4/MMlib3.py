@@ -4,10 +4,23 @@ import sys
 from functools import cmp_to_key
 from string import *
 import subprocess
+import shutil
+import glob
+import errno
+import time
 import io
+import hashlib
+import mmap
+import fcntl
+import gzip
+import zlib
+import struct
+import bisect
+import json
 try:      import pickle as pickle
 except:   import pickle
 from copy import copy, deepcopy
+from itertools import repeat
 from math import log as math_log, sqrt
 import random
 NUMBERS='0123456789'  
@@ -129,6 +142,84 @@ def bash_pipe(cmnd, print_it=0, return_popen=0, stdin=None):
   if return_popen: return s
   else:    return s.stdout
 
+def run_tool(argv, stdout_file=None, append=False, env=None, timeout=None, print_it=0, cwd=None):
+  """ Utility to run a single external program given as a list of arguments (argv), without spawning a shell. If stdout_file is provided, the standard output is written to that file (appending to it if append==True), otherwise it is captured.
+  The program is run in folder cwd, if provided. The standard error is always captured. Returns a list [exit_status, stdout, stderr] analogous to function bash, where stdout is '' if stdout_file was provided. If the program is killed by a signal, exit_status is minus the signal number; if it is not found, exit_status is 127 as in bash.
+  If the program does not end within timeout seconds, it is killed and an exception is raised. If argument print_it==1 or the variable print_commands is defined in MMlib, the command is printed before execution. If variable bin_folder is defined in MMlib, this folder is added to $PATH."""
+  argv=[str(a) for a in argv]
+  if 'print_commands' in globals() and print_commands: print_it=1
+  if print_it:    write(join(argv, ' ')+{True:'', False:' > '+str(stdout_file)}[stdout_file is None], 1)
+  if 'bin_folder' in globals(): 
+    if not bin_folder  == os.environ['PATH'].split(':')[0]:      os.environ['PATH']=str(bin_folder)+':'+os.environ['PATH']
+  if stdout_file is None:    out_fh=subprocess.PIPE
+  else:                      out_fh=open(stdout_file, {True:'a', False:'w'}[bool(append)])
+  try:
+    try:      process=subprocess.run(argv, stdout=out_fh, stderr=subprocess.PIPE, env=env, cwd=cwd, timeout=timeout)
+    except FileNotFoundError:      return [127, '', argv[0]+': command not found']
+    except subprocess.TimeoutExpired:
+      raise Exception('COMMAND: '+join(argv, ' ')+' ERROR: "killed after timeout of '+str(timeout)+' seconds"')
+  finally:
+    if not stdout_file is None: out_fh.close()
+  if process.stdout is None:  stdout=''
+  else:                       stdout=process.stdout.decode(errors='replace').rstrip('\n')
+  return [process.returncode, stdout, process.stderr.decode(errors='replace').rstrip('\n')]
+
+def brun_tool(argv, stdout_file=None, append=False, env=None, timeout=None, print_it=0, dont_die=0, cwd=None):
+  """ Utility to run a single external program given as a list of arguments (argv), without spawning a shell (see run_tool). Its stdout is returned (empty if stdout_file is provided). If the exit status is different than 0, an exception is raised indicating the command and its stderr, unless dont_die==1 (analogous to function bbash) """
+  b=run_tool(argv, stdout_file=stdout_file, append=append, env=env, timeout=timeout, print_it=print_it, cwd=cwd)
+  if b[0]!=0 and not dont_die:     raise Exception('COMMAND: ' + join([str(a) for a in argv], ' ')+' ERROR: "'+b[2]+' "')
+  return b[1]
+
+def date_string():
+  """ Returns the current date and time, formatted as by unix command date """
+  return time.strftime('%a %b %e %H:%M:%S %Z %Y')
+
+### registry of external programs: each is looked up in $PATH only once, then its path (and version) is reused by all modules
+tool_registry={}    # program name -> hash with keys 'path' (dereferenced executable, or None if not found), 'version' (None if not probed) and 'seconds' (time spent to resolve it)
+tool_version_arguments={'exonerate':['--version'], 'genewise':['-version'], 'gawk':['--version']}
+
+def resolve_tools(names, versions=True):
+  """ Look up the executables of the programs in names in $PATH, dereferencing symbolic links, and store them in tool_registry. Programs already resolved are skipped. If versions==True, the version of the programs listed in tool_version_arguments is also probed (see tool_version).
+  If variable bin_folder is defined in MMlib, this folder is added to $PATH. Returns the list of programs that were not found. """
+  if 'bin_folder' in globals():
+    if not bin_folder  == os.environ['PATH'].split(':')[0]:      os.environ['PATH']=str(bin_folder)+':'+os.environ['PATH']
+  for name in names:
+    if name in tool_registry: continue
+    start_time=time.time()
+    path=shutil.which(name)
+    if path: path=dereference(path)
+    tool_registry[name]={'path':path, 'version':None, 'seconds':time.time()-start_time}
+  if versions:
+    for name in names:      tool_version(name)
+  return [name for name in names if not tool_registry[name]['path']]
+
+def tool_path(name, error_message='', exception_raised=Exception):
+  """ Returns the dereferenced path of the executable of a program, resolving it on first use (see resolve_tools). If not found, an exception of class exception_raised is raised with error_message (or a default message) """
+  if resolve_tools([name], versions=False):
+    raise exception_raised(error_message if error_message else 'ERROR '+name+' not found! Please install it')
+  return tool_registry[name]['path']
+
+def tool_version(name):
+  """ Returns the first line printed by a program when run with its arguments in tool_version_arguments. This is computed only once, then cached in tool_registry. Returns None if the program is not found, or if its version cannot be probed """
+  resolve_tools([name], versions=False)
+  entry=tool_registry[name]
+  if entry['version'] is None and entry['path'] and name in tool_version_arguments:
+    start_time=time.time()
+    b=run_tool([entry['path']]+tool_version_arguments[name])
+    output=(b[1]+'\n'+b[2]).strip()
+    entry['version']=output.split('\n')[0].strip() if output else ''
+    entry['seconds']+=time.time()-start_time
+  return entry['version']
+
+def tool_registry_report():
+  """ Returns a text summarizing tool_registry: path and version of each program resolved, and the time spent to resolve them """
+  lines=[]
+  for name in sorted(tool_registry):
+    entry=tool_registry[name]
+    lines.append( name.ljust(14)+' '+str(entry['path'] if entry['path'] else 'NOT FOUND').ljust(55)+' '+'{:7.1f} ms'.format(entry['seconds']*1000) + {True:'   '+str(entry['version']), False:''}[bool(entry['version'])] )
+  lines.append( 'Total time to resolve programs: {:.1f} ms'.format( sum([tool_registry[name]['seconds'] for name in tool_registry])*1000 ) )
+  return join(lines, '\n')
+
 def md5_executable():
   b=bash('echo | md5sum')
   if not b[0]: return 'md5sum'  ## command found, no error
@@ -590,40 +681,73 @@ def get_genetic_code_table(code=None):
   if code is None:   code=get_genetic_code()
   return genetic_codes[code]
 
+### sequence kernels: translation and codon scanning through precomputed tables, avoiding character by character loops in python
+codons_regexp=re.compile('.{1,3}', re.S)   # splits a sequence in codons, the last one possibly incomplete
+codon_tables={}    # (code, include_selenocysteine, gaps_to) -> dictionary codon->aminoacid
+def get_codon_table(code=None, include_selenocysteine=False, gaps_to=None):
+  """ Returns the dictionary codon->aminoacid used by transl for these arguments (see transl); tables are built once and cached """
+  if code is None: code=default_genetic_code
+  key=(code, bool(include_selenocysteine), gaps_to)
+  if not key in codon_tables:
+    codon_table=dict(genetic_codes[code])
+    if include_selenocysteine:    codon_table['TGA']='U'
+    if gaps_to:                   codon_table['---']=gaps_to
+    codon_tables[key]=codon_table
+  return codon_tables[key]
+
+def stop_codons_of_code(code=None):
+  """ Returns the set of (DNA, uppercase) stop codons in this genetic code (default: the one set with set_genetic_code) """
+  return set([codon for codon, aa in get_codon_table(code).items() if aa=='*'])
+
+def split_codons(seq):
+  """ Returns the list of codons in seq, in frame from its first position; the last one may be incomplete """
+  return codons_regexp.findall(seq)
+
+def char_positions(seq, chars):
+  """ Returns the list of 0-based positions in seq of any of the characters in chars """
+  return [m.start() for m in re.finditer('['+re.escape(chars)+']', seq)]
+
+codon_scan_regexps={}   # (stops, allowed_letters) -> compiled regexp
+def codon_scan(seq, start, stops, allowed_letters='ACGT', reverse=False):
+  """ Scans seq in frame codon by codon, starting at position start (0-based), until it finds a codon in stops, a codon with characters not in allowed_letters, or the end of the sequence. The scan is done by the regexp engine in a single call.
+  If reverse is True, the scan goes upstream instead: codons are seq[start-3:start], seq[start-6:start-3] and so on.
+  Returns [n_codons, stop_reason], where n_codons is the number of codons passed before stopping, and stop_reason is 'stop' (the next codon is in stops), 'invalid' (the next codon has other characters) or 'end' (the sequence ended, possibly with an incomplete codon) """
+  scanned_stops=stops
+  if reverse:
+    seq=seq[:start][::-1]
+    scanned_stops=set([codon[::-1] for codon in stops])
+    start=0
+  key=(tuple(sorted(scanned_stops)), allowed_letters)
+  if not key in codon_scan_regexps:
+    codon_scan_regexps[key]=re.compile( ('(?:(?!'+join([re.escape(codon) for codon in key[0]], '|')+')' if key[0] else '(?:')+'['+re.escape(allowed_letters)+']{3})*' )
+  scan_end=codon_scan_regexps[key].match(seq, start).end()
+  next_codon=seq[scan_end:scan_end+3]
+  if reverse:      next_codon=next_codon[::-1]
+  if len(next_codon)==3 and next_codon in stops:                          stop_reason='stop'
+  elif len(next_codon)<3 and all([c in allowed_letters for c in next_codon]):  stop_reason='end'
+  else:                                                                   stop_reason='invalid'
+  return [(scan_end-start)//3, stop_reason]
+
 def transl(cds_seq, include_selenocysteine=False, gaps_to=None, code=None):
   '''translate a nucleotide sequence in aminoacids.
   Use code=X to give a integer identifying the genetic code to be used, as NCBI codes (see https://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi)
   Use include_selenocysteine=1 to use U for TGA or UGA
   Use gaps_to to force a certain char for gaps codons (---); normally translated as -
   '''
-  if code is None: code=default_genetic_code
-  out=''
-  i=0
-  codon_table=genetic_codes[code]
-  while i < len(cds_seq):
-    codon= replace_chars(upper(cds_seq[i:i+3]), 'U', 'T')
-    if include_selenocysteine and codon=='TGA':      out+='U' 
-    elif gaps_to and codon=='---':                   out+=gaps_to
-    elif codon in codon_table:                 out+=codon_table[codon]
-    else:                                            out+='X'
-    i+=3
-  return out
+  codon_table=get_codon_table(code, include_selenocysteine, gaps_to)
+  return join(map(codon_table.get, split_codons(cds_seq.upper().replace('U', 'T')), repeat('X')), '')
 
+retrotrans_first_codon={}    # retrotrans with only the first codon in alphabetical order for each aminoacid
 def retrotransl(aa_seq, gaps_to='', codon_hash={}):
   """translate an aminoacid sequence back to coding sequence. The first codon in alphabetical order is considered, unless a different codon_hash is provided. Argument gaps_to can be used to provide the character for gaps. Notice that a three character argument should be provided"""
-  if not codon_hash: codon_hash=retrotrans
-  out=''
   if len(gaps_to)==1: gaps_to*=3
   if gaps_to and len(gaps_to)!=3: raise Exception("retrotransl ERROR gaps_to should be a string with length 3 or 1! gaps_to="+str(gaps_to))
-  for aa in aa_seq:
-    aa=upper(aa)
-    if gaps_to and aa=='-':          out+=gaps_to
-    elif aa in codon_hash:     
-      codon=codon_hash[aa]
-      if type(codon)==list: codon=codon[0] #taking first in alphabetical order
-      out+=codon
-    else: out+='NNN'
-  return out
+  if not codon_hash:
+    if not retrotrans_first_codon:   retrotrans_first_codon.update({aa:(codon[0] if type(codon)==list else codon) for aa, codon in retrotrans.items()})
+    codon_of=retrotrans_first_codon
+  else:    codon_of={aa:(codon[0] if type(codon)==list else codon) for aa, codon in codon_hash.items()}  #taking first in alphabetical order
+  if gaps_to:    codon_of=dict(codon_of, **{'-':gaps_to})
+  return join(map(codon_of.get, aa_seq.upper(), repeat('NNN')), '')
 
 class e_v:
   """  Class for coping with evalues without going crazy because of out of memory
@@ -816,8 +940,13 @@ def float_generalized(stringg):
   except ValueError:
     if stringg[0]=='e':
       return float('1'+stringg)
+replace_chars_tables={}   # (characters, replacement) -> table for str.translate, see replace_chars
 def replace_chars(astring, chars_list, replace_to_this=''):
-  return ''.join([c if not c in chars_list else  replace_to_this      for c in astring])
+  """ Returns astring with every character found in chars_list (any iterable of characters) replaced by replace_to_this. Translation tables are cached, so the string is processed in a single pass by str.translate """
+  table_key=(join(sorted(set([c for c in chars_list if len(c)==1])), ''), replace_to_this)
+  if not table_key in replace_chars_tables:
+    replace_chars_tables[table_key]=str.maketrans(dict.fromkeys(table_key[0], replace_to_this))
+  return astring.translate(replace_chars_tables[table_key])
   # out=''
   # for c in astring:
   #   if not c in chars_list:
@@ -3023,32 +3152,14 @@ def remove_items_from_list_with_indexes(alist, index_list, inplace=False, index_
 
 
 def getfastalite(cfile,order=1):
-  line=cfile.readline()
-  seq=''
+  """ Reads all sequences from a fasta filehandler (see read_fasta), removing any # character. If order==1 it returns a list [ [title1, seq1], [title2, seq2] ... ], otherwise a dictionary { title: seq }. Sequences with no residues are skipped """
   ord_list=[]    #[ [title1, seq1], [title2, seq2] ... ]
   diz={}      #{ title: seq   }
-  while line:
-    if line[0]=='>':
-      if seq:    #not first line
-#        print [title]
-        if order==1:
-          ord_list.append(  [title, seq]   )
-        else:
-          diz[title]=seq
-
-      title=del_white(replace(line[1:], '\n', ''))
-      seq=''
-    else:
-      seq+=replace( replace(line, '\n', ''), '#', '')
-
-    line=cfile.readline()
-
-  if order==1 and seq:
-    ord_list.append(  [title, seq]   )
-
-  elif seq:
-    diz[title]=seq  
-
+  for title, seq in read_fasta(cfile, remove_chars='\n\r#'):
+    if not seq: continue
+    title=del_white(title)
+    if order==1:      ord_list.append(  [title, seq]   )
+    else:             diz[title]=seq
   if order==1:
     return ord_list
   else:
@@ -3148,12 +3259,10 @@ def getfasta(text, order=1):
     return seq    
 
 reverse_complement_diz={'A':'T', 'T':'A','G':'C','C':'G',  'N':'N', 'X':'X',   'a':'t', 't':'a','g':'c','c':'g',}
+reverse_complement_table=str.maketrans(reverse_complement_diz)
 def reverse_complement(seq):
-  out=''
-  for i in range(len(seq)):
-    if seq[len(seq)-1-i] in reverse_complement_diz:      out+=reverse_complement_diz[seq[len(seq)-1-i]   ]
-    else:                                                         out+=seq[len(seq)-1-i]  
-  return out
+  """ Returns the reverse complement of a nucleotide sequence. Characters other than ACGTNX (upper or lower case) are kept as they are"""
+  return seq.translate(reverse_complement_table)[::-1]
 
 def smith_waterman(seq1, seq2, gap_open=-4, gap_extension=-2, matrix={}, pssm=[]):
   """ This function computes the smith water alignment (local) between the two sequences in input, using the given gap_open and gap_extension parameters. The matrix used can be provided as an argument, or blosum62 called with blosum(a, b[, matrix]) is used. Alternatively, the pssm argument can be provided. This must be a list of hash with scores for each aminoacid.
@@ -3257,6 +3366,51 @@ def correct_sequence(seq1, seq2, special_chars=['U']):
         else: raise Exception("correct_sequence ERROR the sequences are different not only for special characters: "+seq1+'  !=  '+seq2) 
   return seq1
 
+############ file operations: these are run in process, without spawning any shell or program
+def move_file(source, destination):
+  """ Move file source to destination (like mv), replacing destination if it exists. If destination is a folder, the file is moved inside it.
+  The rename is atomic when source and destination are in the same filesystem; otherwise, the file is copied next to destination and then renamed, so that a partial destination file is never visible to other processes """
+  if is_directory(destination): destination=Folder(destination)+base_filename(source)
+  try:      os.replace(source, destination)
+  except OSError as e:
+    if e.errno!=errno.EXDEV: raise
+    temp_destination=destination+'.moving'+str(os.getpid())
+    shutil.copyfile(source, temp_destination)
+    os.replace(temp_destination, destination)
+    os.remove(source)
+
+def copy_file(source, destination):
+  """ Copy file source to destination (like cp), replacing destination if it exists. The copy is written next to destination and then renamed, so that a partial destination file is never visible to other processes """
+  if is_directory(destination): destination=Folder(destination)+base_filename(source)
+  temp_destination=destination+'.copying'+str(os.getpid())
+  shutil.copyfile(source, temp_destination)
+  os.replace(temp_destination, destination)
+
+def append_file(source, destination):
+  """ Append the content of file source to file destination, which is created if it does not exist (like cat source >> destination) """
+  with open(source, 'rb') as in_fh, open(destination, 'ab') as out_fh:     shutil.copyfileobj(in_fh, out_fh)
+
+def matching_files(pattern):
+  """ Returns the sorted list of paths matching a glob pattern (like ls pattern); empty if none is found """
+  return sorted(glob.glob(pattern))
+
+def remove_files(pattern, recursive=False):
+  """ Remove the file or the files matching a glob pattern (like rm). Folders are removed with all their content only if recursive==True (like rm -r), otherwise an exception is raised. Files not found are ignored.
+  Returns the number of files or folders removed """
+  if os.path.lexists(pattern):    paths=[pattern]     # names containing glob special characters, like [ ]
+  else:                           paths=glob.glob(pattern)
+  for path in paths:
+    if is_directory(path) and not os.path.islink(path):
+      if not recursive: raise Exception('remove_files ERROR cannot remove '+path+' : it is a folder')
+      shutil.rmtree(path)
+    else:       os.remove(path)
+  return len(paths)
+
+def link_file(source, link_name):
+  """ Create a symbolic link link_name pointing to source, replacing link_name if it exists (like ln -fs) """
+  if os.path.lexists(link_name):    os.remove(link_name)
+  os.symlink(source, link_name)
+
 def dereference(filename):
   """ This function returns the absolute path of the destination of a symbolic link (if a symbolic link is linked to another symbolic link, it goes all the way to the last file) .
   If the file provided is not a symbolic link, its absolute path is simply returned. If it does not exists, an exception is raised.
@@ -3264,14 +3418,12 @@ def dereference(filename):
   if not is_file(filename):
     raise Exception("dereference ERROR file: "+filename+' was not found ')
   filename=abspath(filename)
-  out_ls=bbash('ls -l "'+filename+'"')
-  while out_ls.split()[-2]=='->':
-    destination=  out_ls.split()[-1]
+  while os.path.islink(filename):
+    destination=  os.readlink(filename)
     if destination[0]!='/':
       filename=directory_name(filename)+'/'+destination
     else:
       filename=destination
-    out_ls=bbash('ls -l '+filename)    
   return filename  
 
 def fileid_for_temp_folder(filename):
@@ -3293,7 +3445,7 @@ def fastaindex(target_genome, silent=0, force=0):
   bbash(cmnd)
   try:        
     test_writeable_folder( directory_name(index_file) )
-    bash('mv '+temp_index_file+' '+index_file)
+    move_file(temp_index_file, index_file)
     return index_file
   except:         return temp_index_file
   
@@ -3302,63 +3454,645 @@ def formatdb(target_file, is_protein=False, silent=0):
   if not silent:    printerr("attempting to format database: "+target_file+" (will crash if you don't have permissions) ", 1 )
   test_writeable_folder(temp_folder, 'temp_folder'); test_writeable_folder( directory_name(target_file)  )
   temp_folder_for_formatting= temp_folder+'formatting_database'
-  bbash('mkdir '+temp_folder_for_formatting+' && cd '+temp_folder_for_formatting+' && ln -s '+abspath(target_file)+' .  &&  formatdb -i '+base_filename(target_file)+' -o T -p '+{False:'F', True:'T'}[bool(is_protein)]+' && mv '+base_filename(target_file)+'.* '+directory_name(abspath(target_file)))
-
-def fastafetch(split_folder, chromosome, target_genome, verbose=0, chars_not_allowed=[':']):
-  """fecthing chromosome routine. File are fetched to a file named after the fasta title. chars_not_allowed is an iterable with characters which cannot appear in the output filename  """
-  target_genome=abspath(target_genome)
-  species_subfolder=Folder(split_folder+replace_chars(target_genome, '/', '_')) 
+  os.mkdir(temp_folder_for_formatting)
+  if is_gzip_file(target_file):     decompress_file(target_file, temp_folder_for_formatting+'/'+base_filename(target_file))   # compressed targets are decompressed only for formatdb
+  else:                             link_file(abspath(target_file), temp_folder_for_formatting+'/'+base_filename(target_file))
+  brun_tool(['formatdb', '-i', base_filename(target_file), '-o', 'T', '-p', {False:'F', True:'T'}[bool(is_protein)]], cwd=temp_folder_for_formatting)
+  for formatted_file in matching_files(temp_folder_for_formatting+'/'+base_filename(target_file)+'.*'):
+    move_file(formatted_file, directory_name(abspath(target_file)))
+  remove_files(temp_folder_for_formatting, recursive=True)
+
+def fastafetch_filename(split_folder, chromosome, target_genome, chars_not_allowed=[':']):
+  """ Returns the path of the file where fastafetch stores this chromosome of target_genome (inside the chromosome cache of split_folder, see get_chromosome_cache). chars_not_allowed is an iterable with characters which cannot appear in the output filename """
+  species_subfolder=Folder(get_chromosome_cache(split_folder).folder+replace_chars(abspath(target_genome), '/', '_')) 
   final_filename=species_subfolder+chromosome
-  
   for char in chars_not_allowed:
     if char in final_filename: final_filename=  replace_chars( final_filename , char, '{Ch'+str(ord(char))+'}')
-  
-  temp_filename=temp_folder+'fetching_chromosome.fa'
-  if is_file(final_filename):    'file already there'
+  return final_filename
+
+def fastafetch(split_folder, chromosome, target_genome, verbose=0, chars_not_allowed=[':']):
+  """fecthing chromosome routine. File are fetched to a file named after the fasta title. chars_not_allowed is an iterable with characters which cannot appear in the output filename. 
+  The chromosome is read from the target_genome through its .seqinfo index (see indexed_fasta), without running external programs. Files fetched are kept in the chromosome cache of split_folder, which has a maximum size (see chromosome_cache) """
+  target_genome=abspath(target_genome)
+  final_filename=fastafetch_filename(split_folder, chromosome, target_genome, chars_not_allowed)
+  cache=get_chromosome_cache(split_folder)
+  if is_file(final_filename):    cache.touch(final_filename)
   else:  
-    #printerr('*** '+fastaindex(target_genome), 1)
-    cmnd='fastafetch '+target_genome+' '+fastaindex(target_genome)+' "' +chromosome +'" > "'+  temp_filename+'"' 
     service( '  ...fetching chromosome: '+chromosome )
-#    debug(cmnd)
-    b=bash(cmnd, verbose)
-    if b[0]==256 and "Could not open fasta index" in b[1]:      #db not indexed? i'll do it!
-      fastaindex(target_genome)
-      bbash(cmnd, verbose)  #trying again to fetch the chromosome after indexing the db
-    elif b[0]==256 and "Could not find identifier" in b[1] and "|" in chromosome: #trying adding a pipe symbol in the end. This is because blast sometimes removes that.
-      cmnd='fastafetch '+target_genome+' '+fastaindex(target_genome)+' "' +chromosome +'|" > "'+  temp_filename+'"' 
-      b=bash(cmnd, verbose)
-    elif b[0]==256 and '_' in chromosome and  is_number( chromosome.split('_')[0], True):  ##SOME BLASTOUT DONT HAVE >GI BUT ARE LIKE >N_fastafilename. THIS IS FOR THEM. 
-      nseq_index=chromosome.split('_')[0]
-      #chromosome=nseq_index
-      service( '  ...using as index of sequence the number in blast output:  '+nseq_index +' from header: '+chromosome )
-      cmnd='get_sequence_numberN.g -v NSEQ='+nseq_index+' '+target_genome+'  > '+  temp_filename
-      #debug(cmnd)
-      bbash(cmnd, verbose)  
-    #checking if there is sequence in temp_folder+'tchrom' 
-    if bbash('head -n2 "'+  temp_filename+'"')=='':      raise Exception('ERROR fetching chromosome; command_line: '+cmnd)
-    bbash('mv '+temp_filename+' "'+final_filename+'"' )
+    temp_filename=temp_folder+'fetching_chromosome.fa'
+    get_genome_reader(target_genome).write_sequence(chromosome, temp_filename)
+    move_file(temp_filename, final_filename)
+    cache.add(final_filename)
   return  final_filename ######## NB different from the function in profiles_classes
 
+class file_lock(object):
+  """ Exclusive advisory lock (fcntl) on lock_file, to be used as context manager:  with file_lock(lock_file):  ...
+  Processes waiting for the lock sleep in the kernel and are woken up as soon as it is released, without polling. The lock is released by the operating system when its holder terminates, also if it crashes, so it never becomes stale: the lock file itself is left in place and reused.
+  The holder writes its host and pid in the lock file; if wait_message is provided, it is printed together with these when the lock must be waited for.
+  """
+  def __init__(self, lock_file, wait_message=''):
+    self.lock_file=lock_file
+    self.wait_message=wait_message
+    self.lock_fh=None
+
+  def __enter__(self):
+    self.lock_fh=open(self.lock_file, 'a+')
+    try:      fcntl.flock(self.lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      if self.wait_message:
+        self.lock_fh.seek(0)
+        holder=self.lock_fh.read().strip()
+        write(self.wait_message+' (lock held by '*bool(holder)+holder+')'*bool(holder), 1)
+      fcntl.flock(self.lock_fh, fcntl.LOCK_EX)
+    self.lock_fh.truncate(0)
+    self.lock_fh.write('host '+os.uname()[1]+' pid '+str(os.getpid())+'\n')
+    self.lock_fh.flush()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    fcntl.flock(self.lock_fh, fcntl.LOCK_UN)
+    self.lock_fh.close()
+    self.lock_fh=None
+
+class file_cache(object):
+  """ Folder of files kept to be reused, limited to max_bytes in total (0: no limit). When this is exceeded, the least recently used files are removed.
+  Files are touched whenever they are used, so that their modification time tells when they were last used, also by other processes: the folder can be shared by concurrent programs on the same host.
+  Removals are serialized through a lock (see file_lock) on a file in the folder. Files used in the last protect_seconds are never removed, since other processes may be about to read them.
+  Files must be added with an atomic rename (e.g. move_file, copy_file), so that other processes never read a partial file. Description is used in messages.
+  """
+  description='cache'
+  def __init__(self, folder, max_bytes=0, protect_seconds=300):
+    self.folder=Folder(folder)
+    self.max_bytes=max_bytes
+    self.protect_seconds=protect_seconds
+    self.total_bytes=None   # estimate of the size of the folder, computed when first needed
+
+  def cached_files(self):
+    """ Returns a list of [last use time, size, path] of all files in the cache """
+    out=[]
+    for dirpath, dirnames, filenames in os.walk(self.folder):
+      for filename in filenames:
+        if filename.startswith('.'): continue
+        try:
+          file_stat=os.stat(dirpath+'/'+filename)
+          out.append( [file_stat.st_mtime, file_stat.st_size, dirpath+'/'+filename] )
+        except FileNotFoundError:   pass   # just removed by another process
+    return out
+
+  def touch(self, filename):
+    """ Marks a cached file as just used """
+    try:     os.utime(filename, None)
+    except FileNotFoundError:  pass
+
+  def add(self, filename):
+    """ Accounts for a file just added to the cache, removing the least recently used ones if the maximum size is exceeded """
+    if not self.max_bytes: return
+    if self.total_bytes is None:    self.total_bytes=sum([size for mtime, size, path in self.cached_files()])
+    else:                           self.total_bytes+=os.path.getsize(filename)
+    if self.total_bytes > self.max_bytes:   self.evict()
+
+  def evict(self):
+    """ Removes the least recently used files until the cache is within its maximum size. The size is computed again, to include files added by other processes """
+    with file_lock(self.folder+'.lock'):
+      cached=sorted(self.cached_files())
+      self.total_bytes=sum([size for mtime, size, path in cached])
+      for mtime, size, path in cached:
+        if self.total_bytes <= self.max_bytes or time.time()-mtime < self.protect_seconds: break
+        try:
+          os.remove(path)
+          service( '  ...removed from '+self.description+': '+path )
+        except FileNotFoundError:   pass
+        self.total_bytes-=size
+
+class chromosome_cache(file_cache):
+  """ Folder with the single-sequence fasta files fetched from targets (see fastafetch); see file_cache """
+  description='chromosome cache'
+
+chromosome_cache_size=0    # maximum size in bytes of the chromosome caches (0: no limit). Set it with set_MMlib_var before fetching
+chromosome_caches={}       # folder -> chromosome_cache object
+def get_chromosome_cache(split_folder):
+  """ Returns the chromosome_cache object in the subfolder "chromosomes" of split_folder, with maximum size chromosome_cache_size """
+  cache_folder=Folder(split_folder)+'chromosomes/'
+  if not cache_folder in chromosome_caches:    chromosome_caches[cache_folder]=chromosome_cache(cache_folder, max_bytes=chromosome_cache_size)
+  return chromosome_caches[cache_folder]
+
+def is_gzip_file(filename):
+  """ Returns True if the file is compressed with gzip (including bgzip), False otherwise """
+  with open(filename, 'rb') as fh:    return fh.read(2)==b'\x1f\x8b'
+
+def is_bgzf_file(filename):
+  """ Returns True if the file is compressed with bgzip (BGZF format: gzip blocks with the BC extra field, that allow random access), False otherwise """
+  with open(filename, 'rb') as fh:    header=fh.read(18)
+  return len(header)==18 and header[:4]==b'\x1f\x8b\x08\x04' and header[12:14]==b'BC'
+
+def decompress_file(gz_file, fileout):
+  """ Writes the decompressed content of a gzip (or bgzip) compressed file to fileout, streaming """
+  with gzip.open(gz_file, 'rb') as in_fh, open(fileout, 'wb') as out_fh:    shutil.copyfileobj(in_fh, out_fh, 4*1024*1024)
+
+class bgzf_file(object):
+  """ Random access to the uncompressed content of a bgzip-compressed file, through its .gzi index (as bgzip -r: number of entries, then the compressed and uncompressed offsets of each block after the first, as little endian uint64), created when not found or older than the file.
+  The compressed file is memory mapped, and only the blocks needed are decompressed; the last max_cached_blocks decompressed are kept in memory.
+  """
+  def __init__(self, filename, max_cached_blocks=64):
+    self.filename=abspath(filename)
+    self.compressed_offsets=[0]      # block index -> offset of block in the compressed file
+    self.uncompressed_offsets=[0]    # block index -> offset of its content in the uncompressed data
+    self.index_file=self.load_index()
+    self.file_h=open(self.filename, 'rb')
+    self.mapped=mmap.mmap(self.file_h.fileno(), 0, access=mmap.ACCESS_READ)
+    self.max_cached_blocks=max_cached_blocks
+    self.cached_blocks={}   # block index -> decompressed data, in order of use
+
+  def load_index(self):
+    """ Loads the .gzi index of the file, building it if necessary. It is written next to the file, or in temp_folder if that is not possible. Returns the path to the index file """
+    index_file=self.filename+'.gzi'
+    temp_index_file=temp_folder+fileid_for_temp_folder(self.filename)+'.gzi'
+    for candidate_file in [index_file, temp_index_file]:
+      if is_file(candidate_file) and os.path.getmtime(candidate_file) >= os.path.getmtime(self.filename):
+        with open(candidate_file, 'rb') as fh:
+          n_entries=struct.unpack('<Q', fh.read(8))[0]
+          offsets=struct.unpack('<'+str(2*n_entries)+'Q', fh.read(16*n_entries))
+        self.compressed_offsets+=list(offsets[0::2])
+        self.uncompressed_offsets+=list(offsets[1::2])
+        return candidate_file
+    self.build_index()
+    n_entries=len(self.compressed_offsets)-1
+    index_data=struct.pack('<Q', n_entries)+struct.pack('<'+str(2*n_entries)+'Q', *[offset for entry in zip(self.compressed_offsets[1:], self.uncompressed_offsets[1:]) for offset in entry])
+    try:
+      with open(index_file+'.'+str(os.getpid()), 'wb') as fh:     fh.write(index_data)
+      move_file(index_file+'.'+str(os.getpid()), index_file)
+      return index_file
+    except OSError:
+      with open(temp_index_file, 'wb') as fh:     fh.write(index_data)
+      return temp_index_file
+
+  def build_index(self):
+    """ Computes the offsets of all blocks, reading only their headers and their uncompressed size (last 4 bytes of each block) """
+    compressed_offset=0;   uncompressed_offset=0
+    file_size=os.path.getsize(self.filename)
+    with open(self.filename, 'rb') as fh:
+      while compressed_offset < file_size:
+        fh.seek(compressed_offset)
+        header=fh.read(18)
+        if len(header)<18 or header[:4]!=b'\x1f\x8b\x08\x04' or header[12:14]!=b'BC':
+          raise Exception("bgzf_file ERROR the file is not compressed with bgzip (BGZF format), or it is corrupted: "+self.filename)
+        block_size=struct.unpack('<H', header[16:18])[0]+1
+        fh.seek(compressed_offset+block_size-4)
+        compressed_offset+=block_size
+        uncompressed_offset+=struct.unpack('<I', fh.read(4))[0]
+        if compressed_offset < file_size:
+          self.compressed_offsets.append(compressed_offset)
+          self.uncompressed_offsets.append(uncompressed_offset)
+
+  def block(self, block_index):
+    """ Returns the decompressed content of a block """
+    if block_index in self.cached_blocks:
+      data=self.cached_blocks.pop(block_index)
+    else:
+      compressed_offset=self.compressed_offsets[block_index]
+      block_size=struct.unpack('<H', self.mapped[compressed_offset+16:compressed_offset+18])[0]+1
+      data=zlib.decompress(self.mapped[compressed_offset+18:compressed_offset+block_size-8], -15)
+      if len(self.cached_blocks) >= self.max_cached_blocks:   del self.cached_blocks[ next(iter(self.cached_blocks)) ]
+    self.cached_blocks[block_index]=data
+    return data
+
+  def read(self, start, end):
+    """ Returns the uncompressed bytes from offset start to end (excluded) """
+    pieces=[];    position=start
+    while position < end:
+      block_index=bisect.bisect_right(self.uncompressed_offsets, position)-1
+      block_start=self.uncompressed_offsets[block_index]
+      piece=self.block(block_index)[position-block_start:end-block_start]
+      if not piece: break    # end of file
+      pieces.append(piece)
+      position+=len(piece)
+    return b''.join(pieces)
+
+class md5_reader(io.RawIOBase):
+  """ Wraps a binary file handler so that all data read through it is added to a md5 checksum (self.md5). Use it inside a io.BufferedReader to read lines """
+  def __init__(self, fh):
+    self.fh=fh
+    self.md5=hashlib.md5()
+  def readable(self):     return True
+  def readinto(self, buffer):
+    data=self.fh.read(len(buffer))
+    buffer[:len(data)]=data
+    self.md5.update(data)
+    return len(data)
+
+class indexed_fasta(object):
+  """ Random access to the sequences of a fasta file through an index (as samtools faidx: for each sequence its length, offset, bases per line, bytes per line), which is stored together with the md5 checksum of the file content in a sidecar file (.seqinfo), created when not found or when the fasta file changed.
+  The fasta file is memory mapped, so that subsequences are read without loading whole chromosomes in memory, and without running external programs.
+  The fasta file can be compressed with bgzip: then offsets refer to the uncompressed data, and the blocks needed are decompressed on demand (see bgzf_file).
+  Sequences are identified by the first word of their title. If the lines of a sequence (except the last) have different lengths, a copy of the file with lines of the same length is written and used instead (see write_normalized_copy). Use function get_indexed_fasta to open each file only once.
+  """
+  seqinfo_format=3
+  def __init__(self, fasta_file):
+    self.filename=abspath(fasta_file)
+    self.sequence_file=self.filename    # file actually read: the fasta file, or its normalized copy
+    self.index={}   # name -> [length, offset, bases per line, bytes per line]
+    self.names=[]   # in order of the file
+    self.checksum=None    # md5 of the (uncompressed) content of the file
+    if is_bgzf_file(self.filename):       self.bgzf=bgzf_file(self.filename)
+    elif is_gzip_file(self.filename):     raise Exception("indexed_fasta ERROR the file is compressed with gzip, which does not allow random access. Please recompress it with bgzip: "+self.filename)
+    else:                                 self.bgzf=None
+    self.index_file=self.load_index()
+    self.file_h=open(self.sequence_file, 'rb')
+    if os.path.getsize(self.sequence_file) and not self.bgzf:    self.mapped=mmap.mmap(self.file_h.fileno(), 0, access=mmap.ACCESS_READ)
+    else:                                                   self.mapped=b''
+
+  def read(self, start, end):
+    """ Returns the (uncompressed) bytes of the fasta file from offset start to end (excluded) """
+    if self.bgzf:    return self.bgzf.read(start, end)
+    return self.mapped[start:end]
+
+  def load_index(self):
+    """ Loads the .seqinfo sidecar of the fasta file, building it if it is not found or if the size or modification time of the fasta file (or of its normalized copy, if any) changed since it was written. It is written next to the fasta file, or in temp_folder if that is not possible. Returns the path to the sidecar file """
+    index_file=self.filename+'.seqinfo'
+    temp_index_file=temp_folder+fileid_for_temp_folder(self.filename)+'.seqinfo'
+    fasta_stat=os.stat(self.filename)
+    for candidate_file in [index_file, temp_index_file]:
+      if not is_file(candidate_file): continue
+      try:
+        with open(candidate_file) as fh:    seqinfo=json.load(fh)
+      except Exception:     continue      # truncated or written by another version: rebuilt
+      if type(seqinfo) is dict and seqinfo.get('format')==self.seqinfo_format and seqinfo['size']==fasta_stat.st_size and seqinfo['mtime_ns']==fasta_stat.st_mtime_ns:
+        if seqinfo['normalized_copy']:
+          copy_file, copy_size, copy_mtime_ns = seqinfo['normalized_copy']
+          if not is_file(copy_file) or os.stat(copy_file).st_size!=copy_size or os.stat(copy_file).st_mtime_ns!=copy_mtime_ns:  continue
+          self.sequence_file, self.bgzf = copy_file, None
+        self.names, self.checksum = seqinfo['names'], seqinfo['md5']
+        self.index=dict(zip(self.names, seqinfo['entries']))
+        return candidate_file
+    normalized_copy=None
+    if not self.build_index():
+      for copy_index, copy_file in enumerate([self.filename+'.normalized.fa', temp_folder+fileid_for_temp_folder(self.filename)+'.normalized.fa']):
+        try:
+          checksum=self.write_normalized_copy(copy_file)
+          break
+        except OSError:
+          if copy_index:  raise
+      service('  ...lines of different length in '+self.filename+': using a copy with lines of the same length: '+copy_file)
+      self.sequence_file, self.bgzf = copy_file, None
+      self.index, self.names = {}, []
+      self.build_index()
+      self.checksum=checksum     # of the original content
+      normalized_copy=[copy_file, os.stat(copy_file).st_size, os.stat(copy_file).st_mtime_ns]
+    # stored as json, rather than pickle, so that loading a sidecar found on shared storage cannot execute code
+    seqinfo_data=json.dumps({'format':self.seqinfo_format, 'size':fasta_stat.st_size, 'mtime_ns':fasta_stat.st_mtime_ns, 'md5':self.checksum, 'normalized_copy':normalized_copy,
+                             'names':self.names, 'entries':[self.index[name] for name in self.names]}, separators=(',', ':'))
+    try:
+      with open(index_file+'.'+str(os.getpid()), 'w') as fh:     fh.write(seqinfo_data)
+      move_file(index_file+'.'+str(os.getpid()), index_file)
+      return index_file
+    except OSError:
+      with open(temp_index_file, 'w') as fh:     fh.write(seqinfo_data)
+      return temp_index_file
+
+  def build_index(self):
+    """ Reads the whole fasta file once to compute the lengths and offsets of its sequences, and the md5 checksum of its content. Returns False (leaving the index incomplete) as soon as a sequence is found with lines of different length, True otherwise """
+    offset=0;    name=None
+    with {True:gzip.open, False:open}[bool(self.bgzf)](self.sequence_file, 'rb') as fh:
+      hashed_fh=md5_reader(fh)
+      for line in io.BufferedReader(hashed_fh, 1024*1024):
+        if line.startswith(b'>'):
+          name=line[1:].split()[0].decode() if line[1:].split() else ''
+          if name in self.index:  raise Exception("indexed_fasta ERROR sequence identifier "+name+" is found more than once in file: "+self.filename)
+          self.index[name]=[0, offset+len(line), 0, 0]
+          self.names.append(name)
+          short_line_found=False
+        elif name is not None:
+          bases=len(line.rstrip(b'\r\n'))
+          entry=self.index[name]
+          if bases:
+            if short_line_found or (entry[2] and bases > entry[2]):     return False
+            if not entry[2]:    entry[2], entry[3] = bases, len(line)
+            elif bases < entry[2] or len(line) != entry[3]:   short_line_found=True
+            entry[0]+=bases
+          elif not entry[2]:   entry[1]+=len(line)    # empty line before the sequence
+          else:                short_line_found=True
+        offset+=len(line)
+      self.checksum=hashed_fh.md5.hexdigest()
+    return True
+
+  def write_normalized_copy(self, copy_file, line_length=60):
+    """ Writes to copy_file the fasta file with the sequence lines rewrapped to line_length characters, and titles unchanged. Empty lines are dropped. Returns the md5 checksum of the content of the original file """
+    with {True:gzip.open, False:open}[bool(self.bgzf)](self.filename, 'rb') as fh, open(copy_file+'.'+str(os.getpid()), 'wb') as out_fh:
+      hashed_fh=md5_reader(fh)
+      pending=b''     # bases of the current sequence not written yet
+      for line in io.BufferedReader(hashed_fh, 1024*1024):
+        if line.startswith(b'>'):
+          if pending:     out_fh.write(pending+b'\n')
+          pending=b''
+          out_fh.write(line.rstrip(b'\r\n')+b'\n')
+        else:
+          pending+=line.rstrip(b'\r\n')
+          if len(pending) >= line_length:
+            cut=len(pending) - len(pending) % line_length
+            out_fh.write(b''.join([pending[i:i+line_length]+b'\n' for i in range(0, cut, line_length)]))
+            pending=pending[cut:]
+      if pending:     out_fh.write(pending+b'\n')
+    move_file(copy_file+'.'+str(os.getpid()), copy_file)
+    return hashed_fh.md5.hexdigest()
+
+  def sequence_name(self, chromosome):
+    """ Returns the identifier under which chromosome is found in the index. As fastafetch, this tries adding a "|" at the end (since blast sometimes removes it), and recognizes the titles like "N_fastafilename" that some blast outputs have instead of the N-th title """
+    if chromosome in self.index:                                    return chromosome
+    if '|' in chromosome and chromosome+'|' in self.index:          return chromosome+'|'
+    if '_' in chromosome and is_number(chromosome.split('_')[0]) and 0 < int(chromosome.split('_')[0]) <= len(self.names):
+      service( '  ...using as index of sequence the number in blast output:  '+chromosome.split('_')[0] +' from header: '+chromosome )
+      return self.names[ int(chromosome.split('_')[0]) -1 ]
+    raise Exception("indexed_fasta ERROR cannot find sequence "+chromosome+" in file: "+self.filename)
+
+  def __contains__(self, chromosome):     return chromosome in self.index
+
+  def length(self, chromosome):
+    """ Returns the length of the sequence of chromosome """
+    return self.index[self.sequence_name(chromosome)][0]
+
+  def subseq(self, chromosome, start, length):
+    """ Returns the subsequence of chromosome starting at position start (0-based) of this length. As fastasubseq, start is set to 0 if it is negative, and the subsequence is cut at the end of the chromosome """
+    seq_length, offset, line_bases, line_bytes = self.index[self.sequence_name(chromosome)]
+    start=max(start, 0);   end=min(start+length, seq_length)
+    if end <= start:    return ''
+    first_byte=offset + (start // line_bases)*line_bytes + start % line_bases
+    last_byte= offset + ((end-1) // line_bases)*line_bytes + (end-1) % line_bases + 1
+    seq=self.read(first_byte, last_byte)
+    if last_byte-first_byte != end-start:      seq=seq.replace(b'\n', b'').replace(b'\r', b'')
+    return seq.decode()
+
+  def sequence(self, chromosome):
+    """ Returns the full sequence of chromosome """
+    return self.subseq(chromosome, 0, self.length(chromosome))
+
+  def write_sequence(self, chromosome, fileout):
+    """ Writes the fasta entry of chromosome (with its full title) to fileout, copying its lines as they are in the fasta file """
+    seq_length, offset, line_bases, line_bytes = self.index[self.sequence_name(chromosome)]
+    title_start=offset
+    while title_start > 0 and self.read(title_start-1, title_start) != b'>':    title_start-=1
+    seq_end=offset + (seq_length // line_bases)*line_bytes + seq_length % line_bases if line_bases else offset
+    chunk_size=4*1024*1024
+    with open(fileout, 'wb') as fh:
+      fh.write(b'>'+self.read(title_start, offset).rstrip(b'\r\n')+b'\n')
+      for chunk_start in range(offset, seq_end, chunk_size):
+        fh.write(self.read(chunk_start, min(chunk_start+chunk_size, seq_end)))
+      if seq_end > offset and self.read(seq_end-1, seq_end) != b'\n':   fh.write(b'\n')
+
+indexed_fasta_files={}   # abspath of fasta file -> indexed_fasta object
+def get_indexed_fasta(fasta_file):
+  """ Returns the indexed_fasta object for this fasta file, opening it only the first time it is requested in this process (and in its child processes, if opened before forking) """
+  fasta_file=abspath(fasta_file)
+  if not fasta_file in indexed_fasta_files:    indexed_fasta_files[fasta_file]=indexed_fasta(fasta_file)
+  return indexed_fasta_files[fasta_file]
+
+twobit_signature=0x1A412743
+twobit_bases='TCAG'    # base encoded by each 2-bit value
+twobit_decode_table=[ join([twobit_bases[(byte >> shift) & 3] for shift in (6, 4, 2, 0)], '') for byte in range(256) ]
+twobit_encode_table=str.maketrans('TCAGtcag', '01230123')
+
+class twobit_genome(object):
+  """ Random access to the sequences of a genome in .2bit format (as UCSC faToTwoBit): bases are packed in 2 bits each (T=0, C=1, A=2, G=3), and each sequence has a table of N runs and a table of soft-masked (lowercase) runs.
+  The file is memory mapped, so that processes forked after opening it share the same pages, taking about a quarter of the size of the fasta file; windows are decoded on demand. Tables of each sequence are read the first time it is accessed.
+  It offers the same methods as indexed_fasta to read sequences (length, subseq, sequence, write_sequence). Use function get_genome_reader to open it.
+  """
+  def __init__(self, twobit_file):
+    self.filename=abspath(twobit_file)
+    self.file_h=open(self.filename, 'rb')
+    self.mapped=mmap.mmap(self.file_h.fileno(), 0, access=mmap.ACCESS_READ)
+    signature, version, n_seqs, reserved = struct.unpack_from('<4I', self.mapped, 0)
+    self.endian='<'
+    if signature != twobit_signature:
+      self.endian='>'
+      signature, version, n_seqs, reserved = struct.unpack_from('>4I', self.mapped, 0)
+      if signature != twobit_signature:     raise Exception("twobit_genome ERROR this is not a .2bit file: "+self.filename)
+    offset_format=self.endian+{0:'I', 1:'Q'}[version]
+    self.offsets={}   # name -> offset of its record
+    self.names=[]
+    position=16
+    for seq_index in range(n_seqs):
+      name_size=self.mapped[position]
+      name=self.mapped[position+1:position+1+name_size].decode()
+      position+=1+name_size
+      self.offsets[name]=struct.unpack_from(offset_format, self.mapped, position)[0]
+      self.names.append(name)
+      position+=struct.calcsize(offset_format)
+    self.records={}   # name -> [length, offset of packed bases, N run starts, N run sizes, mask run starts, mask run sizes]
+
+  def record(self, chromosome):
+    """ Returns the record of chromosome (see self.records), reading it the first time """
+    name=self.sequence_name(chromosome)
+    if not name in self.records:
+      position=self.offsets[name]
+      record=[struct.unpack_from(self.endian+'I', self.mapped, position)[0]]
+      position+=4
+      for table in ('N', 'mask'):
+        n_runs=struct.unpack_from(self.endian+'I', self.mapped, position)[0]
+        run_starts=struct.unpack_from(self.endian+str(n_runs)+'I', self.mapped, position+4)
+        run_sizes= struct.unpack_from(self.endian+str(n_runs)+'I', self.mapped, position+4+4*n_runs)
+        position+=4+8*n_runs
+        record.extend([run_starts, run_sizes])
+      record.insert(1, position+4)    # skipping reserved field
+      self.records[name]=record
+    return self.records[name]
+
+  def sequence_name(self, chromosome):
+    """ Returns the identifier under which chromosome is found in the file (see indexed_fasta.sequence_name) """
+    if chromosome in self.offsets:                                  return chromosome
+    if '|' in chromosome and chromosome+'|' in self.offsets:        return chromosome+'|'
+    if '_' in chromosome and is_number(chromosome.split('_')[0]) and 0 < int(chromosome.split('_')[0]) <= len(self.names):
+      service( '  ...using as index of sequence the number in blast output:  '+chromosome.split('_')[0] +' from header: '+chromosome )
+      return self.names[ int(chromosome.split('_')[0]) -1 ]
+    raise Exception("twobit_genome ERROR cannot find sequence "+chromosome+" in file: "+self.filename)
+
+  def __contains__(self, chromosome):     return chromosome in self.offsets
+
+  def length(self, chromosome):
+    """ Returns the length of the sequence of chromosome """
+    return self.record(chromosome)[0]
+
+  def subseq(self, chromosome, start, length):
+    """ Returns the subsequence of chromosome starting at position start (0-based) of this length, with N runs and soft-masked runs restored. As fastasubseq, start is set to 0 if it is negative, and the subsequence is cut at the end of the chromosome """
+    seq_length, dna_offset, n_starts, n_sizes, mask_starts, mask_sizes = self.record(chromosome)
+    start=max(start, 0);   end=min(start+length, seq_length)
+    if end <= start:    return ''
+    packed=self.mapped[dna_offset + start//4 : dna_offset + (end-1)//4 + 1]
+    seq=bytearray(join(map(twobit_decode_table.__getitem__, packed), '')[start%4 : start%4 + end-start], 'ascii')
+    # runs are written in place, so that the window is not copied once per run
+    for run_start, run_end in runs_in_window(n_starts, n_sizes, start, end):
+      seq[run_start-start:run_end-start]=b'N'*(run_end-run_start)
+    for run_start, run_end in runs_in_window(mask_starts, mask_sizes, start, end):
+      seq[run_start-start:run_end-start]=seq[run_start-start:run_end-start].lower()
+    return seq.decode('ascii')
+
+  def sequence(self, chromosome):
+    """ Returns the full sequence of chromosome """
+    return self.subseq(chromosome, 0, self.length(chromosome))
+
+  def write_sequence(self, chromosome, fileout):
+    """ Writes the fasta entry of chromosome to fileout, with lines of 60 characters. The title is only the sequence identifier, since descriptions are not stored in .2bit files """
+    name=self.sequence_name(chromosome)
+    seq_length=self.length(name)
+    chunk_size=60*65536
+    with open(fileout, 'w') as fh:
+      fh.write('>'+name+'\n')
+      for chunk_start in range(0, seq_length, chunk_size):
+        chunk=self.subseq(name, chunk_start, chunk_size)
+        fh.write(join([chunk[i:i+60]+'\n' for i in range(0, len(chunk), 60)], ''))
+
+def runs_in_window(run_starts, run_sizes, start, end):
+  """ Given the sorted starts and the sizes of non-overlapping runs (as in the tables of .2bit files), returns the list of [run start, run end] (0-based, end excluded) overlapping the window from start to end, cut at its boundaries """
+  runs=[]
+  run_index=max(bisect.bisect_right(run_starts, start)-1, 0)
+  while run_index < len(run_starts) and run_starts[run_index] < end:
+    if run_starts[run_index]+run_sizes[run_index] > start:
+      runs.append([max(run_starts[run_index], start), min(run_starts[run_index]+run_sizes[run_index], end)])
+    run_index+=1
+  return runs
+
+def write_twobit(fasta_file, twobit_file, version=None):
+  """ Converts fasta_file (possibly compressed with bgzip) to .2bit format (see twobit_genome), reading one sequence at the time through its index. Characters other than ACGT (in any case) are stored as N; lowercase runs are stored in the mask table.
+  The version of the format is 0 (32-bit offsets) unless the file would be larger than 4 Gb; then version 1 (64-bit offsets) is used """
+  source_fasta=get_indexed_fasta(fasta_file)
+  total_length=sum([source_fasta.length(name) for name in source_fasta.names])
+  if version is None:   version=int( total_length//4 > 2**31 )
+  offset_format='<'+{0:'I', 1:'Q'}[version]
+  offset=16+sum([1+len(name.encode())+struct.calcsize(offset_format) for name in source_fasta.names])
+  offsets=[]
+  chunk_size=4*1024*1024    # bases packed at the time; multiple of 4
+  with open(twobit_file, 'wb') as fh:
+    fh.seek(offset)
+    for name in source_fasta.names:
+      if offset > 2**32-1 and not version:    
+        fh.close()
+        return write_twobit(fasta_file, twobit_file, version=1)
+      offsets.append(offset)
+      seq=source_fasta.sequence(name)
+      n_runs=   [m.span() for m in re.finditer('[^ACGTacgt]+', seq)]
+      mask_runs=[m.span() for m in re.finditer('[a-z]+', seq)]
+      record=struct.pack('<I', len(seq))
+      for runs in (n_runs, mask_runs):
+        record+=struct.pack('<'+str(1+2*len(runs))+'I', len(runs), *([run_start for run_start, run_end in runs]+[run_end-run_start for run_start, run_end in runs]))
+      record+=struct.pack('<I', 0)
+      fh.write(record)
+      offset+=len(record)
+      for chunk_start in range(0, len(seq), chunk_size):
+        chunk=re.sub('[^0-3]', '0', seq[chunk_start:chunk_start+chunk_size].translate(twobit_encode_table))
+        chunk+='0'*(-len(chunk) % 4)
+        fh.write( int(chunk, 4).to_bytes(len(chunk)//4, 'big') )
+        offset+=len(chunk)//4
+    fh.seek(0)
+    fh.write(struct.pack('<4I', twobit_signature, version, len(source_fasta.names), 0))
+    for name, name_offset in zip(source_fasta.names, offsets):
+      fh.write(struct.pack('<B', len(name.encode())) + name.encode() + struct.pack(offset_format, name_offset))
+
+use_twobit=False    # if set, sequences of fasta files are read from their .2bit version (see get_genome_reader)
+twobit_genomes={}   # abspath of fasta file -> twobit_genome object
+def get_genome_reader(fasta_file):
+  """ Returns the object used to read sequences from this fasta file: its indexed_fasta (see get_indexed_fasta), or, if the MMlib variable use_twobit is set, a twobit_genome for its .2bit version.
+  The .2bit file is written next to the fasta file, or in temp_folder if that is not possible, and it is created again if older than the fasta file. Like get_indexed_fasta, each file is opened only once per process.
+  While regions of the fasta file are preloaded (see preload_regions), the region_slices object holding them is returned instead """
+  fasta_file=abspath(fasta_file)
+  if fasta_file in preloaded_regions:    return preloaded_regions[fasta_file]
+  if not use_twobit:    return get_indexed_fasta(fasta_file)
+  if not fasta_file in twobit_genomes:
+    twobit_file=fasta_file+'.2bit'
+    temp_twobit_file=temp_folder+fileid_for_temp_folder(fasta_file)+'.2bit'
+    for candidate_file in [twobit_file, temp_twobit_file]:
+      if is_file(candidate_file) and os.path.getmtime(candidate_file) >= os.path.getmtime(fasta_file):      break
+    else:
+      try:
+        write_twobit(fasta_file, twobit_file+'.'+str(os.getpid()))
+        move_file(twobit_file+'.'+str(os.getpid()), twobit_file)
+        candidate_file=twobit_file
+      except OSError:
+        remove_files(twobit_file+'.'+str(os.getpid()))
+        write_twobit(fasta_file, temp_twobit_file)
+        candidate_file=temp_twobit_file
+    twobit_genomes[fasta_file]=twobit_genome(candidate_file)
+  return twobit_genomes[fasta_file]
+
+class region_slices(object):
+  """ Sequence reader which keeps in memory the slices of a fasta file covering a list of windows, to serve many requests on the same regions without reading them again.
+  windows is a list of [chromosome, start, end] (0-based, end excluded). Overlapping or adjacent windows are merged, and the resulting slices are read in a single ordered pass through reader (an indexed_fasta or twobit_genome object): chromosomes in their order in the file, and positions in increasing order.
+  Subsequences contained in a slice are returned from memory; all other requests, and all other methods, are passed to reader. Use functions preload_regions and release_regions to have get_genome_reader return this object.
+  """
+  def __init__(self, reader, windows):
+    self.reader=reader
+    self.slices={}    # chromosome -> [list of slice starts, list of slice ends, list of slice sequences], sorted by start
+    windows_by_chromosome={}
+    for chromosome, start, end in windows:
+      windows_by_chromosome.setdefault(reader.sequence_name(chromosome), []).append([max(start, 0), end])
+    file_order={name:name_index for name_index, name in enumerate(reader.names)}
+    for chromosome in sorted(windows_by_chromosome, key=lambda x:file_order[x]):
+      merged=[]
+      for start, end in sorted(windows_by_chromosome[chromosome]):
+        if merged and start <= merged[-1][1]:     merged[-1][1]=max(merged[-1][1], end)
+        else:                                    merged.append([start, end])
+      self.slices[chromosome]=[[start for start, end in merged], [end for start, end in merged], [reader.subseq(chromosome, start, end-start) for start, end in merged]]
+
+  def __getattr__(self, attribute):     return getattr(self.reader, attribute)
+
+  def __contains__(self, chromosome):   return chromosome in self.reader
+
+  def subseq(self, chromosome, start, length):
+    """ Returns the subsequence of chromosome starting at position start (0-based) of this length, as the subseq method of the reader """
+    start=max(start, 0)
+    name=self.reader.sequence_name(chromosome)
+    if name in self.slices:
+      slice_starts, slice_ends, slice_seqs = self.slices[name]
+      slice_index=bisect.bisect_right(slice_starts, start)-1
+      if slice_index >= 0 and start+length <= slice_ends[slice_index]:
+        return slice_seqs[slice_index][start-slice_starts[slice_index] : start-slice_starts[slice_index]+length]
+    return self.reader.subseq(chromosome, start, length)
+
+  def sequence(self, chromosome):
+    """ Returns the full sequence of chromosome """
+    return self.subseq(chromosome, 0, self.reader.length(chromosome))
+
+  def total_length(self):
+    """ Returns the total length of the slices in memory """
+    return sum([ sum(slice_ends)-sum(slice_starts) for slice_starts, slice_ends, slice_seqs in self.slices.values() ])
+
+preloaded_regions={}   # abspath of fasta file -> region_slices object
+def preload_regions(fasta_file, windows):
+  """ Reads the regions of fasta_file covering windows (a list of [chromosome, start, end], 0-based, end excluded) in a single ordered pass, and keeps them in memory: until release_regions is called, get_genome_reader returns a region_slices object serving requests from them. Processes forked meanwhile share them. Any regions previously preloaded for this file are released. Returns the region_slices object """
+  fasta_file=abspath(fasta_file)
+  release_regions(fasta_file)
+  preloaded_regions[fasta_file]=region_slices(get_genome_reader(fasta_file), windows)
+  return preloaded_regions[fasta_file]
+
+def release_regions(fasta_file):
+  """ Frees the memory of the regions preloaded for fasta_file (see preload_regions) """
+  fasta_file=abspath(fasta_file)
+  if fasta_file in preloaded_regions:    del preloaded_regions[fasta_file]
 
 def fastasubseq(subj_file, start, clength, out_file, pipecommand='', warning=False ):  #start can be <0, in that case it becomes 0; lenght can be > than the nts at the right of start, in that case... ###NB starts with 0
   """Utility to subseq fasta sequences. pipecommand is used for expert use: if you want to pass results through a pipe before going in out_file, you can use this. Also, if you want to append results instead of writing, use pipecommand='>' (so in the final command line it will appear >>)
+  Without pipecommand, fastasubseq is run directly without a shell.
   """
+  def run_fastasubseq(clength):
+    """ returns the command line, exit status and error message """
+    if pipecommand:
+      cmnd='fastasubseq "'+subj_file+'" '+str(start)+ ' '+str(clength)+" "+pipecommand+"> "+out_file
+      ss=bash(cmnd)
+      return cmnd, ss[0], ss[1]
+    argv=['fastasubseq', subj_file, start, clength]
+    ss=run_tool(argv, stdout_file=out_file)
+    return join([str(a) for a in argv], ' ')+' > '+out_file, ss[0], ss[2]
   
   start=max(start, 0)
-  cmnd='fastasubseq "'+subj_file+'" '+str(start)+ ' '+str(clength)+" "+pipecommand+"> "+out_file
-  ss = bash(cmnd)
+  cmnd, status, message = run_fastasubseq(clength)
   try:
-    if ss[0]!=0 and "Subsequence must end before end" in ss[1]:
+    if status!=0 and "Subsequence must end before end" in message:
       old_clength=clength
-      clength= int(   ss[1].split('\n')[0].split('(')[1][:-1]     ) - start
-      cmnd='fastasubseq "'+subj_file+'" '+str(start )+ ' '+str(clength)+" "+pipecommand+"> "+out_file
-      ss=bash(cmnd)
+      clength= int(   message.split('\n')[0].split('(')[1][:-1]     ) - start
+      cmnd, status, message = run_fastasubseq(clength)
       if warning: printerr('Fastasubseq: '+str(old_clength)+' bp not available, cutting the first '+str(clength), 1)
-    if ss[0]!=0:
-      raise Exception("COMMAND "+cmnd+" ERROR in fastasubseq: \""+ss[1]+"\"")
+    if status!=0:
+      raise Exception("COMMAND "+cmnd+" ERROR in fastasubseq: \""+message+"\"")
     return clength    #returning message for how much the sequence was actually cut
   except Exception as e:
-    raise Exception("COMMAND "+cmnd+" ERROR in fastasubseq: \""+ss[1]+"\"")
+    raise Exception("COMMAND "+cmnd+" ERROR in fastasubseq: \""+message+"\"")
     
 
 def fasta(string, char_per_line=60):
@@ -4265,24 +4999,25 @@ The argument keep_seq, if True, sets the sequence of the new object as its .seq
 
     if up or down:
       last_codon=big_extended_seq [offset+self.length()-3:offset+self.length() ]
-      while down and not last_codon in stops:  #  last codon is not stop codon: keep extending. out of boundaries or weird sequence cause it to break
+      if down and not last_codon in stops:  #  last codon is not stop codon: extending until the next stop. out of boundaries or weird sequence (e.g. Ns) cause it to stop before
         ## going downstream
-        codon_downstream= big_extended_seq [offset+  self.length(): offset+self.length()+3]
-        ### forcing to stop if letters are not standard (e.g. Ns)
-        if not all ( [c in allowed_letters for c in codon_downstream] ):     down=False; break
-        if len(codon_downstream)!=3:                                         break
-        self.extend(down=3, inplace=True)
-        last_codon=codon_downstream
+        n_codons, stop_reason = codon_scan(big_extended_seq, offset+self.length(), stops, allowed_letters)
+        if stop_reason=='stop':       n_codons+=1   # including the stop
+        elif stop_reason=='invalid':  down=False
+        if n_codons:
+          self.extend(down=3*n_codons, inplace=True)
+          last_codon=big_extended_seq [offset+self.length()-3:offset+self.length() ]
 
       ## first we extend up to the stop, then we subseq
       first_codon = big_extended_seq [offset:offset+3]
-      while up and not first_codon in stops:
-        codon_upstream= big_extended_seq [offset-3:offset]
-        if not all ( [c in allowed_letters for c in codon_upstream] ):     up=False; break
-        if len(codon_upstream)!=3:                                         break
-        self.extend(up=3, inplace=True)
-        offset-=3
-        first_codon=codon_upstream
+      if up and not first_codon in stops:
+        n_codons, stop_reason = codon_scan(big_extended_seq, offset, stops, allowed_letters, reverse=True)
+        if stop_reason=='stop':       n_codons+=1
+        elif stop_reason=='invalid':  up=False
+        if n_codons:
+          self.extend(up=3*n_codons, inplace=True)
+          offset-=3*n_codons
+          first_codon=big_extended_seq [offset:offset+3]
       
       rerun_up=False;       rerun_down=False
       if down and not last_codon in stops and not extended_out_downstream  \
@@ -4298,8 +5033,7 @@ The argument keep_seq, if True, sets the sequence of the new object as its .seq
       ### cut to first start
     if starts:
         first_start=None
-        for codon_index in range(self.length()/3): 
-          codon= big_extended_seq [ offset+codon_index*3:offset+codon_index*3+3 ]
+        for codon_index, codon in enumerate(split_codons(big_extended_seq [offset:offset+self.length()//3*3])):
           if codon in starts: first_start=codon_index; break
         if not first_start is None: 
           if   self.strand=='+':       actually_reducing=  self.boundaries()[0]+first_start*3 > self.original_bounds[0] 
@@ -4394,20 +5128,24 @@ The argument keep_seq, if True, sets the sequence of the new object as its .seq
     self.add_exons_from_positions_summary(title.split('[positions:')[1].split(']')[0])    
 
   def fast_sequence(self):
-    """ Can be used only if the target file for this gene is loaded in memory in the sequence_db object (see function load_sequence_db). provides a much faster way to get sequences than method fasta_sequence. returns string with the sequence """    
-    if self.chromosome not in sequence_db: raise Exception("ERROR fast_sequence() cannot find chromosome identifier: "+str(self.chromosome))
+    """ Provides a much faster way to get sequences than method fasta_sequence when the target file for this gene is loaded in memory in the sequence_db object (see function load_sequence_db). Otherwise, the sequence is read from the .target file through its index (see indexed_fasta). returns string with the sequence """    
+    if self.chromosome in sequence_db:      chromosome_seq=sequence_db[self.chromosome]
+    elif getattr(self, 'target', None):     
+      target_fasta=get_genome_reader(self.target)
+      chromosome_seq=None
+    else: raise Exception("ERROR fast_sequence() cannot find chromosome identifier: "+str(self.chromosome))
     seq_out=''
-    if self.strand=='-':
-      for start, end in reversed(self.exons):      seq_out+= sequence_db[self.chromosome] [ start-1:end ]      
-      seq_out= reverse_complement(seq_out)
-    else:
-      for start, end in self.exons:      seq_out+= sequence_db[self.chromosome] [ start-1:end ]
+    for start, end in sorted(self.exons):
+      if chromosome_seq is None:    seq_out+= target_fasta.subseq(self.chromosome, start-1, end-start+1)
+      else:                         seq_out+= chromosome_seq[ start-1:end ]
+    if self.strand=='-':      seq_out= reverse_complement(seq_out)
     if len(seq_out)!=self.length(): raise Exception("ERROR fast_sequence() wrong sequence length in memory! aborting ")
     return seq_out
 
   def fasta_sequence(self, to_file='', target='', chromosome_file='', split_exons=False, title=''):
     """ Cut the sequence corresponding to this gene object. If to_file is defined, nothing is returned, and the subseqed sequence is written to "to_file" argument. ; if it is not defined, a single (title, seq) object is returned.
   target can be defined as key arg to override the target attribute of the gene object. It should point to the genome (multifasta or not) file.
+  Sequences are read through the index of the target (see indexed_fasta); if chromosome_file is defined, they are read from it instead (a fasta file with the sequence of this chromosome).
   if split_exons is True, then multiple exons will be present in the output as fata entries (so, if split_exons and to_file is not defined, a list of (title, seq) is returned instead of a single entry.
   if you don't define title, this will be computed with the function header. 
 
@@ -4422,40 +5160,35 @@ The argument keep_seq, if True, sets the sequence of the new object as its .seq
     elif not chromosome_file and not target:      target=self.target
     if chromosome_file:
       if not is_file(chromosome_file):       raise Exception("gene-> fasta_sequence ERROR the chromosome_file "+chromosome_file+" was not found")
-      chrom_file=chromosome_file
-    else:      chrom_file=fastafetch(split_folder, self.chromosome, target)
-    if not to_file:      file_out=temp_folder+'gene_fasta_seq'
-    else:                file_out=to_file
-
-    bbash('>'+file_out)      
+      source_fasta=get_indexed_fasta(chromosome_file)
+      chromosome=source_fasta.names[0]
+    else:      
+      source_fasta=get_genome_reader(target)
+      chromosome=self.chromosome
 
     if title=='fasta_title':             title=self.fasta_title()
     elif not title:                      title=self.header()
 
-    if not split_exons:
-      write_to_file(">"+title, file_out)
-      for start, stop in self.exons:
-        if self.strand=='+':          fastasubseq(chrom_file, start-1, stop-start+1, file_out, pipecommand=" | gawk 'NR>1' >") #appending
-        elif self.strand=='-':
-          fastasubseq(chrom_file, start-1, stop-start+1, temp_folder+'gene_fasta_seq_to_revcomp') 
-          bbash("fastarevcomp "+temp_folder+"gene_fasta_seq_to_revcomp  "+"| gawk 'NR>1' "+" >> "+file_out) 
-          
-    else:
-      for exon_index in range(len(self.exons)):
-
-        start, stop = self.exons[exon_index]
+    entries=[]  # list of (title, seq)
+    for exon_index in range(len(self.exons)):
+      start, stop = self.exons[exon_index]
+      if not self.strand in '+-':  continue
+      subseq_text=source_fasta.subseq(chromosome, start-1, stop-start+1)
+      if self.strand=='-':    subseq_text=reverse_complement(subseq_text)
+      if split_exons:
         this_title=title.split()[0]+'_EXON'+str(exon_index+1)  +' '*int(  len(title.split())>1 )+   ' '.join(title.split()[1:])
+        entries.append( (this_title, subseq_text) )
+      elif not entries:          entries.append( (title, subseq_text) )
+      else:                      entries[0]=(title, entries[0][1]+subseq_text)
+    if not split_exons and not entries:   entries.append( (title, '') )
 
-        bbash('echo ">'+this_title+'" >> '+file_out)    
-        if self.strand=='+':          fastasubseq(chrom_file, start-1, stop-start+1, file_out, pipecommand=" | gawk 'NR>1' >") #appending
-        elif self.strand=='-':
-          fastasubseq(chrom_file, start-1, stop-start+1, temp_folder+'gene_fasta_seq_to_revcomp') 
-          bbash("fastarevcomp "+temp_folder+"gene_fasta_seq_to_revcomp   "+"| gawk 'NR>1' "+" >> "+file_out) 
-
-    if not to_file:
-      # 2022
-      if not split_exons:        return [i for i in parse_fasta(file_out)][0]
-      else:                      return [i for i in parse_fasta(file_out)]
+    if to_file:
+      with open(to_file, 'w') as out_fh:
+        for entry_title, seq in entries:
+          print(">"+entry_title, file=out_fh)
+          for i in range(0, len(seq), 60):      print(seq[i:i+60], file=out_fh)
+    elif not split_exons:        return entries[0]
+    else:                        return entries
 
 def intersection_of(range1, range2):
   """assuming they are overlapping, and that they're like [start, stop]  with start < stop"""
@@ -4466,7 +5199,7 @@ uniq_idfunctions_hash={'gtf': lambda s:s.split('transcript_id "')[1].split('"')[
 def get_gff_format(gff_file):
   gff_format=''
   check_file_presence(gff_file)
-  sample_lines=bbash('head -15 '+gff_file)
+  with open(gff_file) as gff_fh:    sample_lines=join([gff_fh.readline() for i in range(15)], '')
   if 'transcript_id "' in sample_lines:
       gff_format='gtf'
   elif '\tSP.' in sample_lines:
@@ -4657,53 +5390,41 @@ def bedtools_intersect(gene_list, strand=True, options={}): ## implicit:{'s':Tru
 
 
 def gene_clusters(gene_list, strand=True):
-  """ Use bedtools intersect (temp_folder from MMib is used. See function set_local_folders) to compute overlaps between the genes.
+  """ Computes the clusters of overlapping genes: two genes are in the same cluster if any of their exons overlap (on the same strand, if strand==True), or if they both overlap a third gene of the cluster, and so on.
+  Exons are compared as the intervals of their bed lines (see gene.bed), as bedtools intersect does (see bedtools_intersect). The exons of each chromosome (and strand) are sorted by start and swept once: an exon overlaps an exon seen before if and only if it starts before the maximum end seen so far in the current run of overlapping exons. The clusters of genes are then merged with a union-find structure. No external program or temporary file is used.
   Returns two dictionaries: gene2cluster, cluster2genes
   where cluster is a numeric index (not consecutives)
 """
-  geneid2cluster_index={}; cluster_index=1; cluster_index2geneids={}
-  geneid2gene={}; 
-  for g_index, g in enumerate(gene_list):    geneid2gene[str(g_index)]=g
-  bp=bedtools_intersect(gene_list, strand=strand)
-  for line in bp.stdout:
-#    print line
-    splt=line.rstrip().split('\t')
-    if strand:    id_left = splt[3]; id_right= splt[9]
-    else:         id_left = splt[3]; id_right= splt[7]
-    if   id_left != id_right:
-      if   (  not id_left in geneid2cluster_index )  and  ( not id_right in geneid2cluster_index ):  #new cluster
-        cluster_index2geneids [cluster_index] = [id_left, id_right]
-        geneid2cluster_index[id_left]=cluster_index;              geneid2cluster_index[id_right]=cluster_index
-        cluster_index+=1
-#        print '1 creating with ids: ',id_left, id_right, ' the cluster ', cluster_index-1
-      elif (  id_left in geneid2cluster_index     )  and  ( not id_right in geneid2cluster_index ):
-        cluster_index2geneids [ geneid2cluster_index[id_left] ].append( id_right )
-        geneid2cluster_index[id_right]=   geneid2cluster_index[id_left]
-#        print '2 moving id: '+id_right+' to cluster ', cluster_index
-      elif ( not id_left in geneid2cluster_index  )  and  ( id_right in geneid2cluster_index ):
-        cluster_index2geneids [ geneid2cluster_index[id_right] ].append( id_left )
-        geneid2cluster_index[id_left]=    geneid2cluster_index[id_right]
-#        print '3 moving id: '+id_left+' to cluster ', cluster_index
-      elif geneid2cluster_index[id_left] != geneid2cluster_index[id_right]    : #not id_left in geneid2cluster_index  and  not id_right in geneid2cluster_index   is implicit
-        #putting those in cluster of id_right into the cluster in id_left, unless the reverse is more efficient
-        if len( cluster_index2geneids [ geneid2cluster_index[id_right] ] )  > len( cluster_index2geneids [ geneid2cluster_index[id_left] ] ): id_left, id_right = id_right, id_left
-#        print '4 LEFT:', id_left,  'c:', geneid2cluster_index[id_left],  'RIGHT:',  id_right, 'c:', geneid2cluster_index[id_right]
-
-        cluster_index_to_remove = geneid2cluster_index[id_right]
-        for gid in cluster_index2geneids [ geneid2cluster_index[id_right] ]:   
-#          print '4 moving id: '+gid, 'from cluster', cluster_index_to_remove, ' to cluster ', geneid2cluster_index[id_left]
-          geneid2cluster_index[ gid ] =  geneid2cluster_index[id_left]
-        cluster_index2geneids[  geneid2cluster_index[id_left]  ].extend(   cluster_index2geneids[  cluster_index_to_remove  ]   )
-#        print '4 removing cluster', cluster_index_to_remove
-        del cluster_index2geneids[  cluster_index_to_remove  ]
+  parent=list(range(len(gene_list)))    # union-find forest of the indexes of genes in gene_list
+  def find_root(g_index):
+    while parent[g_index]!=g_index:
+      parent[g_index]=parent[parent[g_index]]      # path halving
+      g_index=parent[g_index]
+    return g_index
+
+  exons_by_chromosome={}    # (chromosome, strand or None) -> list of (start, end, gene index)
+  for g_index, g in enumerate(gene_list):
+    chromosome_exons=exons_by_chromosome.setdefault( (g.chromosome, g.strand if strand else None), [] )
+    for start, end in g.exons:      chromosome_exons.append( (start, end, g_index) )
+  for chromosome_exons in exons_by_chromosome.values():
+    chromosome_exons.sort()
+    run_end=None
+    for start, end, g_index in chromosome_exons:
+      if run_end is None or start >= run_end:     # not overlapping any exon before: a new run starts
+        run_root=find_root(g_index);    run_end=end
+      else:
+        g_root=find_root(g_index)
+        if g_root!=run_root:   parent[g_root]=run_root
+        if end > run_end:      run_end=end
 
   # producing dictionaries that can be used in output
-  gene2cluster={}; cluster2genes={}
-  for gid in geneid2gene:
-    g=geneid2gene[gid]
-    if gid in geneid2cluster_index:    gene2cluster[ g ] = geneid2cluster_index[gid]
-    else:                              gene2cluster[ g ] = cluster_index; cluster_index+=1
-    if not gene2cluster[ g ] in cluster2genes: cluster2genes[ gene2cluster[ g ] ]= []
+  gene2cluster={}; cluster2genes={}; root2cluster_index={}
+  for g_index, g in enumerate(gene_list):
+    g_root=find_root(g_index)
+    if not g_root in root2cluster_index:
+      root2cluster_index[g_root]=len(root2cluster_index)+1
+      cluster2genes[ root2cluster_index[g_root] ]=[]
+    gene2cluster[ g ] = root2cluster_index[g_root]
     cluster2genes[   gene2cluster[ g ]   ].append(g)
   return gene2cluster, cluster2genes
 
@@ -4723,7 +5444,7 @@ def remove_overlapping_gene_clusters(gene_list,  scoring=len,  cmp_fn=None, phas
     remove_overlapping_genes(gene_list, out_removed_genes=a_list)
     # now a_list contains the gene removed.
   When you use the out_removed_genes argument, you may want to know the correspondance between the genes removed and the ones kept, without recomputing overlaps. If you use remember_overlaps=True, the attribute .overlapping will be added to the removed genes; this is a link to the gene kept (which is present in the output, returned list)
-   Normally the overlaps between any two genes is checked through two steps; first, the bedintersect tool, which can take into account the strand or not (depending on the argument of strand); second, the gene.overlaps_with function, which can take into account also the phase (frame). You can replace this second check with any given function providing it as argument of overlap_fn; this must take two gene arguments, and return True or False. If overlap_fn is provided, then the phase argument is ignored.
+   Normally the overlaps between any two genes is checked through two steps; first, the clusters of genes with overlapping exons (see gene_clusters), which can take into account the strand or not (depending on the argument of strand); second, the gene.overlaps_with function, which can take into account also the phase (frame). You can replace this second check with any given function providing it as argument of overlap_fn; this must take two gene arguments, and return True or False. If overlap_fn is provided, then the phase argument is ignored.
    """
   outlist=[]
   #overlaps_graph= genes_overlap(gene_list, phase=phase, strand=strand)
@@ -5003,7 +5724,7 @@ def get_taxids_from_ncbi_db(   scientific_name_list,    ncbi_db='/users/rg/didac
   bash( 'grep -Ff '+t_file+' ' +ncbi_db+' > '+grep_out)
   ambygous= temp_dir+'/ambygous_out'
   unambygous= temp_dir+'/unambygous_out'
-  bash('rm '+ambygous)
+  remove_files(ambygous)
   bash("gawk -F'|' '{if ($3!=\"\t\t\"){print $0 > \""+ambygous+"\"} else{ print } }' "+grep_out + " > "+unambygous)
   if is_file(ambygous):
     n_ambygous_entries   = int(  bash('wc -l '+ambygous)[1].split()[0]    )
@@ -5139,11 +5860,41 @@ class parser(object):
 #       self.last_line=self.file.readline()
 #     yield title, seq    
 
-from Bio import SeqIO
+fasta_whitespace=' \n\r\t'
+def read_fasta(source, remove_chars=fasta_whitespace):
+  """ Generator of (title, sequence) for all records of a fasta file, read in bulk: characters in remove_chars are deleted from each sequence in a single pass (str.translate), instead of processing it line by line.
+  source can be a filename or a text filehandler. Uncompressed files are memory-mapped and split on record boundaries, so that lines are never handled one by one; gzip or bgzip compressed files and filehandlers are read line by line, and the lines of each record joined at once. Titles are stripped of the initial > and trailing whitespace. Anything before the first title is ignored """
+  if isinstance(source, io.IOBase) or is_gzip_file(source):
+    fh=source if isinstance(source, io.IOBase) else gzip.open(source, 'rt')
+    delete_table=str.maketrans('', '', remove_chars)
+    title=None; seq_lines=[]
+    for line in fh:
+      if line.startswith('>'):
+        if not title is None:   yield title, join(seq_lines, '').translate(delete_table)
+        title=line[1:].rstrip(); seq_lines=[]
+      elif not title is None:   seq_lines.append(line)
+    if not title is None:       yield title, join(seq_lines, '').translate(delete_table)
+    if not fh is source: fh.close()
+    return
+  delete_bytes=remove_chars.encode()
+  with open(source, 'rb') as fh:
+    if not os.fstat(fh.fileno()).st_size: return
+    with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      if data[:1]==b'>':    record_start=0
+      else:
+        record_start=data.find(b'\n>')+1
+        if not record_start: return      # no title in the file
+      while record_start!=-1:
+        record_end=data.find(b'\n>', record_start)
+        record= data[record_start+1:record_end+1] if record_end!=-1 else data[record_start+1:]
+        title_end=record.find(b'\n')
+        if title_end==-1:   title_end=len(record)
+        yield record[:title_end].decode().rstrip(), record[title_end+1:].translate(None, delete_bytes).decode()
+        record_start= record_end+1 if record_end!=-1 else -1
+
 def parse_fasta(filename):
-  with open(filename) as fh:
-    for title, seq in SeqIO.FastaIO.SimpleFastaParser(fh):
-      yield (title, seq)
+  """ Generator of (title, sequence) for all records of a fasta file (or filehandler), see read_fasta """
+  return read_fasta(filename)
 
 
 class parse_sam(parser):
@@ -6005,19 +6756,19 @@ def fasta_next_seq(filehandler, cline=''):
     !!!! obsolete! use parse_fasta() class instead
    """
 
-  title, seq='', ''
+  title, seq_lines='', []
   if not cline:
     cline=filehandler.readline()
   while cline:
     if cline[0]=='>':
       if title:
-        return title, seq, cline
+        return title, join(seq_lines, ''), cline
       title=cline[1:-1]
     else:
-      seq+=cline[:-1]
+      seq_lines.append(cline[:-1])
     cline=filehandler.readline()
   if title:
-    return title, seq, cline
+    return title, join(seq_lines, ''), cline
   else:
     return None
 def check_file_presence(input_file, descriptor='input_file', exception_raised=Exception):
@@ -6031,7 +6782,10 @@ def test_writeable_folder(folder, descriptor=''):
   rnumber= random.randint(1, 99999)
   folder=Folder(folder)
   filename=folder+'WrItE_TeSt.'+str(rnumber)
-  if bash('echo "x" > '+filename+' && rm '+filename)[0]:
+  try:
+    write_to_file('x', filename)
+    os.remove(filename)
+  except OSError:
     raise Exception("ERROR "+descriptor+ ": cannot write in "+folder)
 
 is_file=os.path.isfile
@@ -6523,22 +7277,22 @@ def load_chromosome_lengths(chromosome_length_file, max_chars=0, exception_raise
     fasta_identifier = line.split()[1]
     length=int(line.split()[0])
     if fasta_identifier in chromosome_lengths: 
-      bash('rm '+chromosome_length_file)
+      remove_files(chromosome_length_file)
       raise exception_raised("ERROR the target file has a duplicate fasta identifier! ("+line.split()[1]+') Please modify it and rerun. Note: remove the .index and *.fa.n* blast formatting files after changing the target file')
     if length==0: 
-      bash('rm '+chromosome_length_file)
+      remove_files(chromosome_length_file)
       raise exception_raised("ERROR the target file has a length zero entry! ("+line.split()[1]+') Please modify it and rerun. Note: remove the .index and *.fa.n* blast formatting files after changing the target file')
     if is_number(fasta_identifier) and fasta_identifier[0]=='0':
-      bash('rm '+chromosome_length_file)
+      remove_files(chromosome_length_file)
       raise exception_raised("ERROR the target file has a numeric fasta identifier starting with zero!  ("+line.split()[1]+') This would cause an unexpected blast behavior. Please modify this or these ids and rerun. Note: remove the .index and *.fa.n* blast formatting files after changing the target file')
     if ':subseq(' in fasta_identifier: 
-      bash('rm '+chromosome_length_file)
+      remove_files(chromosome_length_file)
       raise  exception_raised("ERROR with fasta header: "+fasta_identifier+' ; this was generated by fastasubseq and will cause unexpected behavior of this program, since it is using fastasubseq itself to cut sequences. Please clean the titles in your target file from ":subseq(" tags. Note: remove the .index and *.fa.n* blast formatting files after changing the target file ')
     if max_chars and   len(fasta_identifier)>max_chars: 
-      bash('rm '+chromosome_length_file)
+      remove_files(chromosome_length_file)
       raise  exception_raised("ERROR with fasta header: "+fasta_identifier+' is too long. The maximum length for a fasta identifier (first word of the title) is '+str(max_chars)+' characters. Please clean the titles in your target file. Note: remove the .index and *.fa.n* blast formatting files after changing the target file')
     if '/' in fasta_identifier:
-      bash('rm '+chromosome_length_file)
+      remove_files(chromosome_length_file)
       raise  exception_raised("ERROR with fasta header: "+fasta_identifier+' has forbidden character: "/" \nPlease clean the titles in your target file. Note: remove the .index and *.fa.n* blast formatting files after changing the target file')
 
     chromosome_lengths[fasta_identifier]=length
@@ -6558,7 +7312,7 @@ def RNAplot(seq, ss, fileout, label='', options=''):
   expected_file=temp_folder+'title_ss.ps'
   output_extension = fileout.split('.')[-1]
   if output_extension=='ps' and not label:
-    bbash('mv {ps} {out}'.format(ps=expected_file, out=fileout))
+    move_file(expected_file, fileout)
   else:
     labelbit='' if not label else '-label "{lab}"'.format(lab=label)
     bbash( 'montage -geometry +1+1 -density 150 {labelbit} {ps} {out}'.format(ps=expected_file, out=fileout, labelbit=labelbit) )
@@ -12,6 +12,11 @@ o = selenoprofiles_results
 
 # save extracted scaffolds in temp folder (1) or trash everything at each run (0)?
 save_chromosomes=0
+# maximum total size of the extracted scaffolds kept (e.g. 500M, 2G; 0 for no limit); the least recently used are deleted first
+chromosome_cache=2G
+# folder where blast outputs are kept to be reused by other runs of the same searches (empty: not used), and its maximum total size
+blast_cache=
+blast_cache_size=10G
 ## default profile. Searched in profiles_folder. Many possible type of value as argument (see -help)
 profile=
 
@@ -61,6 +66,9 @@ blast_filtering_warning = 1
 ##  genetic code
 genetic_code = 1 
 
+## programs running blast searches: blastall (legacy NCBI blast) or blast+ (NCBI BLAST+, faster with many cpus). It can be set also per profile
+blast_backend = blastall
+
 ###  program options (same for all profiles). -a is for number of cpus
 blast_opt     = -a {ncpus}
 exonerate_opt =
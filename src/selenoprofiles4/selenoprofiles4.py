@@ -5,7 +5,7 @@ from ._version import __version__
 from .load_config import selenoprofiles_config_content
 
 global temp_folder, split_folder
-import sys, os, traceback, shutil, gzip, tarfile, time, glob
+import sys, os, traceback, shutil, gzip, tarfile, time, glob, multiprocessing, queue, shlex, signal, socket, hashlib, heapq
 from types import MethodType
 from subprocess import *
 from string import *
@@ -62,7 +62,8 @@ selenoprofiles  -o output_folder  -t target_file  -s "species name"  -p profile
 
 * Compulsory arguments:
 -o  output folder, will be created if non-existing. The same one can used for runs on different targets
--t  target_file = a (multi-)fasta file containing nucleotide sequences
+-t  target_file = a (multi-)fasta file containing nucleotide sequences, possibly compressed with bgzip (.fa.gz), or a target bundle built with selenoprofiles prepare.
+     If its sequence lines have different lengths, a copy with lines of the same length is written next to it (or in the temp folder) and read instead
 -s  a species descriptor with no restrictions. Use quotes if composed by multiple words
 -p  the profile(s) to be searched. Multiple comma-separated arguments are accepted. Each argument can be:
      - a profile name: invokes a built-in alignment (located in the profiles_folder defined in the config file)
@@ -110,7 +111,7 @@ To create a single output file for all predictions, use -output_FORMAT_file prov
 Additionally, a fasta alignment called PROFILE.ali is created for each profile, with the sequences of all predictions plus the profile.
 
 * Frequently used options
--ncpus         +   number of threads used for blast searches
+-ncpus         +   number of threads used for blast searches, and number of cyclic_exonerate and genewise runs executed in parallel
 -no_splice || -N   disable intron prediction; for  RNA sequences or bacterial genomes. Genewise is deactivated in this mode
 
 For full list of options (e.g. build a new profile; collect/display overview of results), run: selenoprofiles -h full
@@ -126,7 +127,9 @@ To deactivate an option which is active by default, use -option 0.
 In the config file, you must use option = 1 to activate those options not requiring arguments.
 
 * Pipeline steps
-The following steps are normally executed only if their output is not found. You can force their execution with their short or long option. 
+The following steps are normally executed only if their output is not found, or if their inputs changed since the last run: 
+the profile alignment, the target, and the options, profile attributes and actions relevant to each step (stored in the checkpoints folder of the target). 
+You can force their execution with their short or long option. 
 Forcing a step forces also the execution of all subsequent steps. 
 Note that this may cause certain files to be overwritten, but none will be deleted.
 
@@ -149,6 +152,9 @@ selenoprofiles database : fix, inspect, edit the sqlite db used by selenoprofile
 selenoprofiles orthology: assign subfamily names (e.g. GPx1 rather than GPx) for multimember families (vertebrates)
 selenoprofiles lineage  : filter predictions based on the expected selenoproteomes per lineage (vertebrates)
 selenoprofiles assess   : compare an input gene annotation with selenoprofiles output
+selenoprofiles shard    : split a large target into shards to be searched separately, then merge their results
+selenoprofiles prepare  : build a read-only bundle of a target with its index and blast database, searched without any preparation
+selenoprofiles benchmark: time the sequence kernels used in the pipeline against their reference implementations
 ### Note: every utility has it own help page; e.g. run: selenoprofiles build -h
 
 * System and global configuration
@@ -158,15 +164,27 @@ selenoprofiles assess   : compare an input gene annotation with selenoprofiles o
 -bin_folder       +   folder where the executables run by selenoprofiles are searched
 -temp             +   temporary folder. A folder with random name is created here, used and deleted at the end of the computation
 -save_chromosomes     temporary single-seq fasta files extracted from the target are used in the pipeline. If this is active, these files (stored inside -temp folder) are not deleted
+-chromosome_cache +   maximum total size of the single-seq fasta files kept (e.g. 500M, 2G; 0 for no limit). When exceeded, the least recently used are deleted. With -save_chromosomes, the limit applies to the files shared by all runs using the same -temp folder
+-blast_cache      +   folder where the output of blast searches is stored, to be reused by any later run of the same search (same profile alignment or cluster, target, blast backend and options), with any output folder and also after -clean. It can be shared by concurrent runs
+-blast_cache_size +   maximum total size of the blast cache (e.g. 500M, 10G; 0 for no limit). When exceeded, the least recently used outputs are deleted
+-twobit               read sequences from a .2bit version of the target (packed 2 bits per base, with tables of N and lowercase runs), created next to it when missing or older than the target. It is memory mapped and shared by all processes, using about a quarter of the memory of the fasta. Other ambiguity codes are read as N
 -no_colors            disable printing in colors to atty terminals
 -GO_obo_file      +   path to the gene_ontology_ext.obo file used in GO tools-based filtering (see manual)
 
+* Multiple targets
+-batch            +   search many targets in a single run, instead of using -t and -s. Argument is a file with one target per line: the path to the target file, followed by the species name (anything after the first whitespace). Profiles are loaded and prepared only once; each target is searched and written to its usual output folder and database, one after the other
+
+* Parallelization
+-profile_workers  +   number of profiles searched at the same time, each in a separate process with its own subfolder of the temp folder. The output of each profile is printed when its search is completed; results.sqlite is written only by the main process
+-blast_workers    +   number of blast searches run at the same time for profiles with multiple clusters, one per cluster. The -ncpus threads are split among them, so that each blast search runs with ncpus/blast_workers threads (-a of blastall, -num_threads of BLAST+)
+
 * Prediction programs
 -dont_exonerate         do not run exonerate. Not recommended. 
 -dont_genewise          do not run genewise.  Use to reduce the time required for computation
 -genewise_to_be_sure    active by default. When exonerate produce no output or its prediction does not overlap the seed blast hit, genewise is run, seeded using the blast hits coordinates. Turn off this option not to run genewise in these cases, to reduce the time required for computation
 -no_blast               do not allow choosing a blast prediction (over a genewise or exonerate prediction). Use this if an accurate splice site prediction is crucial for you
 -tblastn                use simple tblastn (single query) instead of the default psitblastn (profile-based PSSM)
+-blast_backend      +   programs running the blast searches: blastall (legacy NCBI blast, default) or blast+ (NCBI BLAST+: the PSSM is built with psiblast and searched with tblastn -in_pssm, using -num_threads, which scales across cores much better). Blast options are given in blastall syntax in any case, and translated for BLAST+ (e.g. -a to -num_threads); options with longer names are passed to BLAST+ as they are. Can be set also for each profile (see profile attributes below)
 -exonerate_extension      +    nt lenght of extension used on both sides by the cyclic exonerate procedure (see paper or manual)
 -genewise_extension       +    nt length of extension used on both sides when running genewise on gene boundaries defined by exonerate 
 -genewise_tbs_extension   +    same as -genewise_extension, but used for genewise on blast hits for which exonerate produced no output (only if option -genewise_to_be_sure is active)
@@ -197,7 +215,7 @@ selenoprofiles assess   : compare an input gene annotation with selenoprofiles o
 -add              +       provide a file with python code that is executed before the pipeline flow. It can be used to customize selenoprofiles (see manual)
 -clean                    remove intermediate files (blast, exonerate, genewise etc), to save disk space. Use only for non-parallelized run of selenoprofiles, or making sure that results are stored in the db before cleaning
 -filtered_blast_file  +   write an output file with all blast hits passing the blast filter. Useful for refining filters
--blast_filtering_warning  active by default. When too many blast hits pass filtering for a profile, normally the program prints a warning and goes on with the first blast hits encountered. If you turn this option off, in these cases the program will crash instead
+-blast_filtering_warning  active by default. When too many blast hits pass filtering for a profile, normally the program prints a warning and goes on with the best blast hits (lowest evalue) among all those passing filtering. If you turn this option off, in these cases the program will crash instead
 -debug                    if an error occurs, instead of crashing directly, it prints a preview of the error, then waits for keyboard input before exiting. Useful when debugging to inspect the files in the temporary folder (deleted when exiting)
 -print_commands           print to screen every bash command before running it. Extremely verbose
 
@@ -249,6 +267,7 @@ As an example, see the SELENO keyword for attributes blast_options, exonerate_op
 .go_terms              list of GO terms (as "GO:XXXXXXX" strings) used by the go_score method, for gene ontology/tag blast based filtering (see manual). e.g. ['GO:0004364']
 .uniref2go_db          path to the file mapping the GO terms to the proteins in the tag_db. Used for go_score 
 .blast_options/exonerate_options/genewise_options         command line options used when running psitblastn/exonerate/genewise for this profile
+.blast_backend         programs running the blast searches for this profile (blastall or blast+), overriding option -blast_backend
 
 """
 
@@ -316,14 +335,23 @@ def load(config_filename, args={}, partial=False, override_args={}):
         "download",
         "setup",
         "y",
+        "profile_workers",
+        "blast_workers",
+        "blast_backend",
+        "batch",
+        "chromosome_cache",
+        "blast_cache",
+        "blast_cache_size",
+        "twobit",
     ]
     for keyword in allowed_output_formats:
         non_config_options.extend(["output_" + keyword + "_file", "output_" + keyword])
     # reading configuration file
     def_opt = configuration_file(config_filename)
     # complete list of global variables
-    global families_sets, keywords, opt, sleep_time, max_attempts_database, temp_folder, split_folder, bin_folder, profiles_folder, target_file, reference_genome_filename, three_prime_length, five_prime_length, profiles_names, profiles_hash, results_folder, target_name, target_species, target_results_folder, results_db_file, results_db, actions, blast_folder, exonerate_folder, genewise_folder, prediction_choice_folder, filtered_list_folder, output_folder, blast_nr_folder, target_file_index, chromosome_length_file, exonerate_extension, genewise_extension, genewise_tbs_extension, blast_options, exonerate_options, genewise_options, genewise_tbs_options, output_file_handlers, max_chars_per_column
-    # global families_sets, keywords, sleep_time, max_attempts_database, temp_folder, split_folder, bin_folder, profiles_folder, target_file, reference_genome_filename, three_prime_length, five_prime_length, profiles_names, profiles_hash, results_folder, target_name, target_species, target_results_folder, results_db_file, results_db, actions, blast_folder, exonerate_folder, genewise_folder, prediction_choice_folder, filtered_list_folder, output_folder, blast_nr_folder, target_file_index, chromosome_length_file, exonerate_extension, genewise_extension, genewise_tbs_extension, blast_options, exonerate_options, genewise_options, genewise_tbs_options, output_file_handlers, max_chars_per_column
+    # target_file, results_folder and the other target-specific variables are set in set_target
+    global families_sets, keywords, opt, sleep_time, max_attempts_database, temp_folder, split_folder, bin_folder, profiles_folder, three_prime_length, five_prime_length, profiles_names, profiles_hash, actions, exonerate_extension, genewise_extension, genewise_tbs_extension, blast_options, exonerate_options, genewise_options, genewise_tbs_options, output_file_handlers, max_chars_per_column, blast_cache, keywords_text
+    # global families_sets, keywords, sleep_time, max_attempts_database, temp_folder, split_folder, bin_folder, profiles_folder, target_file, reference_genome_filename, three_prime_length, five_prime_length, profiles_names, profiles_hash, results_folder, target_name, target_species, target_results_folder, results_db_file, results_db, actions, blast_folder, exonerate_folder, genewise_folder, prediction_choice_folder, filtered_list_folder, output_folder, blast_nr_folder, target_file_index, exonerate_extension, genewise_extension, genewise_tbs_extension, blast_options, exonerate_options, genewise_options, genewise_tbs_options, output_file_handlers, max_chars_per_column
     # nonlocal opt
 
     # write(opt, 1, how='magenta') ### debug 2023
@@ -529,8 +557,38 @@ def load(config_filename, args={}, partial=False, override_args={}):
             split_folder = temp_folder
         test_writeable_folder(split_folder, "split_folder")
         set_MMlib_var("split_folder", split_folder)
+        set_MMlib_var("chromosome_cache_size", parse_size(opt["chromosome_cache"]))
+        if opt["blast_cache"]:
+            blast_cache = file_cache(
+                opt["blast_cache"], max_bytes=parse_size(opt["blast_cache_size"])
+            )
+            blast_cache.description = "blast cache"
+        set_MMlib_var("use_twobit", bool(opt["twobit"]))
         bin_folder = Folder(opt["bin_folder"])
         set_MMlib_var("bin_folder", bin_folder)
+        # resolving external programs only once; their paths and versions are then reused by all modules (see tool_registry in MMlib)
+        if not opt["blast_backend"]:
+            opt["blast_backend"] = "blastall"
+        if opt["blast_backend"] not in blast_backends:
+            raise notracebackException(
+                "selenoprofiles ERROR unknown blast backend: "
+                + str(opt["blast_backend"])
+                + " ; possible values for option -blast_backend are: "
+                + join(sorted(blast_backends), ", ")
+            )
+        programs_not_found = resolve_tools(
+            blast_backends[opt["blast_backend"]].programs
+            + ["formatdb", "gawk"]
+            + ["exonerate"] * (not opt["dont_exonerate"])
+            + ["genewise"] * (not opt["dont_genewise"])
+        )
+        if programs_not_found:
+            raise notracebackException(
+                "selenoprofiles ERROR these programs were not found: "
+                + join(programs_not_found, " ")
+                + "\nPlease install them, or provide the folder containing them with option -bin_folder"
+                + " (exonerate and genewise can be skipped with options -dont_exonerate and -dont_genewise)"
+            )
         # 2023#
         # check_directory_presence(profiles_folder, 'profiles_folder', notracebackException)
 
@@ -538,9 +596,7 @@ def load(config_filename, args={}, partial=False, override_args={}):
             set_genetic_code(opt["genetic_code"])
             opt["tblastn"] = 1
             if not opt["dont_exonerate"]:
-                exonerate_version = float(
-                    bash("exonerate --version")[1].split("\n")[0].split()[-1][:3]
-                )
+                exonerate_version = float(tool_version("exonerate").split()[-1][:3])
                 if exonerate_version < 2.4:
                     raise notracebackException(
                         "ERROR exonerate version detected: {}\nAlternative genetic codes are bugged in exonerate versions <2.4!\nPlease download and install exonerate version 2.4.0 if you want to use -genetic_code".format(
@@ -560,14 +616,17 @@ def load(config_filename, args={}, partial=False, override_args={}):
         #  for  k  in  keywords['genewise_options']:     keywords['genewise_options'][k]=keywords['genewise_options'][k].format(GENETIC_CODE=1)
 
         ###############
-        ##### setting target
-        target_file = opt["t"]
-        check_file_presence(target_file, "target file", notracebackException)
-        target_file = abspath(target_file)
-        reference_genome_filename = target_file
-        set_MMlib_var(
-            "reference_genome_filename", target_file
-        )  # to allow some [gene].fasta_sequence() calls without specifying the genome file. see [blasthit].place_selenocysteine() using [blasthit].cds()
+        ##### checking target; the rest is done in set_target, after loading profiles
+        global batch_targets
+        batch_targets = []
+        if opt["batch"]:
+            if opt["name"] or opt["outfolder"]:
+                raise notracebackException(
+                    "ERROR options -name and -outfolder cannot be used together with -batch"
+                )
+            batch_targets = load_batch_manifest(opt["batch"])
+            opt["t"], opt["species"] = batch_targets[0]
+        check_target_presence(opt["t"])
         three_prime_length = opt["three_prime_length"]
         set_MMlib_var("three_prime_length", three_prime_length)
         five_prime_length = opt["five_prime_length"]
@@ -679,99 +738,6 @@ def load(config_filename, args={}, partial=False, override_args={}):
     # filtering state
     if not opt["state"]:
         opt["state"] = "kept"
-    ## determining target name and output folders
-    results_folder = Folder(opt["o"])
-    if not opt["outfolder"]:
-        test_writeable_folder(results_folder, "selenoprofiles results folder")
-    if opt["name"]:
-        target_name = opt["name"]
-    else:
-        target_name = base_filename(target_file)
-        if target_name.split(".")[-1] in ["fasta", "fa"]:
-            target_name = join(target_name.split(".")[:-1], ".")
-    target_name = replace_chars(target_name, ".", "_")
-    # species_library=opt['species_library']; check_file_presence(species_library, 'species_library'); set_MMlib_var('species_library', species_library)  ## this will be used for getting species name
-    ## database for output,   linking to species
-    target_species = None
-    set_species_from_previous_run = False
-    if not target_name == "genome" and not opt["species"]:
-        ### no species information provided!
-        # checking if there's a results subfolder with results on the same target, so we can use the same species
-        service(
-            "no species provided. searching existing folders for a previous run on the same target... "
-        )
-        target_links_found = bbash(
-            "find "
-            + results_folder
-            + " -maxdepth 2 -mindepth 2 -name link_target.fa -type l "
-        ).split("\n")
-        if target_links_found == [""]:
-            target_links_found = []
-        for possible_target_link in target_links_found:
-            try:
-                possible_target_file = dereference(possible_target_link)
-                if possible_target_file == target_file:
-                    masked_species_name = possible_target_link.split("/")[-2].split(
-                        "."
-                    )[0]
-                    # taxid, library_species_name= get_species_from_library(    unmask_characters( replace(masked_species_name, '_', ' ') )     )
-                    # target_species=species( library_species_name );  target_species.taxid = taxid
-                    target_species = unmask_species(masked_species_name)
-                    write(
-                        "Previous run on the same target found. Species name: "
-                        + str(target_species),
-                        1,
-                    )
-                    set_species_from_previous_run = True
-                    break
-            except:
-                raise
-        if not set_species_from_previous_run:
-            ## if we didn't find it, we set species to unidentified, printing a warning
-            target_species = "unidentified"
-            printerr('WARNING no species name provided! Using: "unidentified"', 1)
-    else:
-        ### something provided; either the target is called genome, so we can derive the species name from the folder, or the option -species (-s) was provided. setting variable species_name, which may be converted to ncbi syntax
-        if target_name == "genome" and not opt["species"]:
-            target_species = abspath(target_file).split("/")[-2]
-        elif opt["species"]:
-            target_species = opt["species"]
-        else:
-            target_species = "unidentified"
-        if "_" in target_species or "{ch" in target_species:
-            target_species = unmask_species(target_species)
-    #    try:
-    #      taxid, library_species_name= get_species_from_library( species_name )
-    #      if not library_species_name in  [species_name, unmask_characters(species_name), unmask_characters(replace_chars(species_name, '_', ' '))]:
-    #        printerr('WARNING species name '+species_name+' changed to ncbi-defined scientific name: '+library_species_name, 1)
-    #      target_species=species( library_species_name )
-    #      target_species.taxid=taxid
-    #    except Exception:
-    #      raise notracebackException, 'ERROR species not recognized! Only ncbi taxonomy names are accepted'
-
-    ## if species name is unidentified, we make a uniq target name to be sure not to overwrite results
-    if target_species == "unidentified":
-        target_name = uniq_id_for_file(target_file)
-    target_results_folder = Folder(
-        results_folder + mask_species(target_species) + "." + target_name
-    )  # if you change this, change above as well, in the end of mv command
-
-    results_db_file = target_results_folder + "results.sqlite"
-    if not opt["no_db"]:
-        results_db = selenoprofiles_db(results_db_file)
-        if not results_db.has_table("results"):
-            results_db.initialise_db()  # creating database if necessary
-            write("DATABASE", how=terminal_colors["database"])
-            write(" initialising: " + results_db_file, 1)
-        results_db.update_to_last_version()  # attempt updating database from last versions of selenoprofiles if necessary
-
-    link_target_file = target_results_folder + "link_target.fa"
-    if not is_file(link_target_file):
-        write("Creating link:  " + link_target_file + "   --> " + target_file, 1)
-        bash(
-            "rm " + link_target_file
-        )  # if we entered here because link is broken, cleaning up and relinking
-        bbash("ln -fs " + target_file + " " + link_target_file)
 
     # preparing actions hash. keys of actions are categories (pre_filtering, post_filtering), and their values are hashes. Keys of these hashes are ids (can be anything) which are evaluated in alphabetical order (the sorted() function is used). Values corresponding to such keys are strings which are executed in the python environment, denoting the chosen_hit object with "x"
     actions = {}
@@ -808,134 +774,7 @@ def load(config_filename, args={}, partial=False, override_args={}):
                 )
             actions[category][action_id] = opt[k]
 
-    # setting folders depending on keep_ options
-    blast_folder = Folder(target_results_folder + "blast")
-    exonerate_folder = Folder(target_results_folder + "exonerate")
-    genewise_folder = Folder(target_results_folder + "genewise")
-    prediction_choice_folder = Folder(target_results_folder + "prediction_choice")
-    filtered_list_folder = Folder(target_results_folder + "filtering")
-    output_folder = Folder(target_results_folder + "output")
-    if opt["outfolder"]:
-        output_folder = Folder(opt["outfolder"])
-        test_writeable_folder(output_folder, "outfolder")
-    blast_nr_folder = Folder(target_results_folder + "tag_blast")
-
-    ## indexing and formatting if necessary
-    # fastaindex
-    target_file_index = join(target_file.split(".")[:-1], ".") + ".index"
-    index_in_progress_file = (
-        join(target_file.split(".")[:-1], ".") + ".index_in_progress"
-    )
-    if not is_file(target_file_index) and not is_file(index_in_progress_file):
-        write_to_file(
-            "look in " + temp_folder, index_in_progress_file
-        )  ## creating file to indicate we're computing the index
-        write("Indexing " + target_file + " with fastaindex ... ", 1)
-        try:
-            target_file_index = fastaindex(target_file, silent=True)
-            bbash("rm " + index_in_progress_file)
-        except:
-            bash("rm " + index_in_progress_file)
-            raise
-    elif is_file(index_in_progress_file):
-        index_waited = 0
-        while is_file(index_in_progress_file):
-            write(
-                "Another instance of selenoprofiles is computing the index of "
-                + target_file
-                + " ; waiting ...",
-                1,
-            )
-            index_waited += 1
-            time.sleep(sleep_time)
-            service("waited: " + str(sleep_time * index_waited) + " seconds ")
-        if not is_file(target_file_index):
-            raise notracebackException(
-                "ERROR after waiting, the index was not found : " + target_file_index
-            )
-    # formatdb
-    formatdb_in_progress_file = (
-        join(target_file.split(".")[:-1], ".") + ".formatdb_in_progress"
-    )
-    if bash("ls " + target_file + ".*nin")[0]:
-        write_to_file(
-            "look in " + temp_folder, formatdb_in_progress_file
-        )  ## creating file to indicate we're computing with formatdb
-        write("Formatting " + target_file + " with formatdb ... ", 1)
-        try:
-            formatdb(target_file, is_protein=False, silent=True)
-            bbash("rm " + formatdb_in_progress_file)
-        except:
-            bash("rm " + formatdb_in_progress_file)
-            raise
-    elif is_file(formatdb_in_progress_file):
-        index_waited = 0
-        while is_file(formatdb_in_progress_file):
-            write(
-                "Another instance of selenoprofiles is formatting "
-                + target_file
-                + " ; waiting ...",
-                1,
-            )
-            index_waited += 1
-            time.sleep(sleep_time)
-            service("waited: " + str(sleep_time * index_waited) + " seconds ")
-        if bash("ls " + target_file + ".*nin")[0]:
-            raise notracebackException(
-                "ERROR after waiting, the file produced by formatdb were not found : "
-                + target_file
-                + ".*nin"
-            )
-    # chromosome lenghts
-    chromosome_length_file = join(target_file.split(".")[:-1], ".") + ".lengths"
-    chromosome_length_in_progress_file = (
-        join(target_file.split(".")[:-1], ".") + ".lengths_in_progress"
-    )
-    if not is_file(chromosome_length_file) and not is_file(
-        chromosome_length_in_progress_file
-    ):
-        write_to_file(
-            "look in " + temp_folder, chromosome_length_in_progress_file
-        )  ## creating file to indicate we're computing the index
-        write(
-            "Computing length of all sequences in "
-            + target_file
-            + " --> "
-            + chromosome_length_file,
-            1,
-        )
-        try:
-            bbash(
-                "fastalength "
-                + target_file
-                + " > "
-                + temp_folder
-                + "chrom_lengths && mv "
-                + temp_folder
-                + "chrom_lengths "
-                + chromosome_length_file
-            )
-            bbash("rm " + chromosome_length_in_progress_file)
-        except:
-            bbash("rm " + chromosome_length_in_progress_file)
-            raise
-    elif is_file(chromosome_length_in_progress_file):
-        index_waited = 0
-        while is_file(chromosome_length_in_progress_file):
-            write(
-                "Another instance of selenoprofiles is computing the length of the sequences in "
-                + target_file
-                + " ; waiting ...",
-                1,
-            )
-            index_waited += 1
-            time.sleep(sleep_time)
-            service("waited: " + str(sleep_time * index_waited) + " seconds ")
-        if not is_file(chromosome_length_file):
-            raise notracebackException(
-                "ERROR after waiting, the sequence lengths file was not found : "
-                + chromosome_length_file
-            )
+    set_target()
 
     # handling no_splice option
     if opt["no_splice"]:
@@ -1084,6 +923,9 @@ def load(config_filename, args={}, partial=False, override_args={}):
             + other_options
             + "\n"
         )
+    summary += "|\n##########      External programs:\n"
+    for line in tool_registry_report().split("\n"):
+        summary += "| " + line + "\n"
     summary += "|\n##########      Output options:   "
     if output_options:
         for o in output_options:
@@ -1095,6 +937,295 @@ def load(config_filename, args={}, partial=False, override_args={}):
     return summary
 
 
+def load_batch_manifest(manifest_file):
+    """Reads the file provided with option -batch: one target per line, with the path to the target file followed by the species name (optional; see option -s). Empty lines and lines starting with # are skipped.
+    Returns a list of [target_file, species]"""
+    check_file_presence(manifest_file, "batch manifest file", notracebackException)
+    batch_targets = []
+    for line in open(manifest_file, "r"):
+        if not line.strip() or line.startswith("#"):
+            continue
+        splt = line.split(None, 1)
+        batch_target_file = splt[0]
+        check_target_presence(batch_target_file)
+        if len(splt) > 1:
+            batch_species = splt[1].strip()
+        else:
+            batch_species = ""
+        batch_targets.append([batch_target_file, batch_species])
+    if not batch_targets:
+        raise notracebackException(
+            "ERROR no targets found in batch manifest file: " + manifest_file
+        )
+    return batch_targets
+
+
+def set_target():
+    """Set all global variables relative to the target (opt['t'], opt['species']): target name and species, output folders, results database, and blast formatting and index of the target file (computed if necessary)"""
+    global target_file, reference_genome_filename, results_folder, target_name, target_species, target_results_folder, results_db_file, results_db, blast_folder, exonerate_folder, genewise_folder, prediction_choice_folder, filtered_list_folder, output_folder, blast_nr_folder, checkpoint_folder, target_file_index
+    ##### setting target
+    target_file = opt["t"]
+    target_bundle = None
+    if is_target_bundle(target_file):
+        # built by selenoprofiles prepare: the target file is inside the bundle, with all its preparation steps already done
+        target_bundle = load_target_bundle(target_file)
+        target_file = target_bundle["target"]
+    check_file_presence(target_file, "target file", notracebackException)
+    target_file = abspath(target_file)
+    reference_genome_filename = target_file
+    set_MMlib_var(
+        "reference_genome_filename", target_file
+    )  # to allow some [gene].fasta_sequence() calls without specifying the genome file. see [blasthit].place_selenocysteine() using [blasthit].cds()
+
+    ## determining target name and output folders
+    results_folder = Folder(opt["o"])
+    if not opt["outfolder"]:
+        test_writeable_folder(results_folder, "selenoprofiles results folder")
+    if opt["name"]:
+        target_name = opt["name"]
+    elif target_bundle:
+        target_name = target_bundle["name"]
+    else:
+        target_name = base_filename(target_file)
+        if target_name.split(".")[-1] == "gz":
+            target_name = join(target_name.split(".")[:-1], ".")
+        if target_name.split(".")[-1] in ["fasta", "fa"]:
+            target_name = join(target_name.split(".")[:-1], ".")
+    target_name = replace_chars(target_name, ".", "_")
+    # species_library=opt['species_library']; check_file_presence(species_library, 'species_library'); set_MMlib_var('species_library', species_library)  ## this will be used for getting species name
+    ## database for output,   linking to species
+    target_species = None
+    set_species_from_previous_run = False
+    if not target_name == "genome" and not opt["species"]:
+        ### no species information provided!
+        # checking if there's a results subfolder with results on the same target, so we can use the same species
+        service(
+            "no species provided. searching existing folders for a previous run on the same target... "
+        )
+        target_links_found = [
+            possible_target_link
+            for possible_target_link in matching_files(
+                results_folder + "*/link_target.fa"
+            )
+            if os.path.islink(possible_target_link)
+        ]
+        for possible_target_link in target_links_found:
+            try:
+                possible_target_file = dereference(possible_target_link)
+                if possible_target_file == target_file:
+                    masked_species_name = possible_target_link.split("/")[-2].split(
+                        "."
+                    )[0]
+                    # taxid, library_species_name= get_species_from_library(    unmask_characters( replace(masked_species_name, '_', ' ') )     )
+                    # target_species=species( library_species_name );  target_species.taxid = taxid
+                    target_species = unmask_species(masked_species_name)
+                    write(
+                        "Previous run on the same target found. Species name: "
+                        + str(target_species),
+                        1,
+                    )
+                    set_species_from_previous_run = True
+                    break
+            except:
+                raise
+        if not set_species_from_previous_run:
+            ## if we didn't find it, we set species to unidentified, printing a warning
+            target_species = "unidentified"
+            printerr('WARNING no species name provided! Using: "unidentified"', 1)
+    else:
+        ### something provided; either the target is called genome, so we can derive the species name from the folder, or the option -species (-s) was provided. setting variable species_name, which may be converted to ncbi syntax
+        if target_name == "genome" and not opt["species"]:
+            if target_bundle:
+                target_species = target_bundle["source"].split("/")[-2]
+            else:
+                target_species = abspath(target_file).split("/")[-2]
+        elif opt["species"]:
+            target_species = opt["species"]
+        else:
+            target_species = "unidentified"
+        if "_" in target_species or "{ch" in target_species:
+            target_species = unmask_species(target_species)
+    #    try:
+    #      taxid, library_species_name= get_species_from_library( species_name )
+    #      if not library_species_name in  [species_name, unmask_characters(species_name), unmask_characters(replace_chars(species_name, '_', ' '))]:
+    #        printerr('WARNING species name '+species_name+' changed to ncbi-defined scientific name: '+library_species_name, 1)
+    #      target_species=species( library_species_name )
+    #      target_species.taxid=taxid
+    #    except Exception:
+    #      raise notracebackException, 'ERROR species not recognized! Only ncbi taxonomy names are accepted'
+
+    ## if species name is unidentified, we make a uniq target name to be sure not to overwrite results
+    if target_species == "unidentified":
+        target_name = uniq_id_for_file(target_file)
+    target_results_folder = Folder(
+        results_folder + mask_species(target_species) + "." + target_name
+    )  # if you change this, change above as well, in the end of mv command
+
+    results_db_file = target_results_folder + "results.sqlite"
+    if not opt["no_db"]:
+        results_db = selenoprofiles_db(results_db_file)
+        if not results_db.has_table("results"):
+            results_db.initialise_db()  # creating database if necessary
+            write("DATABASE", how=terminal_colors["database"])
+            write(" initialising: " + results_db_file, 1)
+        results_db.update_to_last_version()  # attempt updating database from last versions of selenoprofiles if necessary
+
+    link_target_file = target_results_folder + "link_target.fa"
+    if not is_file(link_target_file):
+        write("Creating link:  " + link_target_file + "   --> " + target_file, 1)
+        link_file(
+            target_file, link_target_file
+        )  # if we entered here because link is broken, cleaning up and relinking
+
+    # setting folders depending on keep_ options
+    blast_folder = Folder(target_results_folder + "blast")
+    exonerate_folder = Folder(target_results_folder + "exonerate")
+    genewise_folder = Folder(target_results_folder + "genewise")
+    prediction_choice_folder = Folder(target_results_folder + "prediction_choice")
+    filtered_list_folder = Folder(target_results_folder + "filtering")
+    output_folder = Folder(target_results_folder + "output")
+    if opt["outfolder"]:
+        output_folder = Folder(opt["outfolder"])
+        test_writeable_folder(output_folder, "outfolder")
+    blast_nr_folder = Folder(target_results_folder + "tag_blast")
+    checkpoint_folder = Folder(target_results_folder + "checkpoints")
+
+    ## indexing and formatting if necessary
+    # all instances running on the same target coordinate through a lock and a manifest of the preparation steps completed (see prepare_target)
+    prepare_target()
+    # target index (.seqinfo): sequence lengths, offsets and checksum of the target, computed in a single pass (see indexed_fasta in MMlib)
+    target_file_index = get_indexed_fasta(target_file).index_file
+
+
+target_preparation_steps = ["index", "twobit", "formatdb"]
+
+
+def target_file_id(target_file):
+    """Returns the size and modification time (in ns) of the target file, as strings: they identify its version in the manifest of preparation steps and in target bundles"""
+    target_stat = os.stat(target_file)
+    return [str(target_stat.st_size), str(target_stat.st_mtime_ns)]
+
+
+def prepared_target_steps(manifest_file):
+    """Returns the set of preparation steps recorded in the manifest file as completed for the current version of the target file (same size and modification time)"""
+    if not is_file(manifest_file):
+        return set()
+    current_target_id = target_file_id(target_file)
+    return set(
+        [
+            line.split()[0]
+            for line in open(manifest_file)
+            if len(line.split()) == 3 and line.split()[1:] == current_target_id
+        ]
+    )
+
+
+def prepare_target():
+    """Runs the preparation steps needed for the target file (see target_preparation_steps): its index, its .2bit version (only with option -twobit), and its blast formatting.
+    The steps completed are recorded in a manifest next to the target ([target].prepared), so that other instances find them ready. Steps are run while holding a lock on [target].lock (see file_lock in MMlib): instances arriving meanwhile wait and start as soon as the lock is released, and a crashed instance does not block the others; its incomplete steps are run again by the next one.
+    If the folder of the target is not writeable, the lock is taken in the temporary folder and the manifest is not written
+    """
+    steps_needed = [
+        step for step in target_preparation_steps if step != "twobit" or opt["twobit"]
+    ]
+    manifest_file = target_file + ".prepared"
+    if not [
+        step
+        for step in steps_needed
+        if not step in prepared_target_steps(manifest_file)
+    ]:
+        return
+    if os.access(directory_name(abspath(target_file)), os.W_OK):
+        lock_file = target_file + ".lock"
+    else:
+        lock_file = temp_folder + "target.lock"
+    with file_lock(
+        lock_file,
+        wait_message="Another instance of selenoprofiles is preparing "
+        + target_file
+        + " ; waiting ...",
+    ):
+        steps_done = prepared_target_steps(
+            manifest_file
+        )  # possibly by the instance we waited for
+        for step in steps_needed:
+            if step in steps_done:
+                continue
+            if step == "index":
+                write("Indexing " + target_file + " ... ", 1)
+                get_indexed_fasta(target_file)
+            elif step == "twobit":
+                # packed copy of the target, used to read all sequences (see twobit_genome in MMlib)
+                write("Loading 2bit version of " + target_file + " ... ", 1)
+                get_genome_reader(target_file)
+            elif step == "formatdb":
+                if not matching_files(target_file + ".*nin") or os.path.getmtime(
+                    matching_files(target_file + ".*nin")[0]
+                ) < os.path.getmtime(target_file):
+                    write("Formatting " + target_file + " with formatdb ... ", 1)
+                    formatdb(target_file, is_protein=False, silent=True)
+            try:
+                with open(manifest_file, "a") as manifest_fh:
+                    manifest_fh.write(
+                        join([step] + target_file_id(target_file), " ") + "\n"
+                    )
+            except OSError:
+                pass  # folder of the target not writeable
+
+
+target_bundle_manifest = "bundle.manifest"
+target_bundle_format = "1"
+
+
+def is_target_bundle(path):
+    """Returns True if path is a folder containing a target bundle, built with selenoprofiles prepare"""
+    return is_directory(path) and is_file(
+        path.rstrip("/") + "/" + target_bundle_manifest
+    )
+
+
+def check_target_presence(target):
+    """Checks that the target provided (option -t or -batch) is an existing fasta file or target bundle"""
+    if not is_target_bundle(target):
+        check_file_presence(target, "target file", notracebackException)
+
+
+def load_target_bundle(bundle_folder):
+    """Reads the manifest of a target bundle built with selenoprofiles prepare, returning its fields as a dictionary; the value of "target" is converted to the absolute path of the target file inside the bundle.
+    Bundles of a different format, or whose target file was changed after they were built, are refused
+    """
+    bundle_folder = abspath(bundle_folder).rstrip("/") + "/"
+    target_bundle = {}
+    for line in open(bundle_folder + target_bundle_manifest):
+        if "\t" in line:
+            key, value = line.rstrip("\n").split("\t", 1)
+            target_bundle[key] = value
+    if target_bundle.get("format") != target_bundle_format:
+        raise notracebackException(
+            "ERROR target bundle "
+            + bundle_folder
+            + " has format "
+            + str(target_bundle.get("format"))
+            + " while this version of selenoprofiles reads format "
+            + target_bundle_format
+            + ". Build it again with selenoprofiles prepare"
+        )
+    target_bundle["target"] = bundle_folder + target_bundle["target"]
+    check_file_presence(
+        target_bundle["target"], "target file of bundle", notracebackException
+    )
+    if target_file_id(target_bundle["target"]) != [
+        target_bundle["size"],
+        target_bundle["mtime_ns"],
+    ]:
+        raise notracebackException(
+            "ERROR the target file of bundle "
+            + bundle_folder
+            + " was modified after the bundle was built. Build it again with selenoprofiles prepare"
+        )
+    return target_bundle
+
+
 def mask_species(species_name):
     return replace(mask_characters(species_name), " ", "_")
 
@@ -1103,56 +1234,43 @@ def unmask_species(species_name):
     return unmask_characters(replace(species_name, "_", " "))
 
 
-def load_chromosome_lengths(chromosome_length_file, max_chars=0):
-    """Utility to load chromosome lenghts from a fastalength output file and also set it as a MMlib variable; also performing controls on the file"""
+def load_chromosome_lengths(target_fasta, max_chars=0):
+    """Utility to load chromosome lenghts from the index of the target (an indexed_fasta object, see MMlib) and also set it as a MMlib variable; also performing controls on the sequence identifiers. Duplicate identifiers are already refused when the index is built"""
     global chromosome_lengths
     chromosome_lengths = {}
-    for line in open(chromosome_length_file, "r"):
-        fasta_identifier = line.split()[1]
-        length = int(line.split()[0])
-        if fasta_identifier in chromosome_lengths:
-            bash("rm " + chromosome_length_file)
-            raise notracebackException(
-                "ERROR the target file has a duplicate fasta identifier! ("
-                + line.split()[1]
-                + ") Please modify it and rerun. Note: remove the .index and *.fa.n* blast formatting files after changing the target file"
-            )
+    for fasta_identifier in target_fasta.names:
+        length = target_fasta.index[fasta_identifier][0]
         if length == 0:
-            bash("rm " + chromosome_length_file)
             raise notracebackException(
                 "ERROR the target file has a length zero entry! ("
-                + line.split()[1]
-                + ") Please modify it and rerun. Note: remove the .index and *.fa.n* blast formatting files after changing the target file"
+                + fasta_identifier
+                + ") Please modify it and rerun. Note: remove the *.fa.n* blast formatting files after changing the target file"
             )
         if is_number(fasta_identifier) and fasta_identifier[0] == "0":
-            bash("rm " + chromosome_length_file)
             raise notracebackException(
                 "ERROR the target file has a numeric fasta identifier starting with zero!  ("
-                + line.split()[1]
-                + ") This would cause an unexpected blast behavior. Please modify this or these ids and rerun. Note: remove the .index and *.fa.n* blast formatting files after changing the target file"
+                + fasta_identifier
+                + ") This would cause an unexpected blast behavior. Please modify this or these ids and rerun. Note: remove the *.fa.n* blast formatting files after changing the target file"
             )
         if ":subseq(" in fasta_identifier:
-            bash("rm " + chromosome_length_file)
             raise notracebackException(
                 "ERROR with fasta header: "
                 + fasta_identifier
-                + ' ; this was generated by fastasubseq and will cause unexpected behavior of this program, since it is using fastasubseq itself to cut sequences. Please clean the titles in your target file from ":subseq(" tags. Note: remove the .index and *.fa.n* blast formatting files after changing the target file '
+                + ' ; this was generated by fastasubseq and will cause unexpected behavior of this program, since it is using fastasubseq itself to cut sequences. Please clean the titles in your target file from ":subseq(" tags. Note: remove the *.fa.n* blast formatting files after changing the target file '
             )
         if max_chars and len(fasta_identifier) > max_chars:
-            bash("rm " + chromosome_length_file)
             raise notracebackException(
                 "ERROR with fasta header: "
                 + fasta_identifier
                 + " is too long. The maximum length for a fasta identifier (first word of the title) is "
                 + str(max_chars)
-                + " characters. Please clean the titles in your target file. Note: remove the .index and *.fa.n* blast formatting files after changing the target file"
+                + " characters. Please clean the titles in your target file. Note: remove the *.fa.n* blast formatting files after changing the target file"
             )
         if "/" in fasta_identifier:
-            bash("rm " + chromosome_length_file)
             raise notracebackException(
                 "ERROR with fasta header: "
                 + fasta_identifier
-                + ' has forbidden character: "/" \nPlease clean the titles in your target file. Note: remove the .index and *.fa.n* blast formatting files after changing the target file'
+                + ' has forbidden character: "/" \nPlease clean the titles in your target file. Note: remove the *.fa.n* blast formatting files after changing the target file'
             )
 
         chromosome_lengths[fasta_identifier] = length
@@ -1199,6 +1317,20 @@ size_names = [
 ]
 
 
+def parse_size(size_string, system=size_names):
+    """Reverse of human_readable_size: returns the number of bytes for a string like 500M or 2G (or a plain number of bytes)"""
+    size_string = str(size_string).strip().upper().rstrip("B")
+    for factor, suffix in system:
+        if suffix != "B" and size_string.endswith(suffix):
+            return int(float(size_string[: -len(suffix)]) * factor)
+    try:
+        return int(float(size_string)) if size_string else 0
+    except ValueError:
+        raise notracebackException(
+            "selenoprofiles ERROR cannot parse size: " + size_string
+        )
+
+
 def human_readable_size(bytes, system=size_names):
     """Human-readable file size.
     Using the traditional system, where a factor of 1024 is used::     >>> size(10)    '10B'
@@ -1285,7 +1417,7 @@ def main():
     write("", 1)
     write("|         ")
     write("selenoprofiles v" + str(__version__), how="reverse")
-    write("          Host: " + bbash("echo $HOSTNAME") + "   Date: " + bbash("date"), 1)
+    write("          Host: " + socket.gethostname() + "   Date: " + date_string(), 1)
 
     config_filename = home_config_filename
 
@@ -1529,7 +1661,7 @@ def main():
         load(config_filename, partial=3)  # , override_args=override_args)
         run_build_profile(build_opt, selenoprofiles_config)
 
-        write("\nselenoprofiles build completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles build completed.   Date: " + date_string(), 1)
         sys.exit()
 
     if len(sys.argv) > 1 and sys.argv[1] == "drawer":
@@ -1564,7 +1696,7 @@ def main():
         # run_build_profile(build_opt, selenoprofiles_config)
         run_drawer(drawer_opt)
 
-        write("\nselenoprofiles drawer completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles drawer completed.   Date: " + date_string(), 1)
         sys.exit()
 
     if len(sys.argv) > 1 and sys.argv[1] == "database":
@@ -1587,7 +1719,7 @@ def main():
 
         run_database(db_opt)
 
-        write("\nselenoprofiles database completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles database completed.   Date: " + date_string(), 1)
         sys.exit()
 
     # Orthology
@@ -1619,7 +1751,7 @@ def main():
 
         run_orthology(ortho_opt)
 
-        write("\nselenoprofiles orthology completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles orthology completed.   Date: " + date_string(), 1)
         sys.exit()
 
     # Lineage
@@ -1651,7 +1783,7 @@ def main():
 
         run_lineage(lin_opt)
 
-        write("\nselenoprofiles lineage completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles lineage completed.   Date: " + date_string(), 1)
         sys.exit()
 
     # Assess annotations
@@ -1673,7 +1805,73 @@ def main():
 
         run_assess(ass_opt)
 
-        write("\nselenoprofiles assess completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles assess completed.   Date: " + date_string(), 1)
+        sys.exit()
+
+    # Sharding targets
+    if len(sys.argv) > 1 and sys.argv[1] == "shard":
+        from .selenoprofiles_shard import (
+            main as run_shard,
+            def_opt as def_opt_shard,
+            help_msg as help_msg_shard,
+        )
+
+        write("|" + "-" * 119, 1)
+        write("|        Running utility: selenoprofiles shard", 1)
+
+        shard_opt = easyterm.command_line_options(
+            def_opt_shard,
+            help_msg_shard,
+            ["cmd"],  # just to accept "shard"
+        )
+
+        run_shard(shard_opt)
+
+        write("\nselenoprofiles shard completed.   Date: " + date_string(), 1)
+        sys.exit()
+
+    # Building target bundles
+    if len(sys.argv) > 1 and sys.argv[1] == "prepare":
+        from .selenoprofiles_prepare import (
+            main as run_prepare,
+            def_opt as def_opt_prepare,
+            help_msg as help_msg_prepare,
+        )
+
+        write("|" + "-" * 119, 1)
+        write("|        Running utility: selenoprofiles prepare", 1)
+
+        prepare_opt = easyterm.command_line_options(
+            def_opt_prepare,
+            help_msg_prepare,
+            ["cmd"],  # just to accept "prepare"
+        )
+
+        run_prepare(prepare_opt)
+
+        write("\nselenoprofiles prepare completed.   Date: " + date_string(), 1)
+        sys.exit()
+
+    # Benchmarking sequence kernels
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        from .selenoprofiles_benchmark import (
+            main as run_benchmark,
+            def_opt as def_opt_benchmark,
+            help_msg as help_msg_benchmark,
+        )
+
+        write("|" + "-" * 119, 1)
+        write("|        Running utility: selenoprofiles benchmark", 1)
+
+        benchmark_opt = easyterm.command_line_options(
+            def_opt_benchmark,
+            help_msg_benchmark,
+            ["cmd"],  # just to accept "benchmark"
+        )
+
+        run_benchmark(benchmark_opt)
+
+        write("\nselenoprofiles benchmark completed.   Date: " + date_string(), 1)
         sys.exit()
 
     # Testing selenoprofiles
@@ -1688,7 +1886,7 @@ def main():
 
         run_test()
 
-        write("\nselenoprofiles test completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles test completed.   Date: " + date_string(), 1)
         sys.exit()
 
     ######
@@ -1782,7 +1980,7 @@ def main():
             output_folder=output_dir, fam2filelist=fam2filelist, opt=join_opt
         )
 
-        write("\nselenoprofiles join completed.   Date: " + bbash("date"), 1)
+        write("\nselenoprofiles join completed.   Date: " + date_string(), 1)
         sys.exit()
 
     ##### Normal usage  = selenoprofiles
@@ -1790,33 +1988,209 @@ def main():
         config_filename
     )  # loading variables and getting a nice summary to show
 
-    write("\n" + options_summary + "\n", 1)
+    write("\n" + options_summary + "\n", 1)
+
+    if opt[
+        "add"
+    ]:  # with -add  options, the user can add code to be executed right here. This can include the definition of function that will be used in the customized steps
+        added_file = opt["add"]
+        check_file_presence(added_file, "added code file")
+        all_lines_of_added_file = open(added_file, "r").readlines()
+        try:
+            exec(
+                join(all_lines_of_added_file, ""), globals()
+            )  # module namespace, so that added code is visible to the profile search and its actions
+        except:
+            printerr("add ERROR importing code from file : " + added_file)
+            raise
+
+    if not opt["batch"]:
+        search_target()
+        return
+
+    # -batch: profiles were loaded once; preparing their blast files once as well, then searching all targets in the manifest
+    blast_files_folder = Folder(temp_folder + "profiles_blast_files")
+    for family in profiles_names:
+        if profiles_hash[family].nseq() > 1:
+            profiles_hash[family].prepare_blast_files(blast_files_folder)
+    for target_index, (batch_target_file, batch_species) in enumerate(batch_targets):
+        if target_index:
+            opt["t"], opt["species"] = batch_target_file, batch_species
+            set_target()
+            write("\n" + "#" * 120, 1)
+            write("| target file:         " + target_file, 1)
+            write("| target species:      " + str(target_species), 1)
+            write("#" * 120 + "\n", 1)
+        search_target()
+        if not opt["save_chromosomes"]:
+            # chromosomes fetched for this target are not needed anymore
+            shutil.rmtree(
+                fastafetch_filename(split_folder, "", target_file), ignore_errors=True
+            )
+    write(
+        "\nBatch completed: "
+        + str(len(batch_targets))
+        + " targets searched.   Date: "
+        + date_string(),
+        1,
+    )
+
+
+### pipeline stages run for each profile, in order. Each stage is run if forced with its option (e.g. -B), if its output is missing, or if its fingerprint changed since the last run (see stage_fingerprints)
+pipeline_stages = ["blast", "exonerate", "genewise", "choose", "filter", "database"]
+# stage -> stages whose output it reads, and its other inputs: profile attributes, options and categories of actions
+pipeline_stage_graph = {
+    "blast": {
+        "depends_on": [],
+        "profile_attributes": [
+            "blast_options",
+            "clustering_seqid",
+            "max_column_gaps",
+            "blast_backend",
+        ],
+        "options": ["tblastn", "genetic_code", "blast_opt"],
+        "actions": [],
+    },
+    "exonerate": {
+        "depends_on": ["blast"],
+        "profile_attributes": [
+            "blast_filtering",
+            "max_blast_hits",
+            "exonerate_options",
+        ],
+        "options": [
+            "no_splice",
+            "dont_exonerate",
+            "exonerate_extension",
+            "exonerate_opt",
+        ],
+        "actions": ["pre_blast_filter", "post_blast", "post_blast_merge"],
+    },
+    "genewise": {
+        "depends_on": ["exonerate"],
+        "profile_attributes": ["genewise_options"],
+        "options": [
+            "dont_genewise",
+            "genewise_to_be_sure",
+            "genewise_extension",
+            "genewise_tbs_extension",
+            "genewise_opt",
+        ],
+        "actions": [],
+    },
+    "choose": {
+        "depends_on": ["exonerate", "genewise"],
+        "profile_attributes": [],
+        "options": ["no_blast"],
+        "actions": ["pre_choose"],
+    },
+    "filter": {
+        "depends_on": ["choose"],
+        "profile_attributes": ["p2g_filtering", "p2g_refiltering"],
+        "options": [],
+        "actions": ["pre_filtering"],
+    },
+    "database": {
+        "depends_on": ["filter"],
+        "profile_attributes": [],
+        "options": ["full_db"],
+        "actions": ["post_filtering"],
+    },
+}
+
+
+def stage_fingerprints(profile_ali):
+    """Returns a dictionary stage -> fingerprint for all pipeline stages of this profile on the current target. The fingerprint is the md5 of all inputs of the stage (see pipeline_stage_graph) including the profile alignment, the target and the fingerprints of the stages it depends on, so that any change upstream changes also all fingerprints downstream"""
+    common_inputs = [profile_ali.md5sum_id(), target_md5]
+    fingerprints = {}
+    for stage in pipeline_stages:
+        node = pipeline_stage_graph[stage]
+        stage_inputs = common_inputs + [fingerprints[s] for s in node["depends_on"]]
+        for attribute in node["profile_attributes"]:
+            if attribute.endswith("_options"):
+                value = sorted(
+                    profile_ali.options_dict(attribute[: -len("_options")]).items()
+                )
+            elif attribute == "blast_backend":
+                value = profile_ali.blast_backend_value().name
+            else:
+                # keywords (e.g. DEFAULT) are resolved to their configured text, as in filtering_eval
+                value = profile_ali[attribute]
+                if "filtering" in attribute and not value:
+                    value = "DEFAULT"
+                if type(value) == str and value in keywords_text[attribute]:
+                    value = keywords_text[attribute][value]
+            stage_inputs.append(attribute + "=" + repr(value))
+        stage_inputs.extend([o + "=" + repr(opt[o]) for o in node["options"]])
+        stage_inputs.extend(
+            [c + "=" + repr(sorted(actions[c].items())) for c in node["actions"]]
+        )
+        fingerprints[stage] = hashlib.md5(join(stage_inputs, "\n").encode()).hexdigest()
+    return fingerprints
+
+
+def load_stage_fingerprints(family):
+    """Returns the dictionary stage -> fingerprint stored the last time the pipeline was run for this profile on the current target (empty if never stored)"""
+    fingerprints = {}
+    fingerprint_file = checkpoint_folder + family + ".tab"
+    if is_file(fingerprint_file):
+        for line in open(fingerprint_file):
+            if "\t" in line:
+                stage, fingerprint = line.rstrip("\n").split("\t")
+                fingerprints[stage] = fingerprint
+    return fingerprints
+
+
+def save_stage_fingerprints(family, fingerprints):
+    """Stores the fingerprints of the pipeline stages just run for this profile on the current target (see stage_fingerprints)"""
+    fingerprint_file = checkpoint_folder + family + ".tab"
+    write_to_file(
+        join([stage + "\t" + fingerprints[stage] for stage in pipeline_stages], "\n"),
+        fingerprint_file + ".tmp",
+    )
+    move_file(fingerprint_file + ".tmp", fingerprint_file)
+
 
-    if opt[
-        "add"
-    ]:  # with -add  options, the user can add code to be executed right here. This can include the definition of function that will be used in the customized steps
-        added_file = opt["add"]
-        check_file_presence(added_file, "added code file")
-        all_lines_of_added_file = open(added_file, "r").readlines()
-        try:
-            exec(join(all_lines_of_added_file, ""))
-        except:
-            printerr("add ERROR importing code from file : " + added_file)
-            raise
+def stages_to_run(family, fingerprints):
+    """Returns the list of pipeline stages that must be run for this profile (even if their output is present), given the current fingerprints: those forced with their option, and those whose inputs changed since the last run.
+    Since fingerprints propagate downstream, all stages depending on a changed one are also included. Stages without a stored fingerprint (e.g. run by a previous version of selenoprofiles) are not forced
+    """
+    stored_fingerprints = load_stage_fingerprints(family)
+    return [
+        stage
+        for stage in pipeline_stages
+        if opt[stage]
+        or (
+            stage in stored_fingerprints
+            and stored_fingerprints[stage] != fingerprints[stage]
+        )
+    ]
 
-    global max_chars_per_column
+
+def search_target():
+    """Runs the pipeline for all profiles on the current target (see set_target), then produces output"""
+    global max_chars_per_column, target_md5
     global blast_nr_folder_profile_subfolder
-    # computing length of all chromosomes in the target, or just loading it from chromosome_length_file
-    write("Loading length of all chromosomes from " + chromosome_length_file, 1)
-    load_chromosome_lengths(chromosome_length_file)
+    if "blast_nr_folder_profile_subfolder" in globals():
+        del blast_nr_folder_profile_subfolder  # may be left from a previous target, with -batch
+    # length of all chromosomes and checksum of the target are read from its index (see set_target)
+    target_fasta = get_indexed_fasta(target_file)
+    write("Loading length of all chromosomes from " + target_fasta.index_file, 1)
+    load_chromosome_lengths(target_fasta)
     for k in chromosome_lengths:
         if len(k) > max_chars_per_column["chromosome"]:
             max_chars_per_column["chromosome"] = len(k)
 
+    target_md5 = target_fasta.checksum  # used in the fingerprints of pipeline stages
+
     all_results_are_loaded_from_db = True
     chromosomes_with_results = {}  # filled after filtering, when writing in database
     skipped_profiles = {}  # taken off the profiles_names list
-    for profile_index, family in enumerate(profiles_names):
+
+    def search_profile(profile_index, family):
+        """Run the pipeline for a single profile (or load its results from the database). Returns what a -profile_workers child process has to report to the main process: all_results_are_loaded_from_db, chromosomes_with_results, and whether the profile was skipped"""
+        nonlocal all_results_are_loaded_from_db
+        global blast_nr_folder_profile_subfolder
         try:
             # load profile
             profile_ali = profiles_hash[family]
@@ -1847,6 +2221,17 @@ def main():
                     profile_ali.clusters_relative_positions()
                 )  # to convert quickly positions on any cluster query to the corresponding position on the blast master query, we precompute all of them and put them into a hash.
 
+            # determining which stages must be run even if their output is present: forced ones, and those with changed inputs
+            profile_fingerprints = stage_fingerprints(profile_ali)
+            profile_stages_to_run = stages_to_run(family, profile_fingerprints)
+            changed_stages = [s for s in profile_stages_to_run if not opt[s]]
+            if changed_stages:
+                write(
+                    "Inputs changed since last run; running stages: "
+                    + join(changed_stages, " "),
+                    1,
+                )
+
             blast_folder_profile_subfolder = Folder(blast_folder + family)
             # check if this target has already been scanned for this profile.
             if not opt["no_db"]:
@@ -1866,19 +2251,7 @@ def main():
             elif (
                 opt["no_db"]
                 or db_has_results_for_this_profile == "NO"
-                or any(
-                    [
-                        opt[o]
-                        for o in [
-                            "blast",
-                            "exonerate",
-                            "genewise",
-                            "choose",
-                            "filter",
-                            "database",
-                        ]
-                    ]
-                )
+                or profile_stages_to_run
             ):
                 all_results_are_loaded_from_db = False
                 if not opt["no_db"]:
@@ -1899,6 +2272,46 @@ def main():
                 )
                 #### change for tblastn
 
+                # with -blast_workers, searches for the clusters of a multi-sequence profile are run in parallel now; their output files are then parsed below in order of cluster
+                # blast_jobs: cluster_index -> arguments of psitblastn/multi_tblastn
+                blast_jobs = {}
+                if (
+                    opt["blast_workers"]
+                    and opt["blast_workers"] > 1
+                    and profile_ali.nseq() > 1
+                ):
+                    blast_function = {False: psitblastn, True: multi_tblastn}[
+                        bool(opt["tblastn"])
+                    ]
+                    for cluster_index in range(profile_ali.n_clusters()):
+                        blast_outfile = (
+                            blast_folder_profile_subfolder
+                            + family
+                            + ".psitblastn."
+                            + str(cluster_index + 1)
+                        )
+                        if (
+                            "blast" in profile_stages_to_run
+                            or not is_file(blast_outfile)
+                            or not is_valid_blast_output(blast_outfile)
+                        ):
+                            blast_jobs[cluster_index] = {
+                                {False: "profile", True: "ms_profile"}[
+                                    bool(opt["tblastn"])
+                                ]: profile_ali.clusters()[cluster_index],
+                                "target_file": target_file,
+                                "outfile": blast_outfile,
+                            }
+                    if len(blast_jobs) > 1:
+                        n_blast_workers = min(opt["blast_workers"], len(blast_jobs))
+                        for keyargs in blast_jobs.values():
+                            keyargs["blast_options"] = blast_options_for_workers(
+                                n_blast_workers
+                            )
+                        run_parallel_jobs(blast_function, blast_jobs, n_blast_workers)
+                    else:
+                        blast_jobs = {}
+
                 for cluster_index in range(
                     profile_ali.n_clusters()
                 ):  # index is 0 based
@@ -1920,7 +2333,7 @@ def main():
                             + (" (1 seq) --tblastn--").ljust(40)
                         )
                         if (
-                            opt["blast"]
+                            "blast" in profile_stages_to_run
                             or not is_file(blast_outfile)
                             or not is_valid_blast_output(blast_outfile)
                         ):
@@ -1947,8 +2360,11 @@ def main():
                                 + ")"
                             ).ljust(24)
                         )
-                        if (
-                            opt["blast"]
+                        if cluster_index in blast_jobs:
+                            write(" R> " + blast_outfile, 1)
+                            blast_parsers.append(parse_blast(blast_outfile))
+                        elif (
+                            "blast" in profile_stages_to_run
                             or not is_file(blast_outfile)
                             or not is_valid_blast_output(blast_outfile)
                         ):
@@ -1979,8 +2395,13 @@ def main():
                     filtered_blast_file_h = open(opt["filtered_blast_file"], "w")
 
                 ## filtering blast hits depending on the options on the profile
-                blast_hits = []
-                blast_hit_index = 1
+                # at most max_blast_hits are kept: with option blast_filtering_warning, the best ones (lowest evalue, then highest bits score) across all clusters, kept in a bounded heap whose top is the worst of them
+                max_blast_hits = profile_ali.max_blast_hits_number_value()
+                blast_hits_heap = (
+                    []
+                )  # items: (rank, blast hit) ; rank is (-evalue, bits, -parsing index)
+                too_many_blast_hits = False
+                parsing_index = 0
                 for cluster_id, blast_hits_parser in enumerate(blast_parsers):
                     cluster_id += 1  # to have it 1-based
                     blast_queries_alignment = (
@@ -1998,6 +2419,7 @@ def main():
                     )
                     blast_queries_alignment.remove_useless_gaps()
 
+                    previous_chromosome = None
                     for blast_h in blast_hits_parser:
                         # write(blast_h, 1) #2022
                         if (
@@ -2008,31 +2430,30 @@ def main():
                             raise notracebackException(
                                 'selenoprofiles ERROR the chromosome of the blast hit is not recognized. This is a known bug of blast which happens when the fasta titles in the target have "|" characters, but are not gis codes from ncbi. Please, reformat your target file (taking care also that all chromosome names are unique) and rerun selenoprofiles.'
                             )
-                        if blast_hit_index > profile_ali.max_blast_hits_number_value():
-                            ##too many blast hits. now a little trick to avoid a painful error message that gawk will print to screen since we wouldn't get to the end of the blaster_parser
-                            done_end_of_parser = False
-                            while not done_end_of_parser:
-                                try:
-                                    blast_hits_parser.next()
-                                    # next(blast_hits_parser)
-                                except StopIteration:
-                                    done_end_of_parser = True
-                            if opt["blast_filtering_warning"]:
-                                printerr(
-                                    "profile "
-                                    + family
-                                    + " WARNING too many blast hits! you should set a more strict blast filtering for this family. Now keep running using only with the first "
-                                    + str(profile_ali.max_blast_hits_number_value())
-                                    + " blast hits",
-                                    1,
-                                )
+                        parsing_index += 1
+                        blast_hit_rank = (
+                            -float_generalized(str(blast_h.evalue)),
+                            blast_h.bits,
+                            -parsing_index,
+                        )
+                        is_best_hsp_of_chromosome = (
+                            blast_h.chromosome != previous_chromosome
+                        )
+                        previous_chromosome = blast_h.chromosome
+                        if (
+                            opt["blast_filtering_warning"]
+                            and too_many_blast_hits
+                            and blast_hit_rank < blast_hits_heap[0][0]
+                        ):
+                            ## more than max_blast_hits hits passed the filter already (so the heap is full and the warning is due), and this hit is worse than all hits kept: it can't be kept, so it is not even filtered
+                            if (
+                                is_best_hsp_of_chromosome
+                                and blast_hit_rank[0] < blast_hits_heap[0][0][0]
+                            ):
+                                # blast sorts chromosomes by the evalue of their best HSP, listed first: no hit after this one in the blast output can be kept
+                                blast_hits_parser.file.close()
                                 break
-                            else:
-                                raise skipprofileException(
-                                    "profile "
-                                    + family
-                                    + " ERROR too many blast hits! you should change the blast filtering for this family or set a higher value for parameter max_blast_hits in its profile configuration file. See blast filtering chapter in the manual for details. To keep running with the first max_blast_hits blast hits, use option -blast_filtering_warning"
-                                )
+                            continue
                         blast_h.target = target_file
                         blast_h.profile = profile_ali
                         blast_h.species = target_species
@@ -2061,36 +2482,68 @@ def main():
                         if profile_ali.blast_filtering_eval()(
                             blast_h
                         ):  # filtering blast hits
-                            blast_h.place_selenocysteine()
-                            blast_h.id = str(blast_hit_index)
-                            blast_h.query.id = str(blast_hit_index) + "_query"
-                            blast_hits.append(blast_h)
-                            blast_hit_index += 1
-                            if opt["filtered_blast_file"]:
-                                print(
-                                    "BLASTID:" + blast_h.id + "\n",
-                                    blast_h,
-                                    file=filtered_blast_file_h,
+                            if len(blast_hits_heap) < max_blast_hits:
+                                heapq.heappush(
+                                    blast_hits_heap, (blast_hit_rank, blast_h)
                                 )
-                            x = blast_h
-                            for action_id in sorted(actions["post_blast"].keys()):
-                                # write('id: '+str(index_id)+' checking pre action '+str(action_id)+' : '+actions['pre_filtering'][action_id], 1)
-                                try:
-                                    exec(
-                                        actions["post_blast"][action_id]
-                                    )  ### running action
-                                except:
-                                    printerr(
-                                        "selenoprofiles ERROR trying to run post_blast action: "
-                                        + str(actions["post_blast"][action_id])
-                                        + " on result with index "
-                                        + str(blast_hit_index),
-                                        1,
+                            elif opt["blast_filtering_warning"]:
+                                too_many_blast_hits = True
+                                if blast_hit_rank > blast_hits_heap[0][0]:
+                                    # replacing the worst hit kept, which is worse than this one
+                                    heapq.heapreplace(
+                                        blast_hits_heap, (blast_hit_rank, blast_h)
                                     )
-                                    raise
+                            else:
+                                raise skipprofileException(
+                                    "profile "
+                                    + family
+                                    + " ERROR too many blast hits! you should change the blast filtering for this family or set a higher value for parameter max_blast_hits in its profile configuration file. See blast filtering chapter in the manual for details. To keep running with the best max_blast_hits blast hits, use option -blast_filtering_warning"
+                                )
 
                         ## sometimes blast gives an output changing the chromosome names to titles like "1_genome.fa" , where 1 is the index in the file where the fasta title appears, and genome.fa is the target name. This happens presumably because of unwanted characters in the fasta titles. user should remove them by himself
 
+                if too_many_blast_hits:
+                    printerr(
+                        "profile "
+                        + family
+                        + " WARNING too many blast hits! you should set a more strict blast filtering for this family. Now keep running using only the best "
+                        + str(max_blast_hits)
+                        + " blast hits",
+                        1,
+                    )
+                # blast hits kept are numbered in the order they were read
+                blast_hits = [
+                    blast_h
+                    for blast_hit_rank, blast_h in sorted(
+                        blast_hits_heap, key=lambda x: -x[0][2]
+                    )
+                ]
+                del blast_hits_heap
+                for blast_hit_index, blast_h in enumerate(blast_hits, 1):
+                    blast_h.place_selenocysteine()
+                    blast_h.id = str(blast_hit_index)
+                    blast_h.query.id = str(blast_hit_index) + "_query"
+                    if opt["filtered_blast_file"]:
+                        print(
+                            "BLASTID:" + blast_h.id + "\n",
+                            blast_h,
+                            file=filtered_blast_file_h,
+                        )
+                    x = blast_h
+                    for action_id in sorted(actions["post_blast"].keys()):
+                        # write('id: '+str(index_id)+' checking pre action '+str(action_id)+' : '+actions['pre_filtering'][action_id], 1)
+                        try:
+                            exec(actions["post_blast"][action_id])  ### running action
+                        except:
+                            printerr(
+                                "selenoprofiles ERROR trying to run post_blast action: "
+                                + str(actions["post_blast"][action_id])
+                                + " on result with index "
+                                + str(blast_hit_index),
+                                1,
+                            )
+                            raise
+
                 if opt["filtered_blast_file"]:
                     filtered_blast_file_h.close()
 
@@ -2172,6 +2625,7 @@ def main():
                         1,
                     )
                     exonerate_mode = {False: "p2g", True: "p2d"}[opt["no_splice"]]
+                    exonerate_jobs = {}  # hit_index -> arguments of cyclic_exonerate
                     for hit_index in considered_indexes:
                         exonerate_outfile = (
                             exonerate_folder_profile_subfolder
@@ -2180,67 +2634,91 @@ def main():
                             + str(hit_index)
                             + ".exonerate"
                         )
-                        superblast_hit = blast_hits_hash[str(hit_index)]
-                        if opt["exonerate"] or not is_file(
+                        if "exonerate" in profile_stages_to_run or not is_file(
                             exonerate_outfile
                         ):  # deciding if run exonerate or not
-                            ### running cyclic_exonerate, obtaining an (super)exonerate object. It can be empty (in this case its boolean evaluation will be False, and it will have a "error_message" attribute).
-                            # the id of the exonerate hit is set to the id of the original blas hit here below.
-                            # to output, a short description is printed after the output file, like this:
-                            # sps.1.exonerate -> on:scaffold_6 strand:+ positions:1818342-1819187,1819199-18192912
-
-                            exonerate_hit = cyclic_exonerate(
-                                profile_ali,
-                                target_file,
+                            exonerate_jobs[hit_index] = dict(
+                                profile_ali=profile_ali,
+                                target_file=target_file,
                                 outfile=exonerate_outfile,
-                                seed=superblast_hit,
+                                seed=blast_hits_hash[str(hit_index)],
                                 extension=exonerate_extension,
                                 exonerate_options=exonerate_options,
                                 mode=exonerate_mode,
                                 merge_multiple=not opt["no_splice"],
                             )
-                            run_or_load_code = "R"
-                        else:
-                            # loading file
-                            exonerate_hit = superexoneratehit()
-                            error_message = exonerate_hit.load(
-                                exonerate_outfile,
-                                seed=superblast_hit,
-                                merge_multiple=not opt["no_splice"],
+                    try:
+                        preload_hit_job_regions(cyclic_exonerate, exonerate_jobs)
+                        # with -ncpus >1, exonerate jobs are run in parallel now; their output files are then loaded below in order of hit_index
+                        exonerate_jobs_done = (
+                            run_hit_jobs(cyclic_exonerate, exonerate_jobs) is not None
+                        )
+
+                        for hit_index in considered_indexes:
+                            exonerate_outfile = (
+                                exonerate_folder_profile_subfolder
+                                + family
+                                + "."
+                                + str(hit_index)
+                                + ".exonerate"
                             )
-                            if not exonerate_hit:
-                                exonerate_hit.error_message = error_message
-                            run_or_load_code = "L"
+                            superblast_hit = blast_hits_hash[str(hit_index)]
+                            if hit_index in exonerate_jobs and not exonerate_jobs_done:
+                                ### running cyclic_exonerate, obtaining an (super)exonerate object. It can be empty (in this case its boolean evaluation will be False, and it will have a "error_message" attribute).
+                                # the id of the exonerate hit is set to the id of the original blas hit here below.
+                                # to output, a short description is printed after the output file, like this:
+                                # sps.1.exonerate -> on:scaffold_6 strand:+ positions:1818342-1819187,1819199-18192912
+
+                                exonerate_hit = cyclic_exonerate(
+                                    **exonerate_jobs[hit_index]
+                                )
+                                run_or_load_code = "R"
+                            else:
+                                # loading file
+                                exonerate_hit = superexoneratehit()
+                                error_message = exonerate_hit.load(
+                                    exonerate_outfile,
+                                    seed=superblast_hit,
+                                    merge_multiple=not opt["no_splice"],
+                                )
+                                if not exonerate_hit:
+                                    exonerate_hit.error_message = error_message
+                                run_or_load_code = {True: "R", False: "L"}[
+                                    hit_index in exonerate_jobs
+                                ]
 
-                        exonerate_hit.id = superblast_hit.id
-                        exonerate_hit.query.id = (
-                            exonerate_hit.id + "_query"
-                        )  # setting id property of exonerate object to its hit_index
-                        exonerate_hit.profile = profile_ali
-                        exonerate_hit.target = target_file
-                        exonerate_hit.species = target_species
+                            exonerate_hit.id = superblast_hit.id
+                            exonerate_hit.query.id = (
+                                exonerate_hit.id + "_query"
+                            )  # setting id property of exonerate object to its hit_index
+                            exonerate_hit.profile = profile_ali
+                            exonerate_hit.target = target_file
+                            exonerate_hit.species = target_species
 
-                        if exonerate_hit:
-                            short_description = exonerate_hit.header(
-                                no_species=True, no_id=True, compress=True
+                            if exonerate_hit:
+                                short_description = exonerate_hit.header(
+                                    no_species=True, no_id=True, compress=True
+                                )
+                            else:
+                                short_description = exonerate_hit.error_message
+                            write(
+                                description_format(
+                                    exonerate_outfile.split("/")[-1]
+                                    + " "
+                                    + run_or_load_code
+                                    + "> "
+                                    + short_description
+                                ),
+                                1,
                             )
-                        else:
-                            short_description = exonerate_hit.error_message
-                        write(
-                            description_format(
-                                exonerate_outfile.split("/")[-1]
-                                + " "
-                                + run_or_load_code
-                                + "> "
-                                + short_description
-                            ),
-                            1,
-                        )
-                        exonerate_hits_hash[superblast_hit.id] = exonerate_hit
+                            exonerate_hits_hash[superblast_hit.id] = exonerate_hit
 
-                        if not exonerate_hit:
-                            # insert exhaustive exonerate code here ############
-                            blast_hits_of_empty_exonerates_hash[hit_index] = 1
+                            if not exonerate_hit:
+                                # insert exhaustive exonerate code here ############
+                                blast_hits_of_empty_exonerates_hash[hit_index] = 1
+                    finally:
+                        # also when a job fails, so that later profiles do not read these windows
+                        release_regions(target_file)
 
                     if not considered_indexes:
                         write(" -- no blast hit passed filtering --", 1)
@@ -2297,12 +2775,9 @@ def main():
                     )
                     if not considered_indexes:
                         write(" -- no blast hit passed filtering --", 1)
-                    for i_i, hit_index in enumerate(
-                        considered_indexes
-                    ):  # i_i is the index of the index... it is not used.
-                        if (
-                            not hit_index in blast_hits_of_empty_exonerates_hash
-                        ):  # it means we have a non-empty exonerate output for this hit_index
+                    genewise_jobs = {}  # hit_index -> arguments of genewise
+                    for hit_index in considered_indexes:
+                        if not hit_index in blast_hits_of_empty_exonerates_hash:
                             genewise_outfile = (
                                 genewise_folder_profile_subfolder
                                 + family
@@ -2310,67 +2785,65 @@ def main():
                                 + str(hit_index)
                                 + ".genewise"
                             )
-                            current_outfile = genewise_outfile
-                            exonerate_seed_hit = exonerate_hits_hash[str(hit_index)]
-
-                            if opt["genewise"] or not is_file(
+                            if "genewise" in profile_stages_to_run or not is_file(
                                 genewise_outfile
-                            ):  #### run genewise!
-                                genewise_hit = genewise(
-                                    profile_ali,
-                                    target_file,
+                            ):
+                                genewise_jobs[hit_index] = dict(
+                                    profile_ali=profile_ali,
+                                    target_file=target_file,
                                     outfile=genewise_outfile,
-                                    seed=exonerate_seed_hit,
+                                    seed=exonerate_hits_hash[str(hit_index)],
                                     extension=genewise_extension,
                                     genewise_options=genewise_options,
                                 )
-                                run_or_load_code = "R"
-                            else:  # or load genewise file
-                                genewise_hit = genewisehit(genewise_outfile)
-                                run_or_load_code = "L"
-                            genewise_hit.id = str(hit_index)
-                            genewise_hit.query.id = (
-                                genewise_hit.id + "_query"
-                            )  # setting id property of genewise object to its hit_index
-                            genewise_hits_hash[genewise_hit.id] = genewise_hit
-                            genewise_hit.profile = profile_ali
-                            genewise_hit.species = target_species
-                            genewise_hit.target = target_file
-                            if genewise_hit:
-                                short_description = genewise_hit.header(
-                                    no_species=True, no_id=True, compress=True
+                        elif opt["genewise_to_be_sure"]:
+                            genewise_tbs_outfile = (
+                                genewise_folder_profile_subfolder
+                                + family
+                                + "."
+                                + str(hit_index)
+                                + ".genewise_tbs"
+                            )
+                            if "genewise" in profile_stages_to_run or not is_file(
+                                genewise_tbs_outfile
+                            ):
+                                genewise_jobs[hit_index] = dict(
+                                    profile_ali=profile_ali,
+                                    target_file=target_file,
+                                    outfile=genewise_tbs_outfile,
+                                    seed=blast_hits_hash[str(hit_index)],
+                                    extension=genewise_tbs_extension,
+                                    genewise_options=genewise_tbs_options,
                                 )
-                            else:
-                                short_description = genewise_hit.error_message
+                    try:
+                        preload_hit_job_regions(genewise, genewise_jobs)
+                        # with -ncpus >1, genewise jobs are run in parallel now; their output files are then loaded below in order of hit_index
+                        genewise_errors = run_hit_jobs(genewise, genewise_jobs)
 
-                        else:  # genewise to be sure. the correspondent exonerate output was empty
-                            if opt["genewise_to_be_sure"]:
-                                genewise_tbs_outfile = (
+                        for i_i, hit_index in enumerate(
+                            considered_indexes
+                        ):  # i_i is the index of the index... it is not used.
+                            if (
+                                not hit_index in blast_hits_of_empty_exonerates_hash
+                            ):  # it means we have a non-empty exonerate output for this hit_index
+                                genewise_outfile = (
                                     genewise_folder_profile_subfolder
                                     + family
                                     + "."
                                     + str(hit_index)
-                                    + ".genewise_tbs"
+                                    + ".genewise"
                                 )
-                                current_outfile = genewise_tbs_outfile
-                                blast_seed_hit = blast_hits_hash[str(hit_index)]
-
-                                if opt["genewise"] or not is_file(
-                                    genewise_tbs_outfile
-                                ):  #### run genewise tbs!
-                                    genewise_hit = genewise(
-                                        profile_ali,
-                                        target_file,
-                                        outfile=genewise_tbs_outfile,
-                                        seed=blast_seed_hit,
-                                        extension=genewise_tbs_extension,
-                                        genewise_options=genewise_tbs_options,
+                                current_outfile = genewise_outfile
+
+                                if hit_index in genewise_jobs:  #### run genewise!
+                                    genewise_hit = genewise_job_hit(
+                                        hit_index, genewise_jobs, genewise_errors
                                     )
                                     run_or_load_code = "R"
-                                else:  # or load genewise tbs file
-                                    genewise_hit = genewisehit(genewise_tbs_outfile)
+                                else:  # or load genewise file
+                                    genewise_hit = genewisehit(genewise_outfile)
                                     run_or_load_code = "L"
-                                genewise_hit.id = blast_seed_hit.id
+                                genewise_hit.id = str(hit_index)
                                 genewise_hit.query.id = (
                                     genewise_hit.id + "_query"
                                 )  # setting id property of genewise object to its hit_index
@@ -2378,7 +2851,6 @@ def main():
                                 genewise_hit.profile = profile_ali
                                 genewise_hit.species = target_species
                                 genewise_hit.target = target_file
-
                                 if genewise_hit:
                                     short_description = genewise_hit.header(
                                         no_species=True, no_id=True, compress=True
@@ -2386,22 +2858,63 @@ def main():
                                 else:
                                     short_description = genewise_hit.error_message
 
-                        # both in tbs and in normal routine: print summary
-                        if (
-                            opt["genewise_to_be_sure"]
-                            or not hit_index in blast_hits_of_empty_exonerates_hash
-                        ):
-                            genewise_hit.check_alignment()
-                            write(
-                                description_format(
-                                    current_outfile.split("/")[-1]
-                                    + " "
-                                    + run_or_load_code
-                                    + "> "
-                                    + short_description
-                                ),
-                                1,
-                            )
+                            else:  # genewise to be sure. the correspondent exonerate output was empty
+                                if opt["genewise_to_be_sure"]:
+                                    genewise_tbs_outfile = (
+                                        genewise_folder_profile_subfolder
+                                        + family
+                                        + "."
+                                        + str(hit_index)
+                                        + ".genewise_tbs"
+                                    )
+                                    current_outfile = genewise_tbs_outfile
+                                    blast_seed_hit = blast_hits_hash[str(hit_index)]
+
+                                    if (
+                                        hit_index in genewise_jobs
+                                    ):  #### run genewise tbs!
+                                        genewise_hit = genewise_job_hit(
+                                            hit_index, genewise_jobs, genewise_errors
+                                        )
+                                        run_or_load_code = "R"
+                                    else:  # or load genewise tbs file
+                                        genewise_hit = genewisehit(genewise_tbs_outfile)
+                                        run_or_load_code = "L"
+                                    genewise_hit.id = blast_seed_hit.id
+                                    genewise_hit.query.id = (
+                                        genewise_hit.id + "_query"
+                                    )  # setting id property of genewise object to its hit_index
+                                    genewise_hits_hash[genewise_hit.id] = genewise_hit
+                                    genewise_hit.profile = profile_ali
+                                    genewise_hit.species = target_species
+                                    genewise_hit.target = target_file
+
+                                    if genewise_hit:
+                                        short_description = genewise_hit.header(
+                                            no_species=True, no_id=True, compress=True
+                                        )
+                                    else:
+                                        short_description = genewise_hit.error_message
+
+                            # both in tbs and in normal routine: print summary
+                            if (
+                                opt["genewise_to_be_sure"]
+                                or not hit_index in blast_hits_of_empty_exonerates_hash
+                            ):
+                                genewise_hit.check_alignment()
+                                write(
+                                    description_format(
+                                        current_outfile.split("/")[-1]
+                                        + " "
+                                        + run_or_load_code
+                                        + "> "
+                                        + short_description
+                                    ),
+                                    1,
+                                )
+                    finally:
+                        # also when a job fails, so that later profiles do not read these windows
+                        release_regions(target_file)
 
                 write("", 1)
                 ###############
@@ -2451,7 +2964,9 @@ def main():
                     {}
                 )  ## keep track of the predictions we want to drop immediately after the choose step. uniq example on creation date: when the only available prediction is from blast, and you don't want blast predictions according to options
 
-                if opt["choose"] or not is_file(chosen_predictions_outfile):
+                if "choose" in profile_stages_to_run or not is_file(
+                    chosen_predictions_outfile
+                ):
                     write("RUN", 1)
                     chosen_predictions_outfile_text = ""
                     if not considered_indexes:
@@ -2643,7 +3158,9 @@ def main():
                 duplicated_chosen_hits_ids_hash = (
                     {}
                 )  # so these are skipped when looping through results
-                if opt["filter"] or not is_file(filtering_predictions_outfile):
+                if "filter" in profile_stages_to_run or not is_file(
+                    filtering_predictions_outfile
+                ):
                     write("RUN", 1)
                     duplicated_chosen_hits = (
                         []
@@ -2849,6 +3366,7 @@ def main():
                     write("\n")
                     write("DATABASE", how=terminal_colors["database"])
                     write(" wrote results for profile: " + family, 1)
+                save_stage_fingerprints(family, profile_fingerprints)
 
                 remove_items_from_list(
                     considered_indexes,
@@ -2901,6 +3419,34 @@ def main():
         del blast_hits_of_empty_exonerates_hash
         del considered_indexes
         del chosen_predictions
+        return (
+            all_results_are_loaded_from_db,
+            chromosomes_with_results,
+            family in skipped_profiles,
+        )
+
+    if (
+        opt["profile_workers"]
+        and opt["profile_workers"] > 1
+        and len(profiles_names) > 1
+    ):
+        for family in profiles_names:
+            if len(family) + 18 > max_chars_per_column["id"]:
+                max_chars_per_column["id"] = len(family) + 18
+        for family, (
+            loaded_from_db,
+            chromosomes_of_profile,
+            profile_was_skipped,
+        ) in zip(profiles_names, run_profile_workers(search_profile)):
+            all_results_are_loaded_from_db = (
+                all_results_are_loaded_from_db and loaded_from_db
+            )
+            chromosomes_with_results.update(chromosomes_of_profile)
+            if profile_was_skipped:
+                skipped_profiles[family] = True
+    else:
+        for profile_index, family in enumerate(profiles_names):
+            search_profile(profile_index, family)
 
     if skipped_profiles:
         for profile_index in range(len(profiles_names) - 1, -1, -1):
@@ -2913,7 +3459,7 @@ def main():
             "\nOption -no_db:   the files are now ready, but results are not stored in the database and were not checked for inter-family redundancy. Please run with option -database. Now quitting...",
             1,
         )
-        sys.exit()
+        return
     if opt[
         "stop"
     ]:  ### if this option was specified, we don't go to the output phase since we expect more profiles to be computed, and the redundancy must be checked before outputing
@@ -2924,7 +3470,7 @@ def main():
             "\nOption -stop:   results are now stored in the database, but they were not checked for inter-family redundancy. Now quitting...",
             1,
         )
-        sys.exit()
+        return
 
     #### merging inter-profile results, directly on the database. but we have to check for other instances of selenoprofiles
     if not all_results_are_loaded_from_db or opt["merge"]:
@@ -2994,24 +3540,14 @@ def main():
         for family in profiles_names:
             profile_ali = profiles_hash[family]
             write("Cleaning files for profile: " + family, 1)
-            bash(
-                "rm -r "
-                + blast_folder
-                + family
-                + " "
-                + exonerate_folder
-                + family
-                + " "
-                + genewise_folder
-                + family
-                + " "
-                + prediction_choice_folder
-                + family
-                + ".tab "
-                + filtered_list_folder
-                + family
-                + ".tab "
-            )  # +blast_nr_folder+family)
+            for path in [
+                blast_folder + family,
+                exonerate_folder + family,
+                genewise_folder + family,
+                prediction_choice_folder + family + ".tab",
+                filtered_list_folder + family + ".tab",
+            ]:  # +blast_nr_folder+family
+                remove_files(path, recursive=True)
 
     write("\n")
     write("=" * 56)
@@ -3176,29 +3712,517 @@ def main():
                 + profile_ali_with_predictions_file,
                 1,
             )
-            profile_ali_with_predictions.display(profile_ali_with_predictions_file)
+            profile_ali_with_predictions.display(profile_ali_with_predictions_file)
+
+    if not output_something:
+        write(" -- nothing to output -- ", 1)
+    write("\nPipeline workflow completed.   Date: " + date_string(), 1)
+
+    # compute global alignments for indexes in     indexes_passing_p2g_filter     and also only for those     indexes_passing_p2g_refilter
+
+    # remove every file created for this family in the temp folder
+
+
+#######################################################################################################################################
+
+
+### main routines functions! They are used later on.
+def profile_worker(search_profile, profile_index, family, message_queue):
+    """Body of a child process of run_profile_workers: searches a single profile using its own temp subfolder and log file, then reports to the main process through message_queue. It never returns"""
+    global temp_folder, results_db
+    exit_code = 0
+    try:
+        temp_folder = Folder(temp_folder + "profile_worker." + family)
+        set_MMlib_var("temp_folder", temp_folder)
+        sys.stdout = open(temp_folder + "profile_worker.log", "w")
+        sys.stderr = sys.stdout
+        if "log_file" in globals():
+            # the main process copies the output of this child to the log file
+            set_MMlib_var("log_file", open(os.devnull, "w"))
+        if not opt["no_db"]:
+            results_db = profile_worker_db(
+                results_db_file, message_queue, profile_index
+            )
+        outcome = search_profile(profile_index, family)
+        sys.stdout.flush()
+        message_queue.put(("done", profile_index, outcome))
+    except BaseException as e:
+        exit_code = 1
+        sys.stdout.flush()
+        message_queue.put(
+            (
+                "error",
+                profile_index,
+                (
+                    isinstance(e, notracebackException),
+                    str(e),
+                    join(traceback.format_exception(*sys.exc_info()), ""),
+                ),
+            )
+        )
+    message_queue.close()
+    message_queue.join_thread()
+    # skipping close_program and the rest of main, which belong to the main process
+    os._exit(exit_code)
+
+
+def run_profile_workers(search_profile):
+    """Runs search_profile(profile_index, family) for all profiles_names in up to opt['profile_workers'] child processes.
+    Database operations of children are executed here in the order they arrive, so that this process is the only writer of results.sqlite.
+    The screen output of each child is printed when it completes, in the order of profiles_names.
+    Returns the list of values returned by search_profile, in the order of profiles_names
+    """
+    context = multiprocessing.get_context("fork")
+    message_queue = context.Queue()
+    processes = {}  # profile_index -> running child process
+    outcomes = {}  # profile_index -> value returned by search_profile
+    found_dead = set()  # profile_index of children terminated without reporting
+    next_to_start = 0
+    next_to_print = 0
+    try:
+        while next_to_print < len(profiles_names):
+            while (
+                next_to_start < len(profiles_names)
+                and len(processes) < opt["profile_workers"]
+            ):
+                process = context.Process(
+                    target=profile_worker,
+                    args=(
+                        search_profile,
+                        next_to_start,
+                        profiles_names[next_to_start],
+                        message_queue,
+                    ),
+                )
+                process.start()
+                processes[next_to_start] = process
+                next_to_start += 1
+
+            try:
+                message = message_queue.get(timeout=1)
+            except queue.Empty:
+                for profile_index, process in processes.items():
+                    if process.is_alive():
+                        continue
+                    if profile_index in found_dead:
+                        # nothing arrived from it in the last second either
+                        raise notracebackException(
+                            "ERROR -profile_workers: the process searching profile "
+                            + profiles_names[profile_index]
+                            + " terminated unexpectedly with exit code "
+                            + str(process.exitcode)
+                        )
+                    found_dead.add(profile_index)
+                continue
+
+            if message[0] == "db":
+                profile_index, method_name, args = message[1:]
+                getattr(results_db, method_name)(*args)
+            elif message[0] == "error":
+                profile_index, error_data = message[1:]
+                is_notraceback, error_text, traceback_text = error_data
+                processes[profile_index].join()
+                write(
+                    open(
+                        temp_folder
+                        + "profile_worker."
+                        + profiles_names[profile_index]
+                        + "/profile_worker.log",
+                        "r",
+                    ).read()
+                )
+                if is_notraceback:
+                    raise notracebackException(error_text)
+                printerr(traceback_text)
+                raise notracebackException(
+                    "ERROR -profile_workers: the search for profile "
+                    + profiles_names[profile_index]
+                    + " failed: "
+                    + error_text
+                )
+            elif message[0] == "done":
+                profile_index, outcome = message[1:]
+                processes.pop(profile_index).join()
+                outcomes[profile_index] = outcome
+
+            while next_to_print in outcomes:
+                write(
+                    open(
+                        temp_folder
+                        + "profile_worker."
+                        + profiles_names[next_to_print]
+                        + "/profile_worker.log",
+                        "r",
+                    ).read()
+                )
+                next_to_print += 1
+    except:
+        # stopping all children and making sure that the db doesn't say that some profile is still computing
+        for process in processes.values():
+            process.terminate()
+            process.join()
+        if not opt["no_db"]:
+            for family in profiles_names:
+                db_state = results_db.has_results_for_profile(family)
+                if db_state == "ONGOING":
+                    results_db.set_has_results_for_profile(family, "NO")
+                elif db_state == "UNCHECKED":
+                    results_db.set_has_results_for_profile(family, "UNCHECKED-2")
+            results_db.save()
+        raise
+    return [outcomes[profile_index] for profile_index in range(len(profiles_names))]
+
+
+def run_parallel_jobs(function, jobs, n_processes, report=None):
+    """Runs function(**keyargs) for each job_id:keyargs in jobs, in a pool of n_processes child processes. Each job runs with its own scratch subfolder of temp_folder (see run_parallel_job).
+    Objects are not sent to the children: they inherit function and jobs. The value returned by function is passed to report, if provided, inside the child; the values returned by report are sent back.
+    Returns a hash job_id:reported_value (None for all jobs if report is not provided)
+    """
+    global parallel_jobs
+    parallel_jobs = (function, jobs, report)  # inherited by the children
+    job_ids = sorted(jobs.keys())
+    with multiprocessing.get_context("fork").Pool(n_processes) as pool:
+        reported_values = pool.map(run_parallel_job, job_ids, chunksize=1)
+    del parallel_jobs
+    return dict(zip(job_ids, reported_values))
+
+
+def run_parallel_job(job_id):
+    """Runs a single job of run_parallel_jobs inside a child process, in a scratch subfolder of temp_folder"""
+    global temp_folder
+    function, jobs, report = parallel_jobs
+    main_temp_folder = temp_folder
+    temp_folder = Folder(main_temp_folder + "parallel_job." + str(job_id))
+    set_MMlib_var("temp_folder", temp_folder)
+    try:
+        output = function(**jobs[job_id])
+        if report is None:
+            return None
+        return report(output)
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        temp_folder = main_temp_folder
+        set_MMlib_var("temp_folder", temp_folder)
+
+
+def preload_hit_job_regions(function, jobs):
+    """Reads in a single ordered pass the target regions needed by the jobs of a profile for function cyclic_exonerate or genewise (a hash hit_index:keyargs, as for run_hit_jobs), merging the overlapping ones, and keeps them in memory until release_regions is called (see preload_regions in MMlib). Jobs then extract their target windows from these slices, also when run in child processes.
+    The window of each job is the seed boundaries extended on both sides by its extension, as computed in cyclic_exonerate and genewise. Jobs using the whole chromosome (see cyclic_exonerate) are not included
+    """
+    windows_by_target = {}  # target_file -> list of [chromosome, start, end]
+    for keyargs in jobs.values():
+        seed = keyargs["seed"]
+        chromosome_length = chromosome_lengths[seed.chromosome]
+        current_range = seed.boundaries_gene().extend(
+            left=keyargs["extension"], right=keyargs["extension"]
+        )
+        current_range.check_boundaries(chromosome_length)
+        if (
+            function is cyclic_exonerate
+            and float(chromosome_length) / current_range.span() < 2
+        ):
+            continue
+        start, end = current_range.boundaries()
+        windows_by_target.setdefault(keyargs["target_file"], []).append(
+            [seed.chromosome, start - 1, end]
+        )
+    for job_target_file, windows in windows_by_target.items():
+        slices = preload_regions(job_target_file, windows)
+        service(
+            "  ...preloaded "
+            + str(len(windows))
+            + " target regions ("
+            + str(slices.total_length())
+            + " bp) from "
+            + job_target_file
+        )
+
+
+def run_hit_jobs(function, jobs):
+    """Runs function(**keyargs) for each hit_index:keyargs in jobs, in up to opt['ncpus'] child processes (see run_parallel_jobs). function is cyclic_exonerate or genewise: each keyargs must contain target_file, seed and outfile.
+    The index (or .2bit file) of each target is opened in advance, so that children share it (see get_genome_reader).
+    Returns None if there are not enough jobs or cpus to run in parallel (the caller then runs them one by one); otherwise, a hash hit_index:error_message for the jobs which produced an empty prediction. The predictions are then loaded from the outfiles by the caller.
+    """
+    if not opt["ncpus"] or opt["ncpus"] < 2 or len(jobs) < 2:
+        return None
+    for job_target_file in set([keyargs["target_file"] for keyargs in jobs.values()]):
+        get_genome_reader(job_target_file)
+    error_messages = run_parallel_jobs(
+        function, jobs, min(opt["ncpus"], len(jobs)), report=empty_hit_error_message
+    )
+    return {
+        hit_index: error_message
+        for hit_index, error_message in error_messages.items()
+        if error_message is not None
+    }
+
+
+def empty_hit_error_message(p2g_hit):
+    """Used by run_hit_jobs: returns the error_message of p2g_hit if it is empty, None otherwise"""
+    if p2g_hit:
+        return None
+    return p2g_hit.error_message
+
+
+def genewise_job_hit(hit_index, genewise_jobs, genewise_errors):
+    """Returns the genewisehit for a job prepared in the GENEWISE step. If genewise_errors is None, jobs were not run in parallel by run_hit_jobs, so genewise is run now; otherwise the hit is loaded from its outfile, or created empty with the error_message collected from the child process"""
+    if genewise_errors is None:
+        return genewise(**genewise_jobs[hit_index])
+    g = genewisehit()
+    if hit_index in genewise_errors:
+        g.error_message = genewise_errors[hit_index]
+    else:
+        g.load(genewise_jobs[hit_index]["outfile"])
+    return g
+
+
+def blast_options_for_workers(n_workers):
+    """Returns a copy of blast_options in which the number of blast threads (-a, normally set to ncpus; translated by the blast backend, see blast_backend) is divided among n_workers blast searches run at the same time"""
+    worker_blast_options = blast_options.copy()
+    worker_blast_options["a"] = str(max(1, int(opt["ncpus"]) // n_workers))
+    return worker_blast_options
+
+
+def blast_options_argv(blast_options_used):
+    """Returns the list of command line arguments for blastall corresponding to the hash blast_options_used (option:value). Values are split as in a shell, so quoted values with spaces are kept as single arguments"""
+    return shlex.split(
+        join(
+            ["-" + k + " " + str(blast_options_used[k]) for k in blast_options_used],
+            " ",
+        )
+    )
+
+
+class blast_backend(object):
+    """Engine running the searches of the blast stage: psitblastn with the pssm of a profile cluster, and tblastn with a single query. Subclasses define the command lines of a specific suite of programs; their output is read by parse_blast for all backends.
+    Blast options (option -blast_opt and profile attribute blast_options) are always given in blastall syntax, and translated by the backend when needed. Backends are listed in blast_backends, and chosen per run with option -blast_backend or per profile with attribute blast_backend (see profile_alignment.blast_backend_value)
+    """
+
+    name = ""
+    programs = []  # external programs run by this backend
+    pssm_extension = ""
+
+    def pssm_argv(self, profile, pssm_filename, pssm_ascii_filename, tiny_db):
+        """Returns the command line to build the pssm of the profile into pssm_filename (and its human readable version into pssm_ascii_filename), searching the database tiny_db which contains a single dummy sequence"""
+        raise Exception("blast_backend ERROR pssm_argv not defined for " + self.name)
+
+    def search_argv(self, target_file, query_file, pssm_file, blast_options_used):
+        """Returns the command line to search the target_file blast database with the query in query_file, using pssm_file if provided (psitblastn) or not (tblastn)"""
+        raise Exception("blast_backend ERROR search_argv not defined for " + self.name)
+
+    def pssm_error(self, argv, b):
+        """Raises an exception for the failed run of pssm_argv. b is the list [exit_status, stdout, stderr] returned by run_tool"""
+        raise Exception(
+            "unknown ERROR building pssm with "
+            + self.name
+            + ", cmnd:  "
+            + join(argv, " ")
+            + " ERROR: "
+            + b[2]
+        )
+
+
+class blastall_backend(blast_backend):
+    """Legacy NCBI blast: the pssm is a checkpoint file of blastpgp, searched with blastall -p psitblastn. Threads are set with option -a"""
+
+    name = "blastall"
+    programs = ["blastall", "blastpgp"]
+    pssm_extension = ".chk"
+
+    def pssm_argv(self, profile, pssm_filename, pssm_ascii_filename, tiny_db):
+        blastpgp_bin = tool_path(
+            "blastpgp",
+            "ERROR blastpgp not found! Please install it",
+            notracebackException,
+        )
+        argv = [blastpgp_bin, "-i", profile.blast_query_file(sec_char="X")]
+        argv += ["-B", profile.blast_format_alignment()]
+        argv += ["-j", "1", "-d", tiny_db]
+        argv += ["-C", pssm_filename, "-Q", pssm_ascii_filename]
+        return argv
+
+    def pssm_error(self, argv, b):
+        if "[blastpgp] WARNING: SetUpBlastSearch failed." in b[2]:
+            raise notracebackException(
+                "ERROR blastall is not properly installed. Please visit https://guigolab.github.io/blog/20110616/installing-programs-and-modules-needed-by-selenoprofiles/ to fix it. This is the error message: "
+                + b[2]
+                + "\n"
+            )
+        blast_backend.pssm_error(self, argv, b)
 
-    if not output_something:
-        write(" -- nothing to output -- ", 1)
-    write("\nPipeline workflow completed.   Date: " + bbash("date"), 1)
+    def search_argv(self, target_file, query_file, pssm_file, blast_options_used):
+        blastall_bin = tool_path(
+            "blastall",
+            "ERROR blastall not found! Please install it",
+            notracebackException,
+        )
+        if pssm_file:
+            argv = [blastall_bin, "-p", "psitblastn", "-d", target_file]
+            argv += ["-R", pssm_file]
+        else:
+            argv = [blastall_bin, "-p", "tblastn", "-d", target_file]
+        return argv + ["-i", query_file, "-I"] + blast_options_argv(blast_options_used)
 
-    # compute global alignments for indexes in     indexes_passing_p2g_filter     and also only for those     indexes_passing_p2g_refilter
 
-    # remove every file created for this family in the temp folder
+class blastplus_backend(blast_backend):
+    """NCBI BLAST+: the pssm is built by psiblast from the profile cluster, and searched with tblastn -in_pssm. Threads are set with option -num_threads, which scales across cores much better than blastall.
+    The target is searched through the blast database written by formatdb, which BLAST+ reads as well
+    """
 
+    name = "blast+"
+    programs = ["psiblast", "tblastn"]
+    pssm_extension = ".asn"
+    # blastall option -> BLAST+ option. Options with names longer than one character are considered BLAST+ options, and used as they are
+    translated_options = {
+        "a": "num_threads",
+        "b": "num_alignments",
+        "v": "num_descriptions",
+        "e": "evalue",
+        "D": "db_gencode",
+        "M": "matrix",
+        "G": "gapopen",
+        "E": "gapextend",
+        "f": "threshold",
+        "W": "word_size",
+        "X": "xdrop_gap",
+        "y": "xdrop_ungap",
+        "Z": "xdrop_gap_final",
+        "t": "max_intron_length",
+        "Y": "searchsp",
+    }
+
+    def translate_options(self, blast_options_used):
+        """Returns a hash option:value with the BLAST+ options corresponding to blast_options_used, given in blastall syntax"""
+        out = {}
+        for option_name in blast_options_used:
+            value = str(blast_options_used[option_name])
+            if len(option_name) > 1:
+                out[option_name] = value
+            elif option_name == "F":
+                # only whether to filter is kept: BLAST+ uses seg for proteins
+                out["seg"] = {True: "no", False: "yes"}[value.strip("'\" ") == "F"]
+            elif option_name in self.translated_options:
+                out[self.translated_options[option_name]] = value
+            else:
+                raise notracebackException(
+                    "selenoprofiles ERROR blast option -"
+                    + option_name
+                    + " has no equivalent in the blast+ backend. Please provide the BLAST+ option instead (see tblastn -help)"
+                )
+        return out
 
-#######################################################################################################################################
+    def pssm_argv(self, profile, pssm_filename, pssm_ascii_filename, tiny_db):
+        psiblast_bin = tool_path(
+            "psiblast",
+            "ERROR psiblast not found! Please install BLAST+",
+            notracebackException,
+        )
+        # psiblast builds the pssm of the first sequence of the alignment: the blast query, with X at selenocysteine positions
+        msa_file = temp_folder + profile.name + ".blast_plus_alignment"
+        msa_fh = open(msa_file, "w")
+        print(
+            profile.blast_query_title() + "\t" + profile.blast_query_seq(sec_char="X"),
+            file=msa_fh,
+        )
+        for title in profile.titles():
+            if title != profile.blast_query_title():
+                title_out = replace_chars(title, " ", "_")[:120]
+                print(title_out + "\t" + profile.seq_of(title), file=msa_fh)
+        msa_fh.close()
+        argv = [psiblast_bin, "-in_msa", msa_file, "-msa_master_idx", "1"]
+        argv += ["-num_iterations", "1", "-db", tiny_db]
+        argv += ["-out_pssm", pssm_filename, "-out_ascii_pssm", pssm_ascii_filename]
+        return argv
+
+    def search_argv(self, target_file, query_file, pssm_file, blast_options_used):
+        tblastn_bin = tool_path(
+            "tblastn",
+            "ERROR tblastn not found! Please install BLAST+",
+            notracebackException,
+        )
+        argv = [tblastn_bin, "-db", target_file]
+        if pssm_file:
+            argv += ["-in_pssm", pssm_file]
+        else:
+            argv += ["-query", query_file]
+        return argv + blast_options_argv(self.translate_options(blast_options_used))
 
 
-### main routines functions! They are used later on.
-def psitblastn(profile, target_file, outfile="", blast_options={}):
-    """This function runs psitblastn on the target and store results on outfile (if indicated) or in a temporary file, and returns a blast_parser to the results.
+# name -> backend running the blast searches (see blast_backend)
+blast_backends = {
+    backend.name: backend for backend in [blastall_backend(), blastplus_backend()]
+}
+
+
+# file_cache of blast outputs shared by all runs (option -blast_cache), or None if not active. Set in load
+blast_cache = None
+# options not affecting the output of blast, ignored in the names of files in blast_cache
+blast_cache_ignored_options = ["a", "num_threads"]
+
+
+def blast_cache_file(profile, program_name, blast_options_used):
+    """Returns the path of the output of a blast search of profile on the current target in blast_cache. Its name is the md5 of all inputs of the search: the alignment of the profile (or cluster), the target checksum, the blast backend and program, and the blast options (apart from blast_cache_ignored_options), so that the same search run by any other run is found here regardless of its output folder"""
+    search_inputs = [
+        program_name,
+        profile.blast_backend_value().name,
+        profile.content_md5(),
+        repr(profile.max_column_gaps_for_blast_query_value()),
+        target_md5,
+    ]
+    search_inputs += [
+        option_name + "=" + str(blast_options_used[option_name])
+        for option_name in sorted(blast_options_used)
+        if option_name not in blast_cache_ignored_options
+    ]
+    key = hashlib.md5(join(search_inputs, "\n").encode()).hexdigest()
+    return blast_cache.folder + key[:2] + "/" + key + ".blast"
+
+
+def run_blast_search(
+    profile, target_file, outfile, search_files, program_name, blast_options={}
+):
+    """Runs a blast search of profile on the target with its blast backend (see blast_backend). Results are stored on outfile, and a blast_parser to them is returned.
+    search_files is a function returning the query file and the pssm file (None for tblastn) of the search. If option -blast_cache is active, the output is copied from there when present (and search_files is never called), otherwise it is stored there after the search.
     Blast options are read first from blast_options and then from the profile alignment (latter overriding the former).
     """
     blast_options_used = blast_options.copy()
     profile_blast_options = profile.blast_options_dict()
     for option_name in profile_blast_options:
         blast_options_used[option_name] = profile_blast_options[option_name]
+    if blast_cache:
+        cached_file = blast_cache_file(profile, program_name, blast_options_used)
+        if is_file(cached_file) and is_valid_blast_output(cached_file):
+            service("  ...blast output found in blast cache: " + cached_file)
+            blast_cache.touch(cached_file)
+            copy_file(cached_file, outfile)
+            return parse_blast(outfile)
+
+    query_file, pssm_file = search_files()
+    brun_tool(
+        profile.blast_backend_value().search_argv(
+            target_file, query_file, pssm_file, blast_options_used
+        ),
+        stdout_file=temp_folder + program_name + "_out",
+    )
+    move_file(temp_folder + program_name + "_out", outfile)
+    if not is_valid_blast_output(outfile):
+        raise notracebackException(
+            program_name
+            + " ERROR the blast output "
+            + outfile
+            + " doesn't seem complete, although blast exit status was not an error! check the options used"
+        )
+    if blast_cache:
+        os.makedirs(directory_name(cached_file), exist_ok=True)
+        copy_file(outfile, cached_file)
+        blast_cache.add(cached_file)
+    return parse_blast(outfile)
+
+
+def psitblastn(profile, target_file, outfile="", blast_options={}):
+    """This function runs psitblastn on the target and store results on outfile (if indicated) or in a temporary file, and returns a blast_parser to the results.
+    Blast options are read first from blast_options and then from the profile alignment (latter overriding the former).
+    """
     if not outfile:
         outfile = (
             fileid_for_temp_folder(profile.filename)
@@ -3206,121 +4230,67 @@ def psitblastn(profile, target_file, outfile="", blast_options={}):
             + fileid_for_temp_folder(target_file)
         )
 
-    b = bash("which blastall")
-    if b[0]:
-        raise notracebackException("ERROR blastall not found! Please install it")
-    blastall_bin = dereference(b[1])
-    bbash(
-        blastall_bin
-        + " -p psitblastn  -d "
-        + target_file
-        + " -R "
-        + profile.pssm()
-        + " -i "
-        + profile.blast_query_file()
-        + " -I  "
-        + join(
-            ["-" + k + " " + str(blast_options_used[k]) for k in blast_options_used],
-            " ",
-        )
-        + " > "
-        + temp_folder
-        + "psitblastn_out"
+    def search_files():
+        if profile.blast_files:
+            pssm_file, query_file = profile.blast_files  # see prepare_blast_files
+        else:
+            pssm_file, query_file = profile.pssm(), profile.blast_query_file()
+        return query_file, pssm_file
+
+    return run_blast_search(
+        profile,
+        target_file,
+        outfile,
+        search_files,
+        "psitblastn",
+        blast_options=blast_options,
     )
-    bbash("mv " + temp_folder + "psitblastn_out " + outfile)
-    if not is_valid_blast_output(outfile):
-        raise notracebackException(
-            "psitblastn ERROR the blast output "
-            + outfile
-            + " doesn't seem complete, although blast exit status was not an error! check the options used"
-        )
-    return parse_blast(outfile)
 
 
 def tblastn(ss_profile, target_file, outfile="", blast_options={}):
     """This function runs tblastn with a single sequence profile on the target and store results on outfile (if indicated) or in a temporary file, and returns a blast_parser to the results.
     Blast options are read first from blast_options and then from the profile alignment (latter overriding the former).
     """
-    blast_options_used = blast_options.copy()
-    profile_blast_options = ss_profile.blast_options_dict()
-    for option_name in profile_blast_options:
-        blast_options_used[option_name] = profile_blast_options[option_name]
     if not outfile:
         outfile = (
             fileid_for_temp_folder(ss_profile.filename)
             + "_BLAST_"
             + fileid_for_temp_folder(target_file)
         )
-    b = bash("which blastall")
-    if b[0]:
-        raise notracebackException("ERROR blastall not found! Please install it")
-    blastall_bin = dereference(b[1])
-    bbash(
-        blastall_bin
-        + " -p tblastn  -d "
-        + target_file
-        + " -i "
-        + ss_profile.filename
-        + " -I  "
-        + join(
-            ["-" + k + " " + str(blast_options_used[k]) for k in blast_options_used],
-            " ",
-        )
-        + " > "
-        + temp_folder
-        + "tblastn_out"
+    return run_blast_search(
+        ss_profile,
+        target_file,
+        outfile,
+        lambda: (ss_profile.filename, None),
+        "tblastn",
+        blast_options=blast_options,
     )
-    bbash("mv " + temp_folder + "tblastn_out " + outfile)
-    if not is_valid_blast_output(outfile):
-        raise notracebackException(
-            "tblastn ERROR the blast output "
-            + outfile
-            + " doesn't seem complete, although blast exit status was not an error! check the options used"
-        )
-    return parse_blast(outfile)
 
 
 def multi_tblastn(ms_profile, target_file, outfile="", blast_options={}):
     """This function runs a tblastn with a multiple sequence profile compressed to a single consensus query sequence, on the target and store results on outfile (if indicated) or in a temporary file, and returns a blast_parser to the results.
     Blast options are read first from blast_options and then from the profile alignment (latter overriding the former).
     """
-    blast_options_used = blast_options.copy()
-    profile_blast_options = ms_profile.blast_options_dict()
-    for option_name in profile_blast_options:
-        blast_options_used[option_name] = profile_blast_options[option_name]
     if not outfile:
         outfile = (
             fileid_for_temp_folder(ms_profile.filename)
             + "_BLAST_"
             + fileid_for_temp_folder(target_file)
         )
-    b = bash("which blastall")
-    if b[0]:
-        raise notracebackException("ERROR blastall not found! Please install it")
-    blastall_bin = dereference(b[1])
-    bbash(
-        blastall_bin
-        + " -p tblastn  -d "
-        + target_file
-        + " -i "
-        + ms_profile.blast_query_file()
-        + " -I  "
-        + join(
-            ["-" + k + " " + str(blast_options_used[k]) for k in blast_options_used],
-            " ",
-        )
-        + " > "
-        + temp_folder
-        + "tblastn_out"
+
+    def search_files():
+        if ms_profile.blast_files:
+            return ms_profile.blast_files[1], None  # see prepare_blast_files
+        return ms_profile.blast_query_file(), None
+
+    return run_blast_search(
+        ms_profile,
+        target_file,
+        outfile,
+        search_files,
+        "tblastn",
+        blast_options=blast_options,
     )
-    bbash("mv " + temp_folder + "tblastn_out " + outfile)
-    if not is_valid_blast_output(outfile):
-        raise notracebackException(
-            "tblastn ERROR the blast output "
-            + outfile
-            + " doesn't seem complete, although blast exit status was not an error! check the options used"
-        )
-    return parse_blast(outfile)
 
 
 def exonerate(
@@ -3335,32 +4305,21 @@ def exonerate(
     """see below in cyclic exonerate; note: in selenoprofiles, dont_parse=True"""
     if not outfile:
         outfile = temp_folder + "tempout.exonerate"
-    exonerate_options_str = ""
+    argv = ["exonerate", "-m", mode, "--showtargetgff", "1"]
     for k in exonerate_options:
-        exonerate_options_str += " -" + k + ' "' + exonerate_options[k] + '"'
-    b = bash(
-        "exonerate -m "
-        + mode
-        + " --showtargetgff 1 "
-        + exonerate_options_str
-        + " "
-        + int(exhaustive) * "--exhaustive "
-        + ' "'
-        + query_file
-        + '" "'
-        + target_file
-        + '" > '
-        + outfile
-    )
+        argv += ["-" + k, exonerate_options[k]]
+    if exhaustive:
+        argv.append("--exhaustive")
+    b = run_tool(argv + [query_file, target_file], stdout_file=outfile)
     if b[0]:
         # an error occured
-        if "Expected protein query (not DNA) for model" in b[1]:
+        if "Expected protein query (not DNA) for model" in b[2]:
             printerr(
                 "WARNING exonerate crashed because the protein sequence looks too much like a nucleotide sequence. Skipping this result!",
                 1,
             )
         else:
-            raise Exception("ERROR running exonerate: " + b[1])
+            raise Exception("ERROR running exonerate: " + b[2])
     if not dont_parse:
         return parse_exonerate(outfile)
 
@@ -3423,7 +4382,6 @@ def cyclic_exonerate(
     iterations = 1
     cyclic_not_worth_doing = 0
     empty_exonerate = 0
-    chromosome_file = fastafetch(split_folder, seed.chromosome, target_file)
     chromosome_length = chromosome_lengths_hash[seed.chromosome]
     if issubclass(seed.__class__, blasthit):
         current_alignment = alignment()
@@ -3460,7 +4418,7 @@ def cyclic_exonerate(
     ):  ## in this case (chromosome not much bigger than current_range) no cyclic extensions are performed: the whole chromosome is used
         done_left = 1
         done_right = 1
-        target_filename = chromosome_file
+        target_filename = fastafetch(split_folder, seed.chromosome, target_file)
         cyclic_not_worth_doing = 1
     if current_range.boundaries()[0] == 1:
         done_left = 1
@@ -3488,9 +4446,7 @@ def cyclic_exonerate(
                 # not extracting same chunk again
             else:
                 current_range.fasta_sequence(
-                    to_file=target_filename,
-                    chromosome_file=chromosome_file,
-                    title="fasta_title",
+                    to_file=target_filename, target=target_file, title="fasta_title"
                 )
             prev_target_prepared = current_range.fasta_title()
 
@@ -3562,11 +4518,26 @@ def cyclic_exonerate(
     )
     if outfile:
         write_to_file(header, outfile)
-        bbash("cat " + tempout_filename + " >> " + outfile)
+        append_file(tempout_filename, outfile)
 
     return e
 
 
+def clean_genewise_errors(stderr):
+    """Removes from the stderr of genewise the progress messages it prints while computing (e.g. Cells done [...%]), returning the error message left"""
+    for pattern, replacement in [
+        (r"Cells done \[ *-*[0-9]+%\]", ""),
+        (r"Cells [0-9]*%\x08\[ [0-9]*\]", ""),
+        (r"\[[0-9]+% done\]Before mid-j [0-9]+ Cells done [0-9]+%\x08", ""),
+        (r"\[[0-9]+% done\]After *mid-j *[0-9]+ Cells done [0-9]+%\x08", ""),
+        (r"Explicit read off.*\[[0-9]+,[0-9]+\]\[[0-9]+,[0-9]+\]", ""),
+        (r"[\x00-\x08\x0b-\x1f]", ""),
+        (r"  +", " "),
+    ]:
+        stderr = re.sub(pattern, replacement, stderr)
+    return stderr
+
+
 def genewise(
     profile_ali, target_file, outfile="", seed="", extension=15000, genewise_options={}
 ):
@@ -3593,7 +4564,6 @@ def genewise(
         else:
             genewise_options_used[option_name] = profile_genewise_options[option_name]
 
-    chromosome_file = fastafetch(split_folder, seed.chromosome, target_file)
     chromosome_length = chromosome_lengths[seed.chromosome]
 
     ### choosing the query. procedure depends on the type of the seed provided : if it is exonerate, just pick same query. If it is blast, map the alignment to the profile and choose most similar query
@@ -3620,8 +4590,6 @@ def genewise(
     query_filename = temp_folder + "genewise_query.fa"
     target_filename = temp_folder + "genewise_target.fa"
     tempout_filename = temp_folder + "genewise_output"
-    error_file = temp_folder + "genewise_errors_unclean"
-    error_file_cleaned = temp_folder + "genewise_errors"
 
     # preparing query
     query_full_sequence = nogap(profile.seq_of(query_name))
@@ -3630,8 +4598,8 @@ def genewise(
     current_range = seed.boundaries_gene().extend(left=extension, right=extension)
     current_range.check_boundaries(chromosome_length)
     current_range.fasta_sequence(
-        to_file=target_filename, chromosome_file=chromosome_file, title="gw_target"
-    )  # negative strand is already fastarevcomp'ed
+        to_file=target_filename, target=target_file, title="gw_target"
+    )  # negative strand is already reverse complemented
 
     header = (
         "#"
@@ -3650,13 +4618,11 @@ def genewise(
     write_to_file(header, tempout_filename)
     report = ""
 
-    b = bash("which genewise")
-    if b[0]:
-        raise notracebackException(
-            "ERROR genewise not found! Please install it or skip its execution with -dont_genewise"
-        )
-
-    df_genewise = dereference(b[1])
+    df_genewise = tool_path(
+        "genewise",
+        "ERROR genewise not found! Please install it or skip its execution with -dont_genewise",
+        notracebackException,
+    )
     # 2023
     # add_wisecfg = ""
     # if df_genewise.endswith("src/bin/genewise"):
@@ -3665,42 +4631,30 @@ def genewise(
     # works with conda: ## finds its wisecfg
     cfg_dir = df_genewise[:-12] + "share/wise2/wisecfg"
 
-    add_wisecfg = 'export WISECONFIGDIR="' + cfg_dir + '"; '
+    genewise_env = os.environ.copy()
+    genewise_env["WISECONFIGDIR"] = cfg_dir
 
     # b holds the exit status of genewise (in pos 0)
-    b = bash(
-        add_wisecfg
-        + " "
-        # + df_genewise
-        + "genewise"
-        + " -pretty -sum -gff "
-        + join(
-            [
-                "-" + str(k) + " " + str(genewise_options_used[k])
-                for k in genewise_options_used
-            ],
-            " ",
+    b = run_tool(
+        ["genewise", "-pretty", "-sum", "-gff"]
+        + shlex.split(
+            join(
+                [
+                    "-" + str(k) + " " + str(genewise_options_used[k])
+                    for k in genewise_options_used
+                ],
+                " ",
+            )
         )
-        + " "
-        + query_filename
-        + ' "'
-        + target_filename
-        + '"  >> '
-        + tempout_filename
-        + " 2> "
-        + error_file
-    )
-    bash(
-        "sed 's/Cells done \\[[ ]*-*[0-9][0-9]*%\\]//g' "
-        + error_file
-        + " |  sed 's/Cells [0-9]*%\\x08\\[ [0-9]*\\]//g' | sed  's/\\[[0-9][0-9]*% done\\]Before mid-j [0-9][0-9]* Cells done [0-9][0-9]*%\\x08//g' | sed 's/\\[[0-9][0-9]*% done\\]After[ ]* mid-j[ ]* [0-9][0-9]* Cells done [0-9][0-9]*%\\x08//g' |   sed 's/Explicit read off.*\\[[0-9][0-9]*,[0-9][0-9]*\\]\\[[0-9][0-9]*,[0-9][0-9]*\\]//g' | sed 's/\\x[0-9]*//g' | sed 's/ [ ]*/ /g'   > "
-        + error_file_cleaned
+        + [query_filename, target_filename],
+        stdout_file=tempout_filename,
+        append=True,
+        env=genewise_env,
     )
     if b[0]:  # genewise exited with exit status != 0. Some error occured
-        if int(bash('grep -c "Segmentation fault" ' + error_file_cleaned)[1]) > 0:
+        report = clean_genewise_errors(b[2])
+        if b[0] == -signal.SIGSEGV or "Segmentation fault" in report:
             report = "Segmentation fault"  # known problem
-        else:
-            report = join(open(error_file_cleaned, "r").readlines(), "\n")
         if "Could not read a GeneFrequency file in human.gf" in report:
             raise notracebackException(
                 "ERROR genewise is not installed properly. Please visit  http://big.crg.cat/news/20110616/installing_programs_and_modules_needed_by_selenoprofiles to fix it. This is the error message: "
@@ -3714,7 +4668,7 @@ def genewise(
         g = genewisehit()
         g.load(tempout_filename)
     if outfile:
-        bbash("mv " + tempout_filename + " " + outfile)
+        move_file(tempout_filename, outfile)
     return g
 
 
@@ -4306,6 +5260,7 @@ class profile_alignment(alignment):
     .clustering_seqid     -> sequence identity threshold for pre-psitblastn clustering
     .max_columns_gaps     -> maximum percent of gaps allowed in a column to be included in the consensus query computed for psitblastn searches
     .max_blast_hits       -> maximum number of blast hits allowed for this profile
+    .blast_backend        -> programs running the blast searches for this profile (see blast_backends); if not defined, option -blast_backend is used
     """
 
     parameters = [
@@ -4342,6 +5297,7 @@ class profile_alignment(alignment):
         self.go_terms = []
         self.sec_pos_data = None
         self.name = ""
+        self.blast_files = None
         self.clusters_data = None
         self.blast_queries_data = None
         self.conservation_data = None
@@ -4811,8 +5767,17 @@ class profile_alignment(alignment):
     #      raise skipprofileException, "ERROR loading profile_data for profile: "+self.name+' ; try removing the .profile_data file and rerun.'
 
     def md5sum_id(self):
-        """Returns the md5sum output on the alignmetn file. useful to check if the alignment has changed from a previous run"""
-        return bbash("md5sum " + self.filename).split()[0]
+        """Returns the md5sum of the alignment file (computed in process). useful to check if the alignment has changed from a previous run"""
+        with open(self.filename, "rb") as fh:
+            return hashlib.md5(fh.read()).hexdigest()
+
+    def content_md5(self):
+        """Returns the md5 of the titles and sequences of the alignment, in order. Unlike md5sum_id, this does not require the alignment to be stored in a file, so it is available also for clusters"""
+        return hashlib.md5(
+            join(
+                [title + "\n" + self.seq_of(title) for title in self.titles()], "\n"
+            ).encode()
+        ).hexdigest()
 
     def queries_titles(self):
         """Returns the titles of the sequences tagged as queries. see make_profile help for the accepted expressions"""
@@ -4978,51 +5943,27 @@ class profile_alignment(alignment):
         return len(self.clusters())
 
     def pssm(self, fileout=""):
-        """This function builds a pssm from the profile to be used with psiblast. If the file is not specified, it is created in the temp file with the base name of the profile + .pssm.
-        In both cases, a file called as the pssm, but with the added extension .ascii is created, containing the pssm in human readable format.
+        """This function builds a pssm from the profile to be used with psitblastn, through the blast backend of the profile (see blast_backend). If the file is not specified, it is created in the temp file with the base name of the profile + .pssm + the extension of the backend (.chk for blastall).
+        In both cases, a file called as the pssm, but with the added extension .ascii replacing the backend extension is created, containing the pssm in human readable format.
         """
+        backend = self.blast_backend_value()
         if fileout:
             pssm_filename = fileout
         else:
-            pssm_filename = temp_folder + self.name + ".pssm.chk"
-        pssm_ascii_filename = pssm_filename[:-4] + ".ascii"
+            pssm_filename = temp_folder + self.name + ".pssm" + backend.pssm_extension
+        pssm_ascii_filename = pssm_filename[: -len(backend.pssm_extension)] + ".ascii"
         ## debug
         # self.display(temp_folder+'temp_doing_pssm.fa')
         # raw_input(temp_folder+'temp_doing_pssm.fa')
 
-        blast_ali_file = self.blast_format_alignment()
-        query_filename_withX = self.blast_query_file(sec_char="X")
         write_to_file(">noseq\nXXXX", temp_folder + "tiny_db")
-        bbash("formatdb -i " + temp_folder + "tiny_db -p T -o T")
-        b = bash("which blastpgp")
+        brun_tool(["formatdb", "-i", temp_folder + "tiny_db", "-p", "T", "-o", "T"])
+        argv = backend.pssm_argv(
+            self, pssm_filename, pssm_ascii_filename, temp_folder + "tiny_db"
+        )
+        b = run_tool(argv)
         if b[0]:
-            raise notracebackException("ERROR blastpgp not found! Please install it")
-        blastpgp_bin = dereference(b[1])
-        cmnd = (
-            blastpgp_bin
-            + "  -i "
-            + query_filename_withX
-            + " -B "
-            + blast_ali_file
-            + " -j 1 -d  "
-            + temp_folder
-            + "tiny_db "
-            + " -C "
-            + pssm_filename
-            + "  -Q "
-            + pssm_ascii_filename
-        )
-        b = bash(cmnd)
-        if b[0] and "[blastpgp] WARNING: SetUpBlastSearch failed." in b[1]:
-            raise notracebackException(
-                "ERROR blastall is not properly installed. Please visit https://guigolab.github.io/blog/20110616/installing-programs-and-modules-needed-by-selenoprofiles/ to fix it. This is the error message: "
-                + b[1]
-                + "\n"
-            )
-        elif b[0]:
-            raise Exception(
-                "unknown ERROR with blastpgp, cmnd:  " + cmnd + " ERROR: " + b[1]
-            )
+            backend.pssm_error(argv, b)
         return pssm_filename
 
     def pssm_matrix(self, modify_sec=False):
@@ -5092,6 +6033,21 @@ class profile_alignment(alignment):
             return last_title
         return "BLAST_QUERY"
 
+    def prepare_blast_files(self, folder):
+        """Builds the pssm and blast query file of each cluster in folder, and stores their paths as the .blast_files attribute of the clusters; these are then used by psitblastn and multi_tblastn instead of building them at every search. Used with option -batch, to prepare the profile only once for all targets"""
+        for cluster_profile_ali in self.clusters():
+            cluster_profile_ali.blast_files = (
+                cluster_profile_ali.pssm(
+                    fileout=folder
+                    + cluster_profile_ali.name
+                    + ".pssm"
+                    + cluster_profile_ali.blast_backend_value().pssm_extension
+                ),
+                cluster_profile_ali.blast_query_file(
+                    fileout=folder + cluster_profile_ali.name + ".blast_query"
+                ),
+            )
+
     def blast_query_file(self, fileout="", sec_char="U"):  # 3.1a
         """This function builds a file that can be used as query of psiblast. Us are replaced with * (or with the argument of sec_char).
         If fileout is not specified, it is built in the temporary folder and the filename is returned.
@@ -5314,6 +6270,22 @@ class profile_alignment(alignment):
         """This takes the attribute self.max_column_gaps and translates it into something that can be used right away (it changes the potential label into a value)"""
         return self.options_non_str(category="max_column_gaps", istype=float)
 
+    def blast_backend_value(self):
+        """Returns the blast_backend running the blast searches of this profile: the one named by attribute blast_backend, if defined in the profile configuration file, otherwise the one chosen with option -blast_backend (blastall by default)"""
+        if self.is_cluster_subalignment():
+            return self.parent_profile.blast_backend_value()
+        backend_name = self.__dict__.get("blast_backend") or opt["blast_backend"]
+        if not backend_name:
+            backend_name = "blastall"
+        if backend_name not in blast_backends:
+            raise notracebackException(
+                "selenoprofiles ERROR unknown blast backend: "
+                + str(backend_name)
+                + " ; possible values are: "
+                + join(sorted(blast_backends), ", ")
+            )
+        return blast_backends[backend_name]
+
     def max_blast_hits_number_value(self):
         """This takes the attribute self.max_blast_hits and translates it into something that can be used right away (it changes the potential label into a value)"""
         return self.options_non_str(category="max_blast_hits", istype=int)
@@ -5539,8 +6511,8 @@ class selenoprofiles_db(sqlite.Connection):
             "CREATE TABLE features (id INTEGER PRIMARY KEY, resultid INTEGER,  type VARCHAR(15), text VARCHAR(2000) )"
         )
 
-    def add_entry(self, table_name, entry_from_db, make_id_null=True):
-        """This add a result from another db in the table with the same name"""
+    def add_entry(self, table_name, entry_from_db, make_id_null=True, silent=False):
+        """This add a result from another db in the table with the same name. Returns the id of the entry added"""
         db_cursor = self.cursor()
         if make_id_null:
             entry_to_put = entry_from_db[1:]
@@ -5553,18 +6525,20 @@ class selenoprofiles_db(sqlite.Connection):
             parentesis_part += "?, "
         parentesis_part = parentesis_part[:-2]
         parentesis_part += ")"
-        write(
-            "INSERT INTO "
-            + table_name
-            + " VALUES "
-            + parentesis_part
-            + " --- "
-            + str(entry_to_put),
-            1,
-        )
+        if not silent:
+            write(
+                "INSERT INTO "
+                + table_name
+                + " VALUES "
+                + parentesis_part
+                + " --- "
+                + str(entry_to_put),
+                1,
+            )
         db_cursor.execute(
             "INSERT INTO " + table_name + " VALUES " + parentesis_part, (entry_to_put)
         )
+        return db_cursor.lastrowid
 
     def has_results_for_profile(self, profile):
         """Return a value among NO YES ONGOING UNCHECKED WAITING UNCHECKED-2.    NO   is returned even if there's no entry in the db"""
@@ -5647,33 +6621,49 @@ class selenoprofiles_db(sqlite.Connection):
 
     def add_result(self, p2g_hit):
         """Add a result to the database, annotating its data (prediction program etc), and also  the chromosome is in. The majority of information is in the header"""
+        self.add_result_entry(*self.result_entry(p2g_hit))
+
+    def result_entry(self, p2g_hit):
+        """Returns the values stored by add_result for this p2g_hit: a tuple for the results table (without id), and a list of (feature_name, text) for the features table"""
         state = p2g_hit.filtered
         if state == "redundant":
             state += "_" + str(p2g_hit.overlapping.id)
-        db_cursor = self.cursor()
         target_header = p2g_hit.header(
             no_species=True, no_target=True, no_chromosome=True
         )
         query_header = p2g_hit.query.header(
             no_id=True, no_species=True, no_target=True, no_strand=True
         )
+        result_values = (
+            p2g_hit.profile.name,
+            p2g_hit.prediction_program(),
+            target_header,
+            query_header,
+            p2g_hit.chromosome,
+            p2g_hit.alignment.seq_of("q"),
+            p2g_hit.alignment.seq_of("t"),
+            p2g_hit.label,
+            state,
+            p2g_hit.weighted_seq_identity_with_profile(),
+        )
+        features = [
+            (obj.__class__.__name__, obj.dump_text()) for obj in p2g_hit.features
+        ]
+        return result_values, features
+
+    def add_result_entry(self, result_values, features):
+        """Insert a result as returned by result_entry, together with its features"""
+        db_cursor = self.cursor()
         db_cursor.execute(
             "INSERT INTO results VALUES (null  , ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                p2g_hit.profile.name,
-                p2g_hit.prediction_program(),
-                target_header,
-                query_header,
-                p2g_hit.chromosome,
-                p2g_hit.alignment.seq_of("q"),
-                p2g_hit.alignment.seq_of("t"),
-                p2g_hit.label,
-                state,
-                p2g_hit.weighted_seq_identity_with_profile(),
-            ),
-        )
-        for obj in p2g_hit.features:
-            self.add_feature_to_result(obj, p2g_hit)
+            result_values,
+        )
+        result_id = db_cursor.lastrowid
+        for feature_name, text in features:
+            db_cursor.execute(
+                "INSERT INTO features VALUES (null, ?,  ?, ?)",
+                (result_id, feature_name, text),
+            )
 
     def add_feature_to_result(self, obj, p2g_hit):
         """Add a feature (obj) to this result in the database"""
@@ -5901,6 +6891,33 @@ class selenoprofiles_db(sqlite.Connection):
                     )
 
 
+class profile_worker_db(object):
+    """Stand-in for results_db within a child process of option -profile_workers. Reads are served by a private connection to results.sqlite, while every write is sent through a queue to the main process, which is the only one writing to the database (see run_profile_workers)"""
+
+    def __init__(self, db_file, message_queue, profile_index):
+        self.reader = selenoprofiles_db(db_file)
+        self.message_queue = message_queue
+        self.profile_index = profile_index
+
+    def send(self, method_name, *args):
+        self.message_queue.put(("db", self.profile_index, method_name, args))
+
+    def has_results_for_profile(self, profile):
+        return self.reader.has_results_for_profile(profile)
+
+    def set_has_results_for_profile(self, profile_name, value):
+        self.send("set_has_results_for_profile", profile_name, value)
+
+    def clear_results(self, profile_name):
+        self.send("clear_results", profile_name)
+
+    def add_result(self, p2g_hit):
+        self.send("add_result_entry", *self.reader.result_entry(p2g_hit))
+
+    def save(self):
+        self.send("save")
+
+
 ##############################################################################################################################################
 ####GENE SUBCLASSES
 ##########
@@ -6119,25 +7136,23 @@ class p2ghit(gene):
     def stop_codons(self):
         """Returns a list of elements like[position_in_prot_seq_1_based, codon_in_upper_RNA_letters]"""
         out = []
-        for pos in range(len(self.protein())):
-            if self.protein()[pos] in "*":
-                codon = replace_chars(
-                    upper(self.cds()[pos * 3 : pos * 3 + 3]), "T", "U"
+        cds_seq = self.cds()
+        for pos in char_positions(self.protein(), "*"):
+            codon = replace_chars(upper(cds_seq[pos * 3 : pos * 3 + 3]), "T", "U")
+            if codon in STOP_CODONS:
+                out.append([pos + 1, codon])
+            else:
+                # print self
+                raise Exception(
+                    'ERROR the codon for "*" is not a stop codon: '
+                    + codon
+                    + " ; result_id:"
+                    + str(self.id)
+                    + " ; prediction_program: "
+                    + self.prediction_program()
+                    + " GFF: \n"
+                    + self.gff()
                 )
-                if codon in STOP_CODONS:
-                    out.append([pos + 1, codon])
-                else:
-                    # print self
-                    raise Exception(
-                        'ERROR the codon for "*" is not a stop codon: '
-                        + codon
-                        + " ; result_id:"
-                        + str(self.id)
-                        + " ; prediction_program: "
-                        + self.prediction_program()
-                        + " GFF: \n"
-                        + self.gff()
-                    )
         return out
 
     def n_stop_codons(self):
@@ -6632,11 +7647,15 @@ class p2ghit(gene):
                     id_go_associations_hash = (
                         {}
                     )  # key: id; value: list of GO code strings e.g, "GO:0055114"
-                    id_go_associations_string = bbash(
-                        "gawk -v id_file="
-                        + id_list_file
-                        + """ -F"\\t" 'BEGIN{ while ((getline idline < id_file)>0){ GI_INPUT[idline]=1 } } { split($1, GI, "; "); split("", gi_match); for (i=1; i<=length(GI); i++){ if (GI[i] in GI_INPUT) { gi_match[GI[i]]=1}   }; o=""; for (g in gi_match) o=o"; " g; if (o)  print substr(o, 3) "\\t" $2  }' """
-                        + self.profile.uniref2go_db_filename(),
+                    id_go_associations_string = brun_tool(
+                        [
+                            "gawk",
+                            "-v",
+                            "id_file=" + id_list_file,
+                            "-F\t",
+                            """BEGIN{ while ((getline idline < id_file)>0){ GI_INPUT[idline]=1 } } { split($1, GI, "; "); split("", gi_match); for (i=1; i<=length(GI); i++){ if (GI[i] in GI_INPUT) { gi_match[GI[i]]=1}   }; o=""; for (g in gi_match) o=o"; " g; if (o)  print substr(o, 3) "\\t" $2  }""",
+                            self.profile.uniref2go_db_filename(),
+                        ],
                         dont_die=1,
                     )
                     if id_go_associations_string:
@@ -6757,28 +7776,20 @@ class p2ghit(gene):
                     + "  -> "
                     + outfile
                 )
-            b = bash("which blastall")
-            if b[0]:
-                raise notracebackException(
-                    "ERROR blastall not found! Please install it"
-                )
-            blastall_bin = dereference(b[1])
-            bbash(
-                blastall_bin
-                + " -I -p blastp -d "
-                + blast_db
-                + " -i "
-                + query_file
-                + " "
-                + tag_blast_options_string
-                + " > "
-                + temp_folder
-                + "tagblast_out"
+            blastall_bin = tool_path(
+                "blastall",
+                "ERROR blastall not found! Please install it",
+                notracebackException,
+            )
+            brun_tool(
+                [blastall_bin, "-I", "-p", "blastp", "-d", blast_db, "-i", query_file]
+                + shlex.split(tag_blast_options_string),
+                stdout_file=temp_folder + "tagblast_out",
             )
-            bbash("mv " + temp_folder + "tagblast_out " + outfile)
+            move_file(temp_folder + "tagblast_out", outfile)
             if not silent:
                 service("")
-            bbash("rm " + query_file)
+            remove_files(query_file)
         return outfile
 
     tag_blast = blast_against_tag_db
@@ -7653,10 +8664,13 @@ class p2ghit(gene):
             old_p2g = self.copy()
             try:
                 n_gaps_in_target = 0
-                for pos in range(self.alignment.length()):
-                    if self.alignment.seq_of("t")[pos] == "-":
+                target_seq = self.alignment.seq_of(
+                    "t"
+                )  # the alignment is not modified in the loop, which returns after cutting any stop codon
+                for pos in range(len(target_seq)):
+                    if target_seq[pos] == "-":
                         n_gaps_in_target += 1
-                    elif self.alignment.seq_of("t")[pos] == "*":
+                    elif target_seq[pos] == "*":
                         this_aa_codon = self.subseq(3 * (pos - n_gaps_in_target) + 1, 3)
                         # now searching the nearest intron
                         introns_index_and_distances_and_direction = (
@@ -8348,41 +9362,81 @@ class blasthit(p2ghit):
     """
 
     def load_blaster(self, line, dont_keep_ali=None, id=None, keep_lengths=None):
-        dont_keep_ali = dont_keep_ali or self["dont_keep_ali"]
+        """Loads a line of blaster_parser output (see blaster_parser.awk)"""
         splt = line.split()
-        self.chromosome = splt[0]
-        self.strand = splt[3]  # not 100% sure ...
         start, stop = int(splt[1]), int(splt[2])
-        if start > stop:  # USELESS!
+        if splt[3] == "-" and start < stop:
             start, stop = stop, start
+        self.load_hsp(
+            splt[0],
+            start,
+            stop,
+            splt[4],
+            int(splt[5]),
+            int(splt[6]),
+            target_seq=splt[7],
+            query_seq=splt[8],
+            evalue=splt[9],
+            bits=splt[10],
+            target_length=splt[11] if keep_lengths else None,
+            query_length=splt[12] if keep_lengths else None,
+            dont_keep_ali=dont_keep_ali,
+            id=id,
+        )
+
+    def load_hsp(
+        self,
+        target,
+        target_start,
+        target_end,
+        query,
+        query_start,
+        query_end,
+        target_seq="",
+        query_seq="",
+        evalue=None,
+        bits=None,
+        target_length=None,
+        query_length=None,
+        dont_keep_ali=None,
+        id=None,
+    ):
+        """Loads a blast HSP from its fields, as parsed from any blast output format (see parse_blast). Positions are 1-based; a start greater than the end indicates the negative strand, for the target as for the query.
+        The aligned sequences are kept in the .alignment (with titles "q" and "t") unless dont_keep_ali is True. Lengths of target and query are stored as attributes .target_length and .query_length if provided
+        """
+        dont_keep_ali = dont_keep_ali or self["dont_keep_ali"]
+        self.chromosome = target
+        self.strand = "+"
+        if target_start > target_end:
+            target_start, target_end = target_end, target_start
             self.strand = "-"
-        self.add_exon(start, stop)
+        self.add_exon(target_start, target_end)
         # alignment
         self.alignment = alignment()
         if not dont_keep_ali:
             self.alignment.add(
-                "q", splt[8]
+                "q", query_seq
             )  # not keeping the title here, I already have it in chromosome
-            self.alignment.add("t", splt[7])
-        if keep_lengths:
-            self.target_length = int(splt[11])
-            self.query_length = int(splt[12])
-
-        self.evalue = e_v(splt[9])
-        self.bits = float(splt[10])
+            self.alignment.add("t", target_seq)
+        if not target_length is None:
+            self.target_length = int(target_length)
+        if not query_length is None:
+            self.query_length = int(query_length)
+
+        self.evalue = e_v(evalue)
+        self.bits = float(bits)
         if id:
             self.id = id
         else:
             self.id = str(uniq_id(self))
         # query
-        start, stop = int(splt[5]), int(splt[6])
-        self.query = gene(chromosome=splt[4], id=self.id + "_query")
-        if start > stop:
-            start, stop = stop, start
+        self.query = gene(chromosome=query, id=self.id + "_query")
+        if query_start > query_end:
+            query_start, query_end = query_end, query_start
             self.query.strand = "-"
         else:
             self.query.strand = "+"
-        self.query.add_exon(start, stop)
+        self.query.add_exon(query_start, query_end)
 
     load = load_blaster
 
@@ -8644,36 +9698,41 @@ class superblasthit(blasthit):
         return o
 
 
+def blasthit_from_tab_line(line):
+    """Returns a blasthit (without .alignment) from a line of tabular blast output"""
+    splt = line.split("\t")
+    # target
+    s, e, strand = int(splt[8]), int(splt[9]), "+"
+    if s > e:
+        strand = "-"
+        s, e = e, s
+    g = blasthit()
+    g.chromosome = splt[1]
+    g.strand = strand  ## will return g
+    g.alignment = None
+    # alignment(); g.alignment.add('q', 'X'); g.alignment.add('t', 'X');
+    g.add_exon(s, e)
+    # query
+    s, e, strand = int(splt[6]), int(splt[7]), "+"
+    if s > e:
+        strand = "-"
+        s, e = e, s
+    g.query.chromosome = splt[0]
+    g.query.strand = strand
+    g.query.add_exon(s, e)
+    g.evalue = e_v(splt[10])
+    g.bits = float(splt[11])
+    g.identity = float(splt[2])
+    return g
+
+
 class parse_blast_tab(parser):
     """Read blast hits (without .alignment)"""
 
     def parse_next(self):
         if not self.last_line:
             self.stop()
-        splt = self.last_line.split("\t")
-        # target
-        s, e, strand = int(splt[8]), int(splt[9]), "+"
-        if s > e:
-            strand = "-"
-            s, e = e, s
-        g = blasthit()
-        g.chromosome = splt[1]
-        g.strand = strand  ## will return g
-        g.alignment = None
-        # alignment(); g.alignment.add('q', 'X'); g.alignment.add('t', 'X');
-        g.add_exon(s, e)
-        # query
-        s, e, strand = int(splt[6]), int(splt[7]), "+"
-        if s > e:
-            strand = "-"
-            s, e = e, s
-        g.query.chromosome = splt[0]
-        g.query.strand = strand
-        g.query.add_exon(s, e)
-        g.evalue = e_v(splt[10])
-        g.bits = float(splt[11])
-        g.identity = float(splt[2])
-
+        g = blasthit_from_tab_line(self.last_line)
         self.last_line = self.file.readline()
         return g
 
@@ -8692,79 +9751,253 @@ class parse_blaster(parser):
         return g
 
 
+blast_alignment_line_regexp = re.compile(r"(Query|Sbjct):?\s+(\d+)\s*(\S*)\s+(\d+)\s*$")
+blast_length_line_regexp = re.compile(r"\s*Length\s*=\s*([\d,]+)\s*$")
+blast_letters_line_regexp = re.compile(r"\s*\(([\d,]+) letters\)")
+
+
+def blast_output_format(first_line):
+    """Returns the format of a blast output given its first line: "xml", "tab" (tabular, with or without comment lines) or "pairwise" (default text output)"""
+    if first_line.startswith("<?xml"):
+        return "xml"
+    if first_line.startswith("# ") or first_line.count("\t") >= 11:
+        return "tab"
+    return "pairwise"
+
+
 class parse_blast(parser):
-    """Parse a ncbi blast output file, which is passed through blaster_parser to. blasthit instances are returned on each next() call. Define dont_keep_ali=1 when calling the parser to ignore the alignments in the blast output.
-    When initialising, add keyargs full_target=1 or full_query=1 to have complete names instead of just the first word. You can use full=1 to have both
+    """Parse a ncbi blast output file: blasthit instances are returned on each next() call. Define dont_keep_ali=1 when calling the parser to ignore the alignments in the blast output.
+    When initialising, add keyargs full_target=1 or full_query=1 to have complete names instead of just the first word. You can use full=1 to have both. With keep_lengths=1, the lengths of query and target are stored in the blasthits (.query_length, .target_length)
+    The format is detected from the first line: the default pairwise text output of blastall or blast+ is read, as well as the tabular (-m 8, -m 9) and xml (-m 7) outputs; tabular output gives blasthits without alignment.
+    Files are read line by line in a single pass and each HSP is returned as soon as its lines are read, so the first hits are available before the whole file is parsed
     """
 
     def load(self, filename=""):
         if not filename:
             filename = self.file.name
-        if filename != "<fdopen>":
+        if isinstance(filename, io.IOBase):
+            self.file = filename
+        else:
             check_file_presence(filename, "filename")
-
-        add_option = ""
+            self.file = open(filename, "r")
         if self["full"]:
-            add_option += " -v FULL=1 "
             self.full_query = 1
             self.full_target = 1
-        else:
-            if self["full_query"]:
-                add_option += " -v FULL_QUERY=1 "
-            if self["full_target"]:
-                add_option += " -v FULL_TARGET=1 "
-        if self["keep_lengths"]:
-            add_option += " -v QLENGTH=1 -v TLENGTH=1 "
-
-        # b_awk=bash('which awk')
-        # if b_awk[0]: # exit code >0
-        b_gawk = bash("which gawk")
-        if b_gawk[0]:
-            raise notracebackException(
-                "ERROR gawk must be available to run selenoprofiles! Install it with: conda install -c anaconda gawk"
-            )
-        awk_exec = b_gawk[1]
-        # else:
-        #     awk_exec=b_awk[1]
-
-        pipe_cmd = (
-            awk_exec
-            + " -f "
-            + selenoprofiles_install_dir
-            + "/blaster_parser.awk "
-            + add_option
-            + " "
-            + filename
-        )
-        # write(pipe_cmd, 1, how='magenta')
-        self.bash_pipe = bash_pipe(pipe_cmd, return_popen=1)
-        self.file = self.bash_pipe.stdout
         self.last_line = self.file.readline()
-        if self.bash_pipe.poll():  # exit code
-            raise Exception(
-                "ERROR parsing blast output! check standard error message above"
-            )
+        self.blast_format = blast_output_format(self.last_line)
+        if self.blast_format == "tab":
+            self.skip_tab_comments()
+            return
+        self.skip_comments = False  # in pairwise output, "#" starts no comment lines
+        if self.blast_format == "xml":
+            self.xml_hsps = self.iterate_xml()
+            self.next_hsp = next(self.xml_hsps, None)
+            if self.next_hsp is None:
+                self.last_line = ""
+            return
+        self.query_name, self.query_length = "UNKNOWN_QUERY", None
+        self.target_name, self.target_length = None, None
+        self.advance()
+
+    def skip_tab_comments(self):
+        """Moves self.last_line past comment lines (-m 9 output, also reports of queries without hits) and blank lines of tabular blast output. At the end of file, self.last_line is empty"""
+        while self.last_line and (
+            self.last_line.startswith("#") or not self.last_line.strip()
+        ):
+            self.last_line = self.file.readline()
 
     def parse_next(self):
-        g = blasthit()
-        g.load(
-            self.last_line,
-            dont_keep_ali=bool(self["dont_keep_ali"]),
-            keep_lengths=bool(self["keep_lengths"]),
-        )
-        if self["full_query"]:
-            g.query.chromosome = replace_chars(g.query.chromosome, "%", " ")
+        if self.blast_format == "tab":
+            self.skip_tab_comments()
+            if not self.last_line:
+                self.stop()
+            g = blasthit_from_tab_line(self.last_line)
+            self.last_line = self.file.readline()
+            self.skip_tab_comments()
+            return g
+        if self.blast_format == "xml":
+            g = self.next_hsp
+            self.next_hsp = next(self.xml_hsps, None)
+            if self.next_hsp is None:
+                self.last_line = ""
+            return g
+        return self.parse_next_pairwise()
+
+    def full_name(self, lines):
+        """Joins the lines of a title (query or target) into a full name, removing multiple spaces"""
+        return re.sub(
+            " +", " ", join([line.rstrip("\n") for line in lines], " ")
+        ).strip()
+
+    def advance(self):
+        """Reads the pairwise blast output from self.last_line to the next line starting an HSP ("Score =" line), updating the current query and target names and lengths. At the end of file, self.last_line is empty"""
+        line = self.last_line
+        while line and not "Score =" in line:
+            if line.startswith("Query="):
+                title_lines = [line[7:]]
+                line = self.file.readline()
+                while (
+                    line
+                    and not blast_letters_line_regexp.match(line)
+                    and not blast_length_line_regexp.match(line)
+                ):
+                    title_lines.append(line)
+                    line = self.file.readline()
+                self.query_length = (
+                    replace_chars(
+                        (
+                            blast_letters_line_regexp.match(line)
+                            or blast_length_line_regexp.match(line)
+                        ).group(1),
+                        ",",
+                    )
+                    if line
+                    else None
+                )
+                if self["full_query"]:
+                    self.query_name = self.full_name(title_lines)
+                else:
+                    self.query_name = (title_lines[0].split() + ["UNKNOWN_QUERY"])[0]
+            elif line.startswith(">"):
+                title_lines = [line[1:]]
+                line = self.file.readline()
+                while line and not blast_length_line_regexp.match(line):
+                    title_lines.append(line)
+                    line = self.file.readline()
+                self.target_length = (
+                    replace_chars(blast_length_line_regexp.match(line).group(1), ",")
+                    if line
+                    else None
+                )
+                if self["full_target"]:
+                    self.target_name = self.full_name(title_lines)
+                else:
+                    self.target_name = title_lines[0].split()[0]
+            line = self.file.readline()
+        self.last_line = line
 
-        if self["full_target"]:
-            g.chromosome = replace_chars(g.chromosome, "%", " ")
-        self.last_line = self.file.readline()
-        if self.bash_pipe.poll():  # exit code
+    def parse_next_pairwise(self):
+        """Parses the HSP starting at self.last_line (a "Score =" line), until the line starting the next HSP, target, query or the statistics at the end of the report"""
+        score_line_splt = self.last_line.split("=")
+        bits = score_line_splt[1].split()[0]
+        evalue = score_line_splt[2].split(",")[0].strip()
+        query_seqs, target_seqs = [], []
+        query_start, target_start = None, None
+        line = self.file.readline()
+        while (
+            line
+            and not "Score =" in line
+            and not line.startswith(">")
+            and not line.startswith("Query=")
+            and not line.startswith("Reference:")
+            and not line.startswith("Matrix:")
+            and not line.startswith("##")
+        ):
+            alignment_line_match = blast_alignment_line_regexp.match(line)
+            if alignment_line_match:
+                seq_name, start, seq, end = alignment_line_match.groups()
+                if seq_name == "Query":
+                    if query_start is None:
+                        query_start = int(start)
+                    query_end = int(end)
+                    query_seqs.append(seq)
+                else:
+                    if target_start is None:
+                        target_start = int(start)
+                    target_end = int(end)
+                    target_seqs.append(seq)
+            line = self.file.readline()
+        if query_start is None or target_start is None:
             raise Exception(
-                "ERROR parsing blast output! check standard error message above"
+                "ERROR parsing blast output! HSP without alignment in file: "
+                + self.file.name
             )
-
+        g = blasthit()
+        g.load_hsp(
+            self.target_name,
+            target_start,
+            target_end,
+            self.query_name,
+            query_start,
+            query_end,
+            target_seq=join(target_seqs, ""),
+            query_seq=join(query_seqs, ""),
+            evalue=evalue,
+            bits=bits,
+            target_length=self.target_length if self["keep_lengths"] else None,
+            query_length=self.query_length if self["keep_lengths"] else None,
+            dont_keep_ali=bool(self["dont_keep_ali"]),
+        )
+        self.last_line = line
+        self.advance()
         return g
 
+    def iterate_xml(self):
+        """Generator of the blasthits of a xml blast output, read incrementally from self.file (whose first line was already read into self.last_line)"""
+        import xml.etree.ElementTree as ElementTree
+
+        xml_parser = ElementTree.XMLPullParser(events=["end"])
+        xml_parser.feed(self.last_line)
+        query_name, query_length = "UNKNOWN_QUERY", None
+        target_name, target_length = None, None
+        for line in self.file:
+            xml_parser.feed(line)
+            for event, element in xml_parser.read_events():
+                if element.tag == "Iteration_query-def":
+                    query_name = element.text.strip()
+                    if not self["full_query"]:
+                        query_name = query_name.split()[0]
+                elif element.tag == "Iteration_query-len":
+                    query_length = element.text
+                elif element.tag == "Hit_id":
+                    hit_id = element.text.strip()
+                elif element.tag == "Hit_def":
+                    target_name = element.text.strip() if element.text else ""
+                    if not hit_id.startswith("gnl|BL_ORD_ID|"):
+                        target_name = (hit_id + " " + target_name).strip()
+                    if not self["full_target"]:
+                        target_name = target_name.split()[0]
+                elif element.tag == "Hit_len":
+                    target_length = element.text
+                elif element.tag == "Hsp":
+                    hsp = {child.tag: child.text for child in element}
+                    target_start, target_end = int(hsp["Hsp_hit-from"]), int(
+                        hsp["Hsp_hit-to"]
+                    )
+                    if (
+                        int(hsp.get("Hsp_hit-frame", "1")) < 0
+                        and target_start < target_end
+                    ):
+                        target_start, target_end = target_end, target_start
+                    query_start, query_end = int(hsp["Hsp_query-from"]), int(
+                        hsp["Hsp_query-to"]
+                    )
+                    if (
+                        int(hsp.get("Hsp_query-frame", "1")) < 0
+                        and query_start < query_end
+                    ):
+                        query_start, query_end = query_end, query_start
+                    g = blasthit()
+                    g.load_hsp(
+                        target_name,
+                        target_start,
+                        target_end,
+                        query_name,
+                        query_start,
+                        query_end,
+                        target_seq=hsp.get("Hsp_hseq", ""),
+                        query_seq=hsp.get("Hsp_qseq", ""),
+                        evalue=hsp["Hsp_evalue"],
+                        bits=hsp["Hsp_bit-score"],
+                        target_length=target_length if self["keep_lengths"] else None,
+                        query_length=query_length if self["keep_lengths"] else None,
+                        dont_keep_ali=bool(self["dont_keep_ali"]),
+                    )
+                    element.clear()
+                    yield g
+                elif element.tag in ["Hit", "Iteration"]:
+                    element.clear()
+
 
 ##########
 # EXONERATEHIT
@@ -10124,17 +11357,13 @@ def Secisearch3(p2g, three_prime_length=-1, silent=False, full=False):
         )
         write_to_file(three_prime_text, three_prime_file)
         # running SS3
-        command = (
-            "Seblastian.py "
-            + three_prime_file
-            + " -SS -infernal_no_mpi -type -c -temp "
-            + temp_folder
-            + "secisearch3"
-        )
+        argv = ["Seblastian.py", three_prime_file, "-SS", "-infernal_no_mpi", "-type"]
+        argv += ["-c", "-temp", temp_folder + "secisearch3"]
         if full:
-            command += " -m all "
+            argv += ["-m", "all"]
+        command = join(argv, " ")
         try:
-            b = bash(command)
+            b = run_tool(argv)
             assert not b[0]
         except:
             raise notracebackException(
@@ -10142,6 +11371,7 @@ def Secisearch3(p2g, three_prime_length=-1, silent=False, full=False):
                 + command
                 + " ; ERROR: "
                 + b[1]
+                + b[2]
             )
         ss3_out_file = temp_folder + "three_prime_for_secisearch.output.all_secis"
         # loading results
@@ -10167,13 +11397,11 @@ def Secisearch3(p2g, three_prime_length=-1, silent=False, full=False):
                         1,
                     )
                 # all_euk_secises[secis_element_index].parent=p2g
-        bbash(
-            "rm -r "
-            + temp_folder
-            + "three_prime_for_secisearch.* "
-            + temp_folder
-            + "secisearch3"
-        )  # * is to remove secis files as well
+        for path in [
+            temp_folder + "three_prime_for_secisearch.*",
+            temp_folder + "secisearch3",
+        ]:  # * is to remove secis files as well
+            remove_files(path, recursive=True)
         if all_secises:
             return all_secises
         else:
@@ -10186,12 +11414,11 @@ def bSecisearch(p2g, silent=False, full=False):
     # cutting 3' UTR
     cds_seq = p2g.cds()
     prot_seq = p2g.protein()
-    sec_ugas = []  # pos codon based, 0 based
-    for codon_index in range(len(cds_seq) // 3):
-        if (
-            prot_seq[codon_index] == "U"
-        ):  # and cds_seq[codon_index*3:codon_index*3+3]   =='TGA'
-            sec_ugas.append(codon_index)
+    sec_ugas = [
+        codon_index
+        for codon_index in char_positions(prot_seq, "U")
+        if codon_index < len(cds_seq) // 3
+    ]  # pos codon based, 0 based
     if sec_ugas:
         ### cutting from 5 nts before the first uga, to 100 nts after the last one  (generally there's only one)
         pos_start_subsequence = sec_ugas[0] * 3 + 1 - 5  ## 1 based, nt based
@@ -10256,15 +11483,11 @@ def bSecisearch(p2g, silent=False, full=False):
             + subseq,
             target_temp_file,
         )
-        command = (
-            "bSeblastian.py "
-            + target_temp_file
-            + " -SS -infernal_no_mpi -c -temp "
-            + temp_folder
-            + "bsecisearch"
-        )
+        argv = ["bSeblastian.py", target_temp_file, "-SS", "-infernal_no_mpi", "-c"]
+        argv += ["-temp", temp_folder + "bsecisearch"]
+        command = join(argv, " ")
         try:
-            b = bash(command)
+            b = run_tool(argv)
             assert not b[0]
         except:
             raise notracebackException(
@@ -10273,6 +11496,7 @@ def bSecisearch(p2g, silent=False, full=False):
                 + command
                 + " ; ERROR: "
                 + b[1]
+                + b[2]
             )
         # raw_input('...'+temp_folder)
         bsecis_out_file = temp_folder + "sequence_for_bsecisearch.output.all_secis"
@@ -10294,13 +11518,11 @@ def bSecisearch(p2g, silent=False, full=False):
                         "bSeblastian found a bacterial SECIS for " + p2g.output_id(), 1
                     )
                 # all_euk_secises[secis_element_index].parent=p2g
-        bbash(
-            "rm -r "
-            + temp_folder
-            + "sequence_for_bsecisearch.* "
-            + temp_folder
-            + "bsecisearch"
-        )  # * is to remove secis files as well
+        for path in [
+            temp_folder + "sequence_for_bsecisearch.*",
+            temp_folder + "bsecisearch",
+        ]:  # * is to remove secis files as well
+            remove_files(path, recursive=True)
         if all_secises:
             return all_secises
         else:
@@ -0,0 +1,687 @@
+#!/usr/bin/env python
+import random, shutil, time, timeit
+from .MMlib3 import *
+from .selenoprofiles4 import blasthit, parse_blast, selenoprofiles_install_dir
+
+help_msg = """selenoprofiles benchmark: micro-benchmark of the sequence kernels of selenoprofiles (translation, reverse complement, codon scanning), of its blast parser, of its fasta reader and of its clustering of overlapping genes, compared with the implementations they replaced.
+
+Usage:   selenoprofiles benchmark [-n 3000] [-r 200] [-code 1] [-seed 1] [-blast_hits 2500] [-fasta_mb 200] [-intervals 100000]
+
+Random sequences are generated and processed by each pair of implementations: their outputs are checked to be identical, and the average time per call is reported.
+Then, a random blast report is parsed natively and through blaster_parser.awk, as done before.
+Then, fasta files with a single random chromosome are written in the temporary folder and read with each fasta reader.
+Last, random genes are clustered by overlap of their exons (gene_clusters), and compared with the clusters obtained from all overlapping pairs as before (through bedtools intersect, if installed).
+
+-n      length of the random nucleotide sequences (in nucleotides). Default: 3000
+-r      number of calls timed for each implementation. Default: 200
+-code   genetic code used for translation (NCBI numbering, see selenoprofiles -genetic_code). Default: 1
+-seed   seed of the random generator. Default: 1
+-blast_hits   number of HSPs in the blast report (tblastn pairwise output); 0 to skip this test. Default: 2500 (as max_blast_hits)
+-fasta_mb   length of the chromosome read by the fasta readers (in megabases); 0 to skip this test. Default: 200
+-fasta_reference_mb   length of the shorter chromosome (in megabases) used to compare the fasta readers with the character by character parser, whose time grows quadratically. Default: 2
+-intervals   number of exons of the random genes clustered by overlap; 0 to skip this test. Default: 100000
+-temp   parent of the temporary folder. Default: /tmp/
+"""
+
+def_opt = {
+    "n": 3000,
+    "r": 200,
+    "code": 1,
+    "seed": 1,
+    "blast_hits": 2500,
+    "fasta_mb": 200,
+    "fasta_reference_mb": 2,
+    "intervals": 100000,
+    "temp": "/tmp/",
+    "cmd": "benchmark",
+}
+
+##### reference implementations: the functions as they were before the sequence kernels of MMlib
+
+
+def reference_transl(cds_seq, include_selenocysteine=False, gaps_to=None, code=1):
+    out = ""
+    i = 0
+    codon_table = genetic_codes[code]
+    while i < len(cds_seq):
+        codon = replace_chars(upper(cds_seq[i : i + 3]), "U", "T")
+        if include_selenocysteine and codon == "TGA":
+            out += "U"
+        elif gaps_to and codon == "---":
+            out += gaps_to
+        elif codon in codon_table:
+            out += codon_table[codon]
+        else:
+            out += "X"
+        i += 3
+    return out
+
+
+def reference_retrotransl(aa_seq, gaps_to=""):
+    out = ""
+    if len(gaps_to) == 1:
+        gaps_to *= 3
+    for aa in aa_seq:
+        aa = upper(aa)
+        if gaps_to and aa == "-":
+            out += gaps_to
+        elif aa in retrotrans:
+            codon = retrotrans[aa]
+            if type(codon) == list:
+                codon = codon[0]
+            out += codon
+        else:
+            out += "NNN"
+    return out
+
+
+def reference_reverse_complement(seq):
+    reverse_complement_diz = {
+        "A": "T",
+        "T": "A",
+        "G": "C",
+        "C": "G",
+        "N": "N",
+        "X": "X",
+        "a": "t",
+        "t": "a",
+        "g": "c",
+        "c": "g",
+    }
+    out = ""
+    for c in seq[::-1]:
+        out += reverse_complement_diz.get(c, c)
+    return out
+
+
+def reference_stop_positions(protein_seq):
+    return [pos for pos in range(len(protein_seq)) if protein_seq[pos] in "*"]
+
+
+def reference_codon_scan(seq, start, stops, allowed_letters="ACGT"):
+    n_codons = 0
+    while True:
+        codon = seq[start + 3 * n_codons : start + 3 * n_codons + 3]
+        if not all([c in allowed_letters for c in codon]):
+            return [n_codons, "invalid"]
+        if len(codon) != 3:
+            return [n_codons, "end"]
+        if codon in stops:
+            return [n_codons, "stop"]
+        n_codons += 1
+
+
+def reference_replace_chars(astring, chars_list, replace_to_this=""):
+    return "".join([c if not c in chars_list else replace_to_this for c in astring])
+
+
+def reference_parse_fasta(filename):
+    """The parser of fasta files of MMlib (parse_next of parser class), reading each line and removing whitespace character by character"""
+    fh = open(filename)
+    last_line = fh.readline()
+    while last_line:
+        title = del_white(last_line[1:-1])
+        seq = ""
+        last_line = fh.readline()
+        while last_line and last_line[0] != ">":
+            seq += reference_replace_chars(last_line, " \n\r\t", "")
+            last_line = fh.readline()
+        yield title, seq
+    fh.close()
+
+
+def biopython_parse_fasta(filename):
+    """The fasta parser of Biopython, previously used by parse_fasta"""
+    from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+    with open(filename) as fh:
+        for title, seq in SimpleFastaParser(fh):
+            yield title, seq
+
+
+def reference_parse_blast(blast_file):
+    """The blast parser of selenoprofiles before native parsing: the blast output is piped through blaster_parser.awk, and each line of its output is loaded as a blasthit"""
+    awk_exec = shutil.which("gawk") or shutil.which("awk")
+    blaster_pipe = bash_pipe(
+        awk_exec
+        + " -f "
+        + selenoprofiles_install_dir
+        + "/blaster_parser.awk "
+        + blast_file,
+        return_popen=1,
+    )
+    hits = []
+    for line in blaster_pipe.stdout:
+        g = blasthit()
+        g.load(line)
+        hits.append(g)
+    blaster_pipe.wait()
+    return hits
+
+
+def write_random_blast_report(blast_file, n_hsps, n_targets=200, query_length=300):
+    """Writes a random tblastn report in the pairwise output format of blastall, with n_hsps HSPs of a single query distributed on n_targets target sequences"""
+    aa_letters = "ACDEFGHIKLMNPQRSTVWY"
+    fh = open(blast_file, "w")
+    fh.write(
+        "TBLASTN 2.2.26 [Sep-21-2011]\n\n\nReference: Altschul, Stephen F., Thomas L. Madden, Alejandro A. Schaffer,\nJinghui Zhang, Zheng Zhang, Webb Miller, and David J. Lipman (1997),\n\n"
+    )
+    fh.write(
+        "Query= BLAST_QUERY_1 random query\n         ("
+        + str(query_length)
+        + " letters)\n\nDatabase: genome.fa\n           "
+        + str(n_targets)
+        + " sequences; 100,000,000 total letters\n\nSearching..................................................done\n\n"
+    )
+    hsps_per_target = [n_hsps // n_targets] * n_targets
+    for target_index in range(n_hsps % n_targets):
+        hsps_per_target[target_index] += 1
+    for target_index, n_target_hsps in enumerate(hsps_per_target):
+        if not n_target_hsps:
+            continue
+        fh.write(
+            ">chr"
+            + str(target_index + 1)
+            + " random target sequence\n          Length = 500000\n\n"
+        )
+        for hsp_index in range(n_target_hsps):
+            ali_length = random.randint(20, 150)
+            query_start = random.randint(1, query_length - ali_length)
+            strand = random.choice("+-")
+            target_start = random.randint(3 * ali_length, 500000 - 3 * ali_length)
+            query_seq = join(random.choices(aa_letters + "-", k=ali_length), "")
+            target_seq = join(random.choices(aa_letters + "*-", k=ali_length), "")
+            fh.write(
+                " Score = %.1f bits (%d), Expect = %se-%02d\n Identities = 20/%d (40%%), Positives = 30/%d (60%%)\n Frame = %s%d\n\n"
+                % (
+                    random.uniform(20, 200),
+                    random.randint(50, 500),
+                    random.choice(["1.0", "2.5", "7.3"]),
+                    random.randint(1, 99),
+                    ali_length,
+                    ali_length,
+                    strand,
+                    random.randint(1, 3),
+                )
+            )
+            query_pos, target_pos = query_start, target_start
+            for block_start in range(0, ali_length, 60):
+                query_block = query_seq[block_start : block_start + 60]
+                target_block = target_seq[block_start : block_start + 60]
+                query_end = query_pos + len(query_block) - 1
+                if strand == "+":
+                    target_end = target_pos + 3 * len(target_block) - 1
+                else:
+                    target_end = target_pos - 3 * len(target_block) + 1
+                fh.write(
+                    "Query: "
+                    + str(query_pos).ljust(6)
+                    + query_block
+                    + " "
+                    + str(query_end)
+                    + "\n             "
+                    + query_block
+                    + "\nSbjct: "
+                    + str(target_pos).ljust(6)
+                    + target_block
+                    + " "
+                    + str(target_end)
+                    + "\n\n"
+                )
+                query_pos = query_end + 1
+                target_pos = target_end + (1 if strand == "+" else -1)
+            fh.write("\n")
+    fh.write(
+        "  Database: genome.fa\n    Posted date:  Jan 1, 2020  0:00 AM\n  Number of letters in database: 100,000,000\n  Number of sequences in database:  "
+        + str(n_targets)
+        + "\n\nLambda     K      H\n   0.318    0.134    0.401\n\nGapped\nLambda     K      H\n   0.267   0.0410    0.140\n\n\nMatrix: BLOSUM62\nGap Penalties: Existence: 11, Extension: 1\n"
+    )
+    fh.close()
+
+
+def blasthit_fields(g):
+    """Returns the fields of a blasthit compared between blast parsers"""
+    return (
+        g.chromosome,
+        g.strand,
+        g.exons,
+        g.query.chromosome,
+        g.query.strand,
+        g.query.exons,
+        str(g.evalue),
+        g.bits,
+        g.alignment.seq_of("q"),
+        g.alignment.seq_of("t"),
+    )
+
+
+def time_blast_parsers(blast_file, n_hsps):
+    """Writes a random blast report with n_hsps HSPs to blast_file and parses it natively and through blaster_parser.awk; outputs are checked to be identical and the time of each parser is reported"""
+    write_random_blast_report(blast_file, n_hsps)
+    write("", 1)
+    write("Parsing a tblastn report with " + str(n_hsps) + " HSPs", 1)
+    write("parser".ljust(34) + "time (s)".rjust(14) + "speedup".rjust(10), 1)
+    parsers = [
+        ["parse_blast (native)", lambda: list(parse_blast(blast_file))],
+        [
+            "blaster_parser.awk + load_blaster",
+            lambda: reference_parse_blast(blast_file),
+        ],
+    ]
+    outputs, times = [], []
+    for name, blast_parser in parsers:
+        start_time = time.time()
+        outputs.append([blasthit_fields(g) for g in blast_parser()])
+        times.append(time.time() - start_time)
+    if outputs[0] != outputs[1] or len(outputs[0]) != n_hsps:
+        raise Exception(
+            "selenoprofiles benchmark ERROR the native blast parser and blaster_parser.awk give different results"
+        )
+    for (name, blast_parser), seconds in zip(parsers, times):
+        write(
+            name.ljust(34)
+            + ("%.3f" % seconds).rjust(14)
+            + ("%.1fx" % (times[-1] / seconds)).rjust(10),
+            1,
+        )
+    check_tabular_blast_parser(blast_file + ".tab", list(parse_blast(blast_file)))
+
+
+def tabular_blast_line(g):
+    """Returns the line of tabular blast output (-m 8) of blasthit g"""
+    target_start, target_end = g.boundaries()
+    if g.strand == "-":
+        target_start, target_end = target_end, target_start
+    query_start, query_end = g.query.boundaries()
+    return join(
+        [g.query.chromosome, g.chromosome, "100.00", str(len(g.query)), "0", "0"]
+        + [str(query_start), str(query_end), str(target_start), str(target_end)]
+        + [str(g.evalue), str(g.bits)],
+        "\t",
+    )
+
+
+def check_tabular_blast_parser(blast_file, blast_hits):
+    """Writes blast_hits in tabular blast output with comment lines (-m 9), followed by a query without hits, and checks that parse_blast reads them back; then checks that a report with no hits at all gives no blasthits"""
+    comment_lines = [
+        "# TBLASTN 2.2.26 [Sep-21-2011]",
+        "# Query: BLAST_QUERY",
+        "# Database: target.fa",
+    ]
+    with open(blast_file, "w") as fh:
+        fh.write(join(comment_lines, "\n") + "\n")
+        fh.write(
+            "# Fields: Query id, Subject id, % identity, alignment length, mismatches, gap openings, q. start, q. end, s. start, s. end, e-value, bit score\n"
+        )
+        for g in blast_hits:
+            fh.write(tabular_blast_line(g) + "\n")
+        fh.write(join(comment_lines, "\n") + "\n# BLAST processed 2 queries\n")
+    tab_fields = lambda g: (
+        g.chromosome,
+        g.strand,
+        g.exons,
+        g.query.chromosome,
+        g.query.exons,
+        str(g.evalue),
+        g.bits,
+    )
+    if [tab_fields(g) for g in parse_blast(blast_file)] != [
+        tab_fields(g) for g in blast_hits
+    ]:
+        raise Exception(
+            "selenoprofiles benchmark ERROR parse_blast does not read back the tabular blast output (-m 9)"
+        )
+    with open(blast_file, "w") as fh:
+        fh.write(join(comment_lines, "\n") + "\n# BLAST processed 1 queries\n")
+    if list(parse_blast(blast_file)):
+        raise Exception(
+            "selenoprofiles benchmark ERROR parse_blast returns blast hits for a tabular blast output (-m 9) with no hits"
+        )
+    write("Tabular blast output (-m 9) read back by parse_blast: OK", 1)
+
+
+def write_random_chromosome(fasta_file, length, char_per_line=60):
+    """Writes a fasta file with a single random sequence of this length, in lines of char_per_line characters. To be fast, the sequence is built from copies of a random block of 1 Mb, each shifted by a random offset"""
+    block = join(random.choices("ACGT", k=1000000), "")
+    with open(fasta_file, "w") as fh:
+        fh.write(">chr_benchmark random sequence\n")
+        line_seq = ""
+        while length > 0:
+            offset = random.randint(0, len(block))
+            new_seq = (block[offset:] + block[:offset])[:length]
+            length -= len(new_seq)
+            chunk = line_seq + new_seq
+            full_lines = len(chunk) // char_per_line * char_per_line
+            fh.write(
+                join(
+                    [
+                        chunk[i : i + char_per_line] + "\n"
+                        for i in range(0, full_lines, char_per_line)
+                    ],
+                    "",
+                )
+            )
+            line_seq = chunk[full_lines:]
+        if line_seq:
+            fh.write(line_seq + "\n")
+
+
+def time_fasta_readers(fasta_file, megabases, readers):
+    """Writes a random chromosome of this length (in megabases) to fasta_file and reads it with each of the readers, given as a list of [name, function]. Outputs are checked to be identical, and the time of each reader is reported, together with its speedup over the last one"""
+    fasta_length = int(float(megabases) * 1000000)
+    write_random_chromosome(fasta_file, fasta_length)
+    write("", 1)
+    write(
+        "Reading a fasta file with one sequence of " + str(fasta_length) + " nt",
+        1,
+    )
+    write("reader".ljust(34) + "time (s)".rjust(14) + "speedup".rjust(10), 1)
+    expected_output = None
+    times = []
+    for name, reader in readers:
+        start_time = time.time()
+        output = reader()
+        times.append(time.time() - start_time)
+        if expected_output is None:
+            expected_output = output
+        elif output != expected_output:
+            raise Exception(
+                "selenoprofiles benchmark ERROR the output of this fasta reader differs from read_fasta: "
+                + name
+            )
+        del output
+    for (name, reader), seconds in zip(readers, times):
+        write(
+            name.ljust(34)
+            + ("%.2f" % seconds).rjust(14)
+            + ("%.1fx" % (times[-1] / seconds)).rjust(10),
+            1,
+        )
+
+
+def reference_gene_clusters(gene_list, overlapping_pairs):
+    """The merging of clusters of gene_clusters before the sweep line: overlapping_pairs yields the pairs of indexes (as strings) of genes of gene_list with overlapping exons, as read from the output of bedtools_intersect"""
+    geneid2cluster_index = {}
+    cluster_index = 1
+    cluster_index2geneids = {}
+    for id_left, id_right in overlapping_pairs:
+        if id_left == id_right:
+            continue
+        if not id_left in geneid2cluster_index and not id_right in geneid2cluster_index:
+            cluster_index2geneids[cluster_index] = [id_left, id_right]
+            geneid2cluster_index[id_left] = cluster_index
+            geneid2cluster_index[id_right] = cluster_index
+            cluster_index += 1
+        elif not id_right in geneid2cluster_index:
+            cluster_index2geneids[geneid2cluster_index[id_left]].append(id_right)
+            geneid2cluster_index[id_right] = geneid2cluster_index[id_left]
+        elif not id_left in geneid2cluster_index:
+            cluster_index2geneids[geneid2cluster_index[id_right]].append(id_left)
+            geneid2cluster_index[id_left] = geneid2cluster_index[id_right]
+        elif geneid2cluster_index[id_left] != geneid2cluster_index[id_right]:
+            if len(cluster_index2geneids[geneid2cluster_index[id_right]]) > len(
+                cluster_index2geneids[geneid2cluster_index[id_left]]
+            ):
+                id_left, id_right = id_right, id_left
+            cluster_index_to_remove = geneid2cluster_index[id_right]
+            for gid in cluster_index2geneids[cluster_index_to_remove]:
+                geneid2cluster_index[gid] = geneid2cluster_index[id_left]
+            cluster_index2geneids[geneid2cluster_index[id_left]].extend(
+                cluster_index2geneids[cluster_index_to_remove]
+            )
+            del cluster_index2geneids[cluster_index_to_remove]
+    gene2cluster, cluster2genes = {}, {}
+    for g_index, g in enumerate(gene_list):
+        if str(g_index) in geneid2cluster_index:
+            gene2cluster[g] = geneid2cluster_index[str(g_index)]
+        else:
+            gene2cluster[g] = cluster_index
+            cluster_index += 1
+        cluster2genes.setdefault(gene2cluster[g], []).append(g)
+    return gene2cluster, cluster2genes
+
+
+def bedtools_overlapping_pairs(gene_list, strand=True):
+    """Yields the pairs of indexes of genes of gene_list with overlapping exons, computed all against all by bedtools intersect"""
+    bp = bedtools_intersect(gene_list, strand=strand)
+    for line in bp.stdout:
+        splt = line.rstrip().split("\t")
+        yield splt[3], splt[9] if strand else splt[7]
+    bp.wait()
+
+
+def scan_overlapping_pairs(gene_list, strand=True):
+    """Yields the same pairs as bedtools_overlapping_pairs without running bedtools: for each exon, the exons sorted after it are scanned until one starts after its end"""
+    exons = sorted(
+        [
+            ((g.chromosome, g.strand if strand else None), start, end, str(g_index))
+            for g_index, g in enumerate(gene_list)
+            for start, end in g.exons
+        ]
+    )
+    for index, (key, start, end, g_id) in enumerate(exons):
+        yield g_id, g_id
+        other_index = index + 1
+        while (
+            other_index < len(exons)
+            and exons[other_index][0] == key
+            and exons[other_index][1] < end
+        ):
+            yield g_id, exons[other_index][3]
+            other_index += 1
+
+
+def random_genes(n_exons, n_chromosomes=50, chromosome_length=10000000):
+    """Returns a list of random genes with n_exons exons in total (1 to 3 per gene), on both strands of n_chromosomes chromosomes"""
+    genes = []
+    while n_exons > 0:
+        g = gene(
+            chromosome="chr" + str(random.randint(1, n_chromosomes)),
+            strand=random.choice("+-"),
+        )
+        position = random.randint(1, chromosome_length)
+        for exon_index in range(min(n_exons, random.randint(1, 3))):
+            exon_length = random.randint(100, 1000)
+            g.add_exon(position, position + exon_length - 1)
+            position += exon_length + random.randint(50, 5000)
+            n_exons -= 1
+        g.id = "gene" + str(len(genes) + 1)
+        genes.append(g)
+    return genes
+
+
+def cluster_partition(gene_list, cluster2genes):
+    """Returns the clusters as a set of frozensets of indexes of genes in gene_list, to compare clusters regardless of their numbering"""
+    gene_index = {g: g_index for g_index, g in enumerate(gene_list)}
+    return set(
+        [frozenset([gene_index[g] for g in genes]) for genes in cluster2genes.values()]
+    )
+
+
+def time_gene_clusters(n_exons):
+    """Clusters random genes with n_exons exons in total with gene_clusters, and with the cluster merging used before on the overlapping pairs computed by bedtools (if installed) or by a scan of sorted exons. Clusters are checked to be identical, and the time of each engine is reported"""
+    gene_list = random_genes(n_exons)
+    write("", 1)
+    write(
+        "Clustering "
+        + str(len(gene_list))
+        + " random genes with "
+        + str(n_exons)
+        + " exons by overlap",
+        1,
+    )
+    engines = [
+        ["gene_clusters (sweep line)", lambda: gene_clusters(gene_list)[1]],
+        [
+            "pairs scan + cluster merging",
+            lambda: reference_gene_clusters(
+                gene_list, scan_overlapping_pairs(gene_list)
+            )[1],
+        ],
+    ]
+    if shutil.which("bedtools"):
+        engines.append(
+            [
+                "bedtools intersect + merging",
+                lambda: reference_gene_clusters(
+                    gene_list, bedtools_overlapping_pairs(gene_list)
+                )[1],
+            ]
+        )
+    else:
+        write("(bedtools not found: bedtools intersect is not timed)", 1)
+    write("engine".ljust(34) + "time (s)".rjust(14) + "speedup".rjust(10), 1)
+    expected_partition = None
+    times = []
+    for name, engine in engines:
+        start_time = time.time()
+        cluster2genes = engine()
+        times.append(time.time() - start_time)
+        partition = cluster_partition(gene_list, cluster2genes)
+        if expected_partition is None:
+            expected_partition = partition
+        elif partition != expected_partition:
+            raise Exception(
+                "selenoprofiles benchmark ERROR the clusters of this engine differ from gene_clusters: "
+                + name
+            )
+    for (name, engine), seconds in zip(engines, times):
+        write(
+            name.ljust(34)
+            + ("%.2f" % seconds).rjust(14)
+            + ("%.1fx" % (times[-1] / seconds)).rjust(10),
+            1,
+        )
+    write(
+        "clusters: "
+        + str(len(expected_partition))
+        + "   largest: "
+        + str(max([len(c) for c in expected_partition]))
+        + " genes",
+        1,
+    )
+
+
+#########################################################
+###### start main program function
+
+
+def main(args={}):
+    opt = args
+    random.seed(int(opt["seed"]))
+    seq_length, repetitions, code = int(opt["n"]), int(opt["r"]), int(opt["code"])
+    stops = stop_codons_of_code(code)
+    sequences = [
+        join([random.choice("ACGT") for i in range(seq_length)], "") for j in range(20)
+    ]
+    non_stop_codons = [
+        codon
+        for codon in get_codon_table(code)
+        if len(codon) == 3 and not codon in stops and not "-" in codon
+    ]
+    orf_sequences = [  # long open reading frames, ending with a stop: the case of extend_orf
+        join([random.choice(non_stop_codons) for i in range(seq_length // 3)], "")
+        + sorted(stops)[0]
+        for j in range(20)
+    ]
+    proteins = [reference_transl(s, code=code) for s in sequences]
+
+    tests = [
+        # name, kernel, reference, inputs
+        [
+            "transl",
+            lambda s: transl(s, code=code),
+            lambda s: reference_transl(s, code=code),
+            sequences,
+        ],
+        [
+            "transl (selenocysteine)",
+            lambda s: transl(s, include_selenocysteine=True, code=code),
+            lambda s: reference_transl(s, include_selenocysteine=True, code=code),
+            sequences,
+        ],
+        ["retrotransl", retrotransl, reference_retrotransl, proteins],
+        [
+            "reverse_complement",
+            reverse_complement,
+            reference_reverse_complement,
+            sequences,
+        ],
+        [
+            "stop positions (char_positions)",
+            lambda p: char_positions(p, "*"),
+            reference_stop_positions,
+            proteins,
+        ],
+        [
+            "codon_scan",
+            lambda s: codon_scan(s, 0, stops),
+            lambda s: reference_codon_scan(s, 0, stops),
+            orf_sequences,
+        ],
+    ]
+    write(
+        "Sequences of "
+        + str(seq_length)
+        + " nt; genetic code "
+        + str(code)
+        + "; "
+        + str(repetitions)
+        + " calls timed for each function",
+        1,
+    )
+    write(
+        "function".ljust(34)
+        + "kernel (us)".rjust(14)
+        + "reference (us)".rjust(16)
+        + "speedup".rjust(10),
+        1,
+    )
+    for name, kernel, reference, inputs in tests:
+        for x in inputs:
+            if kernel(x) != reference(x):
+                raise Exception(
+                    "selenoprofiles benchmark ERROR the output of the kernel differs from the reference for: "
+                    + name
+                )
+        times = []
+        for function in [kernel, reference]:
+            input_cycle = [inputs[i % len(inputs)] for i in range(repetitions)]
+            times.append(
+                timeit.timeit(lambda: [function(x) for x in input_cycle], number=1)
+                / repetitions
+                * 1e6
+            )
+        write(
+            name.ljust(34)
+            + ("%.1f" % times[0]).rjust(14)
+            + ("%.1f" % times[1]).rjust(16)
+            + ("%.1fx" % (times[1] / times[0])).rjust(10),
+            1,
+        )
+
+    temp_folder = Folder(random_folder(opt["temp"]))
+    test_writeable_folder(temp_folder, "temp_folder")
+    set_MMlib_var("temp_folder", temp_folder)
+    fasta_file = temp_folder + "chromosome.fa"
+    readers = [
+        # name, function returning a list of (title, sequence)
+        ["read_fasta (memory-mapped)", lambda: list(read_fasta(fasta_file))],
+        ["read_fasta (filehandler)", lambda: list(read_fasta(open(fasta_file)))],
+        [
+            "Biopython SimpleFastaParser",
+            lambda: list(biopython_parse_fasta(fasta_file)),
+        ],
+        ["reference parser", lambda: list(reference_parse_fasta(fasta_file))],
+    ]
+    try:
+        if int(opt["blast_hits"]):
+            time_blast_parsers(temp_folder + "blast_report", int(opt["blast_hits"]))
+        if float(opt["fasta_mb"]):
+            # the reference parser is quadratic with the sequence length: it is timed only on the shorter chromosome
+            time_fasta_readers(fasta_file, opt["fasta_mb"], readers[:-1])
+            time_fasta_readers(fasta_file, opt["fasta_reference_mb"], readers)
+        if int(opt["intervals"]):
+            time_gene_clusters(int(opt["intervals"]))
+    finally:
+        remove_files(temp_folder, recursive=True)
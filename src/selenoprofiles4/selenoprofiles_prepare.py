@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+import os, shutil, stat
+from .MMlib3 import *
+from ._version import __version__
+from .selenoprofiles4 import (
+    target_bundle_manifest,
+    target_bundle_format,
+    is_target_bundle,
+    load_target_bundle,
+    target_file_id,
+    notracebackException,
+)
+from .selenoprofiles_shard import target_name_for_file
+
+help_msg = """selenoprofiles prepare: build a target bundle, i.e. a read-only folder with everything selenoprofiles needs to search a target:
+the target file itself, its index with sequence lengths and checksum, its blast database and optionally its .2bit version.
+Searching a bundle requires no preparation at all, and a bundle can be placed on shared storage and used by many runs at once (e.g. searching new profiles on the same genomes).
+
+Usage:   selenoprofiles prepare -t genome.fa [-d bundles_folder] [-twobit]
+   then search the bundle in place of the target file:
+         selenoprofiles -t bundles_folder/genome.bundle -o output_folder -s species  ...
+
+The bundle is created as [target name].bundle inside the -d folder. Its files are write-protected.
+Output folders and species of runs on a bundle are the same as those of runs on the original target file.
+A bundle is refused if its target file is modified after building it; if the original target changes, remove the bundle (chmod -R u+w first) and build it again.
+
+-t      target file (fasta, possibly compressed with bgzip) to be bundled
+-d      folder where the bundle is created. Default: current directory
+-name   name of the target; it defaults to the target file name (see selenoprofiles -h full)
+-twobit also store the .2bit version of the target, used by selenoprofiles runs with option -twobit
+-link   hard link the target file into the bundle instead of copying it, when they are in the same filesystem. The target file is not write-protected in this case
+-temp   parent of the temporary folder. Default: /tmp/
+"""
+
+def_opt = {
+    "t": "",
+    "d": "./",
+    "name": "",
+    "twobit": False,
+    "link": False,
+    "temp": "/tmp/",
+    "cmd": "prepare",
+}
+
+
+def copy_target(target_file, bundle_target_file, hard_link=False):
+    """Places the target file in the bundle, preserving its modification time. Returns True if it was hard linked, False if it was copied"""
+    if hard_link:
+        try:
+            os.link(target_file, bundle_target_file)
+            return True
+        except OSError:
+            printerr(
+                "WARNING target file cannot be hard linked into the bundle; copying it",
+                1,
+            )
+    shutil.copy2(target_file, bundle_target_file)
+    return False
+
+
+def write_protect(bundle_folder, skip_files=[]):
+    """Removes write permissions from all files of the bundle (except those in skip_files) and from the bundle folder itself"""
+    not_writeable = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    for filename in os.listdir(bundle_folder):
+        if filename in skip_files:
+            continue
+        file_mode = os.stat(bundle_folder + filename).st_mode
+        os.chmod(bundle_folder + filename, file_mode & not_writeable)
+    os.chmod(bundle_folder, os.stat(bundle_folder).st_mode & not_writeable)
+
+
+def build_bundle(
+    target_file, bundle_folder, target_name, twobit=False, hard_link=False
+):
+    """Builds the bundle of target_file in bundle_folder, which must not exist. Files are written to a separate folder, renamed to bundle_folder only when complete, so that an interrupted build never leaves a partial bundle.
+    Returns the indexed_fasta of the target file in the bundle (see MMlib)"""
+    building_folder = bundle_folder.rstrip("/") + ".building." + str(os.getpid()) + "/"
+    os.mkdir(building_folder)
+    bundle_target_file = building_folder + base_filename(target_file)
+
+    write("Placing target file in the bundle ... ", 1)
+    is_hard_linked = copy_target(target_file, bundle_target_file, hard_link)
+    steps_done = []
+    write("Indexing target file ... ", 1)
+    target_fasta = indexed_fasta(bundle_target_file)
+    steps_done.append("index")
+    if twobit:
+        write("Writing 2bit version of target file ... ", 1)
+        write_twobit(bundle_target_file, bundle_target_file + ".2bit")
+        steps_done.append("twobit")
+    write("Formatting target file with formatdb ... ", 1)
+    formatdb(bundle_target_file, is_protein=False, silent=True)
+    steps_done.append("formatdb")
+
+    # manifest of preparation steps, read by selenoprofiles (see prepare_target)
+    with open(bundle_target_file + ".prepared", "w") as manifest_fh:
+        for step in steps_done:
+            manifest_fh.write(
+                join([step] + target_file_id(bundle_target_file), " ") + "\n"
+            )
+    size, mtime_ns = target_file_id(bundle_target_file)
+    bundle_fields = [
+        ["format", target_bundle_format],
+        ["selenoprofiles_version", __version__],
+        ["name", target_name],
+        ["target", base_filename(target_file)],
+        ["source", target_file],
+        ["size", size],
+        ["mtime_ns", mtime_ns],
+        ["md5", target_fasta.checksum],
+        ["sequences", str(len(target_fasta.names))],
+        [
+            "total_length",
+            str(sum([target_fasta.index[name][0] for name in target_fasta.names])),
+        ],
+        ["steps", join(steps_done, ",")],
+        ["date", date_string()],
+    ]
+    with open(building_folder + target_bundle_manifest, "w") as bundle_fh:
+        for key, value in bundle_fields:
+            bundle_fh.write(key + "\t" + value + "\n")
+
+    os.rename(building_folder, bundle_folder)
+    write_protect(
+        bundle_folder, skip_files=[base_filename(target_file)] if is_hard_linked else []
+    )
+    return target_fasta
+
+
+#########################################################
+###### start main program function
+
+
+def main(args={}):
+    opt = args
+    if not opt["t"]:
+        print(help_msg)
+        sys.exit(1)
+    target_file = abspath(opt["t"])
+    check_file_presence(target_file, "target file", notracebackException)
+    target_name = target_name_for_file(target_file, opt["name"])
+    bundle_folder = abspath(Folder(opt["d"])) + "/" + target_name + ".bundle/"
+
+    if is_target_bundle(bundle_folder):
+        target_bundle = load_target_bundle(bundle_folder)
+        if target_bundle["source"] == target_file and target_file_id(target_file) == [
+            target_bundle["size"],
+            target_bundle["mtime_ns"],
+        ]:
+            write("Bundle is already up to date: " + bundle_folder, 1)
+            return
+        raise notracebackException(
+            "selenoprofiles prepare ERROR a bundle built from another version of the target already exists: "
+            + bundle_folder
+            + " ; remove it or use a different folder with option -d"
+        )
+    if os.path.lexists(bundle_folder.rstrip("/")):
+        raise notracebackException(
+            "selenoprofiles prepare ERROR "
+            + bundle_folder
+            + " exists but it is not a target bundle; remove it or use a different folder with option -d"
+        )
+
+    temp_folder = Folder(random_folder(opt["temp"]))
+    test_writeable_folder(temp_folder, "temp_folder")
+    set_MMlib_var("temp_folder", temp_folder)
+    try:
+        target_fasta = build_bundle(
+            target_file,
+            bundle_folder,
+            target_name,
+            twobit=opt["twobit"],
+            hard_link=opt["link"],
+        )
+    finally:
+        remove_files(temp_folder, recursive=True)
+    write(
+        "Bundle written to: "
+        + bundle_folder
+        + "   sequences: "
+        + str(len(target_fasta.names))
+        + "   md5: "
+        + target_fasta.checksum,
+        1,
+    )
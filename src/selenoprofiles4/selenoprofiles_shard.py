@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+import os, heapq, gzip
+from .MMlib3 import *
+from .selenoprofiles4 import (
+    selenoprofiles_db,
+    set_selenoprofiles_var,
+    mask_species,
+    unmask_species,
+    uniq_id_for_file,
+    notracebackException,
+)
+
+help_msg = """selenoprofiles shard: utility to split a large target into shards to be searched separately (e.g. on different nodes of a cluster), and to merge the results obtained on each shard.
+
+Usage:   selenoprofiles shard -t genome.fa -n 8 [-d shards_folder]
+   then run selenoprofiles on each shard target (e.g.  selenoprofiles -t shards_folder/genome.shard1.fa -o output_folder -s species  ...)
+   and finally:
+         selenoprofiles shard -t genome.fa -o output_folder -s species -merge output_folder/*.genome_shard*/results.sqlite
+
+Shards contain whole sequences (chromosomes or scaffolds) of the target, with their original titles:
+coordinates of predictions on shards are therefore identical to those on the original target.
+Sequences are distributed across shards to balance their total length.
+
+Merging copies the results stored in the results.sqlite database of each shard into the database of the original target,
+found in the usual location inside the output folder (i.e. as if selenoprofiles was run with -t genome.fa -o output_folder -s species).
+Predictions are renumbered, and the overlaps among results of different profiles are computed again (see selenoprofiles database -remove_redundancy).
+Then, running selenoprofiles on the original target with the same output folder and species loads results from the database,
+or you can get fast output with selenoprofiles database (run: selenoprofiles database -h)
+
+### Shard planning:
+-t      target file (fasta, possibly compressed with gzip or bgzip) to be split
+-n      number of shards. Default: 2
+-d      folder where shard fasta files are written. Default: current directory
+        A file named [target name].shards is also written here with the list of shards; it can be used as manifest for selenoprofiles -batch
+
+### Merging:
+-merge  results.sqlite files obtained by running selenoprofiles on each shard
+-t      original target file (fasta)
+-o      selenoprofiles output folder where results for the original target are stored
+-s      species of the original target (see selenoprofiles -h). If not provided, "unidentified" is used
+-name   name of the original target; it defaults to the target file name (see selenoprofiles -h full)
+"""
+
+def_opt = {
+    "t": "",
+    "n": 2,
+    "d": "./",
+    "merge": [],
+    "o": "",
+    "s": "",
+    "name": "",
+    "cmd": "shard",
+}
+
+
+def target_name_for_file(target_file, name=""):
+    """Returns the target name used by selenoprofiles for this target file, as in its load function"""
+    if name:
+        target_name = name
+    else:
+        target_name = base_filename(target_file)
+        if target_name.split(".")[-1] == "gz":
+            target_name = join(target_name.split(".")[:-1], ".")
+        if target_name.split(".")[-1] in ["fasta", "fa"]:
+            target_name = join(target_name.split(".")[:-1], ".")
+    return replace_chars(target_name, ".", "_")
+
+
+def open_target(target_file):
+    """Returns a text filehandler to read the target file, decompressing it if it is compressed with gzip or bgzip"""
+    if is_gzip_file(target_file):
+        return gzip.open(target_file, "rt")
+    return open(target_file)
+
+
+def sequence_lengths(target_file):
+    """Returns a list of [title line, length] for all sequences in the target fasta file, in order"""
+    lengths = []
+    for line in open_target(target_file):
+        if line.startswith(">"):
+            lengths.append([line, 0])
+        elif lengths:
+            lengths[-1][1] += len(line.rstrip())
+    return lengths
+
+
+def plan_shards(lengths, n_shards):
+    """Given a list of [title line, length] as returned by sequence_lengths, assigns each sequence to one of n_shards, balancing their total length (longest sequences are assigned first, each to the shard with smallest total length so far).
+    Returns a dictionary title line -> shard index (starting from 1)"""
+    shard_heap = [(0, shard_index) for shard_index in range(1, n_shards + 1)]
+    shard_of_title = {}
+    for title, length in sorted(lengths, key=lambda x: -x[1]):
+        total_length, shard_index = heapq.heappop(shard_heap)
+        shard_of_title[title] = shard_index
+        heapq.heappush(shard_heap, (total_length + length, shard_index))
+    return shard_of_title
+
+
+def write_shards(target_file, shard_of_title, shard_files):
+    """Reads the target fasta file and writes each sequence (unchanged) into the shard file it was assigned to. shard_files is a dictionary shard index -> file path"""
+    shard_handlers = {
+        shard_index: open(shard_files[shard_index], "w") for shard_index in shard_files
+    }
+    out_fh = None
+    for line in open_target(target_file):
+        if line.startswith(">"):
+            out_fh = shard_handlers[shard_of_title[line]]
+        if out_fh is not None:
+            out_fh.write(line)
+    for out_fh in shard_handlers.values():
+        out_fh.close()
+
+
+def merge_shard_databases(shard_db_files, merged_db):
+    """Adds the results of all shard databases to merged_db, renumbering them so that prediction indexes are unique for each profile.
+    Results of profiles found in any shard database replace those previously stored in merged_db. Interfamily overlap calls are dropped, and the profiles are marked as UNCHECKED-2 so that remove_redundancy can be run afterwards.
+    Returns the list of profiles merged"""
+    shard_dbs = [selenoprofiles_db(shard_db_file) for shard_db_file in shard_db_files]
+    profile_states = {}  # profile -> {shard db: state}
+    for shard_db in shard_dbs:
+        db_cursor = shard_db.cursor()
+        db_cursor.execute("SELECT profile, has_output FROM has_results_for_profile")
+        for profile_name, state in db_cursor.fetchall():
+            profile_states.setdefault(profile_name, {})[shard_db] = state
+
+    profiles_to_merge = []
+    for profile_name in sorted(profile_states):
+        completed_in = [
+            shard_db
+            for shard_db in profile_states[profile_name]
+            if not profile_states[profile_name][shard_db] in ["NO", "ONGOING"]
+        ]
+        if not completed_in:
+            continue
+        if len(completed_in) < len(shard_dbs):
+            missing_shards = [
+                shard_db_files[shard_index]
+                for shard_index, shard_db in enumerate(shard_dbs)
+                if not shard_db in completed_in
+            ]
+            raise notracebackException(
+                "selenoprofiles shard ERROR profile "
+                + profile_name
+                + " was not completed for shard(s): "
+                + join(missing_shards, " ")
+            )
+        profiles_to_merge.append(profile_name)
+
+    for profile_name in profiles_to_merge:
+        merged_db.clear_results(profile_name)
+        max_index = 0
+        n_results = 0
+        for shard_db in shard_dbs:
+            shard_db_cursor = shard_db.cursor()
+            index_offset = max_index
+            for r in shard_db.get_results(profile_name):
+                db_id, target_header, state = r[0], r[3], r[9]
+                pred_index, other_header_fields = target_header.split(" ", 1)
+                pred_index = int(pred_index) + index_offset
+                max_index = max(max_index, pred_index)
+                n_results += 1
+                state = state.split("_overlapping_")[0]
+                if state.startswith("redundant_"):
+                    state = "redundant_" + str(int(state.split("_")[1]) + index_offset)
+                result_id = merged_db.add_entry(
+                    "results",
+                    r[:3]
+                    + (str(pred_index) + " " + other_header_fields,)
+                    + r[4:9]
+                    + (state, r[10]),
+                    silent=True,
+                )
+                shard_db_cursor.execute(
+                    'SELECT * FROM features WHERE resultid =="' + str(db_id) + '"'
+                )
+                for f in shard_db_cursor.fetchall():
+                    merged_db.add_entry(
+                        "features", (f[0], result_id) + f[2:], silent=True
+                    )
+        merged_db.set_has_results_for_profile(profile_name, "UNCHECKED-2")
+        write(
+            "Merged profile "
+            + profile_name.ljust(30)
+            + " : "
+            + str(n_results)
+            + " results",
+            1,
+        )
+    merged_db.save()
+    for shard_db in shard_dbs:
+        shard_db.close()
+    return profiles_to_merge
+
+
+#########################################################
+###### start main program function
+
+
+def main(args={}):
+    opt = args
+    if not opt["t"]:
+        print(help_msg)
+        sys.exit(1)
+    target_file = abspath(opt["t"])
+    check_file_presence(target_file, "target file", notracebackException)
+    target_name = target_name_for_file(target_file, opt["name"])
+
+    if not opt["merge"]:
+        ### planning shards
+        n_shards = int(opt["n"])
+        lengths = sequence_lengths(target_file)
+        if not lengths:
+            raise notracebackException(
+                "selenoprofiles shard ERROR no sequences found in target file: "
+                + target_file
+            )
+        if n_shards > len(lengths):
+            printerr(
+                "WARNING target has only "
+                + str(len(lengths))
+                + " sequences; number of shards reduced to "
+                + str(len(lengths)),
+                1,
+            )
+            n_shards = len(lengths)
+        shards_folder = Folder(opt["d"])
+        shard_files = {
+            shard_index: shards_folder
+            + target_name
+            + ".shard"
+            + str(shard_index)
+            + ".fa"
+            for shard_index in range(1, n_shards + 1)
+        }
+        shard_of_title = plan_shards(lengths, n_shards)
+        write_shards(target_file, shard_of_title, shard_files)
+
+        shard_lengths = {shard_index: [0, 0] for shard_index in shard_files}
+        for title, length in lengths:
+            shard_lengths[shard_of_title[title]][0] += 1
+            shard_lengths[shard_of_title[title]][1] += length
+        shards_list_file = shards_folder + target_name + ".shards"
+        shards_list_fh = open(shards_list_file, "w")
+        for shard_index in sorted(shard_files):
+            shards_list_fh.write(abspath(shard_files[shard_index]) + "\n")
+            write(
+                shard_files[shard_index].ljust(50)
+                + " sequences: "
+                + str(shard_lengths[shard_index][0]).ljust(8)
+                + " total length: "
+                + str(shard_lengths[shard_index][1]),
+                1,
+            )
+        shards_list_fh.close()
+        write("List of shards written to: " + shards_list_file, 1)
+
+    else:
+        ### merging shard databases
+        if not opt["o"]:
+            raise notracebackException(
+                "selenoprofiles shard ERROR the output folder must be provided with option -o"
+            )
+        for shard_db_file in opt["merge"]:
+            check_file_presence(
+                shard_db_file, "shard database (results.sqlite)", notracebackException
+            )
+        target_species = opt["s"] if opt["s"] else "unidentified"
+        if "_" in target_species or "{ch" in target_species:
+            target_species = unmask_species(target_species)
+        if target_species == "unidentified":
+            target_name = uniq_id_for_file(target_file)
+        target_results_folder = Folder(
+            Folder(opt["o"]) + mask_species(target_species) + "." + target_name
+        )
+        results_db_file = target_results_folder + "results.sqlite"
+        set_selenoprofiles_var("max_attempts_database", 0)
+        merged_db = selenoprofiles_db(results_db_file)
+        if not merged_db.has_table("results"):
+            merged_db.initialise_db()
+            write("Initialising database: " + results_db_file, 1)
+        merged_db.update_to_last_version()
+        link_target_file = target_results_folder + "link_target.fa"
+        if not is_file(link_target_file):
+            if os.path.islink(link_target_file):
+                os.remove(link_target_file)
+            os.symlink(target_file, link_target_file)
+
+        profiles_merged = merge_shard_databases(opt["merge"], merged_db)
+        merged_db.close()
+        write(
+            "Merged "
+            + str(len(profiles_merged))
+            + " profiles from "
+            + str(len(opt["merge"]))
+            + " shard databases into "
+            + results_db_file,
+            1,
+        )
+
+        ### computing overlaps among profiles, through selenoprofiles database
+        from .selenoprofiles_database import (
+            main as run_database,
+            def_opt as def_opt_database,
+        )
+
+        db_opt = dict(def_opt_database)
+        db_opt["i"] = results_db_file
+        db_opt["remove_redundancy"] = 1
+        run_database(db_opt)